@@ -0,0 +1,507 @@
+"""
+Burst acquisition for the MPU6050 using its hardware FIFO.
+
+Instead of polling the data registers once per loop iteration, the sensor
+samples at a fixed output data rate (ODR) into its 1024 byte FIFO. The host
+drains the FIFO with bulk read_i2c_block_data transfers and decodes all
+samples at once into NumPy arrays.
+
+Sampler runs the drain loop of one sensor in its own thread and writes the
+raw records into a RingBuffer, so publishing never delays acquisition.
+
+FakeSMBus emulates the registers and FIFO of one or more MPU6050s so the
+engine can be run and benchmarked without hardware.
+
+The sensors are set up from an acquisition profile (PROFILES, profile()):
+
+    odr          output data rate in Hz, the nearest the divider allows
+    dlpf         DLPF_CFG of the digital low-pass filter, 0 (260 Hz, 8 kHz
+                 sample clock) to 6 (5 Hz)
+    accel_range  full scale in g: 2, 4, 8 or 16
+    gyro_range   full scale in deg/s: 250, 500, 1000 or 2000
+    channels     what goes into the FIFO: "accel" and optionally "temp"
+                 and "gyro", in the FIFO's order accel, temp, gyro
+
+The accelerometer itself updates at 1 kHz; above that the FIFO repeats its
+samples and only the gyroscope gains. Every channel adds to the bytes per
+sample the bus has to carry, bench-profiles.py finds the highest ODR it
+sustains for each profile.
+"""
+import math
+import os
+import threading
+import time
+import numpy as np
+
+# ===============================
+# MPU-6050 Registers (Register Map rev 4.2)
+# ===============================
+SMPLRT_DIV = 0x19
+MPU_CONFIG = 0x1A
+GYRO_CONFIG = 0x1B
+ACCEL_CONFIG = 0x1C
+FIFO_EN = 0x23
+INT_STATUS = 0x3A
+ACCEL_XOUT0 = 0x3B
+TEMP_OUT0 = 0x41
+GYRO_XOUT0 = 0x43
+USER_CTRL = 0x6A
+PWR_MGMT_1 = 0x6B
+FIFO_COUNTH = 0x72
+FIFO_R_W = 0x74
+WHO_AM_I = 0x75
+
+FIFO_EN_ACCEL = 0x08
+FIFO_EN_TEMP = 0x80
+FIFO_EN_GYRO = 0x70     # XG, YG and ZG
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RESET = 0x04
+INT_STATUS_FIFO_OFLOW = 0x10
+PWR_MGMT_1_SLEEP = 0x40
+
+FIFO_SIZE = 1024
+# FIFO bytes and bits of each channel, in FIFO order
+FIFO_CHANNELS = {"accel": (6, FIFO_EN_ACCEL), "temp": (2, FIFO_EN_TEMP), "gyro": (6, FIFO_EN_GYRO)}
+# SMBus block transfers are limited to 32 bytes, reads take whole samples of at most this
+SMBUS_BLOCK = 32
+# Timestamps are re-anchored to the read time once the continued timeline is
+# off by more than this many sample periods
+RESYNC_PERIODS = 50
+# Fraction of the timeline error corrected per read, tracks the sensor clock drift
+CLOCK_GAIN = 0.1
+
+GRAVITY_MS2 = 9.80665
+ACCEL_SCALE = {0x00: 16384.0, 0x08: 8192.0, 0x10: 4096.0, 0x18: 2048.0}     # counts per g
+GYRO_SCALE = {0x00: 131.0, 0x08: 65.5, 0x10: 32.8, 0x18: 16.4}             # counts per deg/s
+ACCEL_RANGES = {2: 0x00, 4: 0x08, 8: 0x10, 16: 0x18}
+GYRO_RANGES = {250: 0x00, 500: 0x08, 1000: 0x10, 2000: 0x18}
+DLPF_BANDWIDTH = {0: 260, 1: 184, 2: 94, 3: 44, 4: 21, 5: 10, 6: 5}        # Hz of the accelerometer
+TEMP_SCALE = 340.0      # counts per degree C, 0 counts are TEMP_OFFSET
+TEMP_OFFSET = 36.53
+
+PROFILES = {
+    # The kit's settings so far: 184 Hz bandwidth at 500 Hz, +-2 g
+    "default": {"odr": 500, "dlpf": 1, "accel_range": 2, "gyro_range": 250, "channels": ("accel",)},
+    # Machine vibration up to the accelerometer's 260 Hz bandwidth, room for impacts
+    "vibration": {"odr": 1000, "dlpf": 0, "accel_range": 4, "gyro_range": 250, "channels": ("accel",)},
+    # Hard impacts, with the temperature of the housing
+    "shock": {"odr": 1000, "dlpf": 0, "accel_range": 16, "gyro_range": 2000, "channels": ("accel", "temp")},
+    # Slow motion and orientation of the kit: every channel at 44 Hz bandwidth
+    "motion": {"odr": 200, "dlpf": 3, "accel_range": 4, "gyro_range": 500, "channels": ("accel", "temp", "gyro")},
+}
+
+
+def gyro_output_rate(dlpf):
+    """Internal sample clock in Hz for a DLPF_CFG setting."""
+    return 8000 if dlpf in (0, 7) else 1000
+
+
+def _range_of(ranges, code):
+    return next(r for r, c in ranges.items() if c == code)
+
+
+def profile(name, **changes):
+    """The acquisition profile PROFILES[name] as a dict with its "name", some settings changed."""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile {name!r}, expected one of {tuple(PROFILES)}")
+    return dict(PROFILES[name], name=name, **changes)
+
+
+class FifoSensor:
+    """One MPU6050 streaming accelerometer samples, optionally with temperature and gyroscope, through its FIFO.
+
+    Records are the int16 counts of the channels in FIFO order; columns
+    maps each channel to its slice of them.
+    """
+
+    def __init__(self, bus, address, odr=500, dlpf=1, accel_range=0x00, gyro_range=0x00, channels=("accel",)):
+        if "accel" not in channels or not set(channels) <= set(FIFO_CHANNELS):
+            raise ValueError(f"channels {channels!r} must include accel and be some of {tuple(FIFO_CHANNELS)}")
+        self.bus = bus
+        self.address = address
+        self.dlpf = dlpf
+        self.accel_range = accel_range
+        self.accel_scale = ACCEL_SCALE[accel_range]
+        self.gyro_range = gyro_range
+        self.gyro_scale = GYRO_SCALE[gyro_range]
+        self.divider = max(0, min(255, round(gyro_output_rate(dlpf) / odr) - 1))
+        self.odr = gyro_output_rate(dlpf) / (self.divider + 1)
+        self.period_ns = int(1e9 / self.odr)
+        self.channels = [c for c in FIFO_CHANNELS if c in channels]
+        self.fifo_enable = 0
+        self.columns = {}
+        self.sample_bytes = 0
+        for c in self.channels:
+            size, bit = FIFO_CHANNELS[c]
+            self.fifo_enable |= bit
+            self.columns[c] = slice(self.sample_bytes // 2, (self.sample_bytes + size) // 2)
+            self.sample_bytes += size
+        self.width = self.sample_bytes // 2
+        self.block_size = SMBUS_BLOCK // self.sample_bytes * self.sample_bytes
+        self.overruns = 0
+        self.samples = 0
+        self.last_t = None
+
+    @classmethod
+    def from_profile(cls, bus, address, profile):
+        return cls(bus, address, profile["odr"], profile["dlpf"], ACCEL_RANGES[profile["accel_range"]],
+                   GYRO_RANGES[profile["gyro_range"]], profile["channels"])
+
+    @property
+    def fifo_seconds(self):
+        """How long the FIFO takes to fill up, the longest the sensor may go undrained."""
+        return FIFO_SIZE // self.sample_bytes / self.odr
+
+    def settings(self):
+        """The settings the sensor runs with, as recorded with a session."""
+        return {"odr": self.odr, "dlpf": self.dlpf, "bandwidth_hz": DLPF_BANDWIDTH.get(self.dlpf),
+                "accel_range_g": _range_of(ACCEL_RANGES, self.accel_range),
+                "gyro_range_dps": _range_of(GYRO_RANGES, self.gyro_range),
+                "channels": self.channels, "sample_bytes": self.sample_bytes}
+
+    def setup(self):
+        """Wake the sensor, apply the profile and start the FIFO.
+
+        The four rate and range registers are consecutive and written in
+        one block transfer, then read back. Raises OSError if the sensor
+        does not answer on the bus or did not take the settings.
+        """
+        # FIFO off and awake, USER_CTRL and PWR_MGMT_1 are consecutive too
+        self.bus.write_i2c_block_data(self.address, USER_CTRL, [0x00, 0x00])
+        config = [self.divider, self.dlpf, self.gyro_range, self.accel_range]
+        self.bus.write_i2c_block_data(self.address, SMPLRT_DIV, config)
+        self.bus.write_byte_data(self.address, FIFO_EN, self.fifo_enable)
+        applied = list(self.bus.read_i2c_block_data(self.address, SMPLRT_DIV, len(config)))
+        if applied != config:
+            raise OSError(f"MPU6050 at 0x{self.address:02X} did not take the settings, reads {applied}")
+        self.reset()
+
+    def reset(self):
+        """Clear the FIFO and re-enable it."""
+        self.last_t = None
+        self.bus.write_byte_data(self.address, USER_CTRL, USER_CTRL_FIFO_RESET)
+        self.bus.write_byte_data(self.address, USER_CTRL, USER_CTRL_FIFO_EN)
+        self.bus.read_byte_data(self.address, INT_STATUS)
+
+    def stop(self):
+        self.bus.write_byte_data(self.address, USER_CTRL, 0x00)
+        self.bus.write_byte_data(self.address, FIFO_EN, 0x00)
+
+    def fifo_count(self):
+        high, low = self.bus.read_i2c_block_data(self.address, FIFO_COUNTH, 2)
+        return (high << 8) | low
+
+    def read_raw(self):
+        """Drain all complete samples from the FIFO.
+
+        Returns (t, counts): int64 timestamps in ns and an (n, width)
+        int16 array of raw counts, the accelerometer's first. Timestamps continue the
+        timeline of the previous read at the sample period, slowly pulled
+        towards the FIFO count time to follow the sensor clock.
+        """
+        count = self.fifo_count()
+        # The newest counted sample was taken within one period before this
+        now = time.time_ns() - self.period_ns // 2
+        if count >= FIFO_SIZE or self.bus.read_byte_data(self.address, INT_STATUS) & INT_STATUS_FIFO_OFLOW:
+            # Samples were lost and the FIFO may no longer be frame aligned
+            self.overruns += 1
+            self.reset()
+            return np.empty(0, dtype=np.int64), np.empty((0, self.width), dtype=np.int16)
+
+        n = count // self.sample_bytes
+        remaining = n * self.sample_bytes
+        raw = bytearray()
+        while remaining > 0:
+            size = min(self.block_size, remaining)
+            raw += bytes(self.bus.read_i2c_block_data(self.address, FIFO_R_W, size))
+            remaining -= size
+
+        counts = np.frombuffer(raw, dtype='>i2').astype(np.int16).reshape(-1, self.width)
+        if self.last_t is None:
+            end = now
+        else:
+            end = self.last_t + n * self.period_ns
+            error = now - end
+            if abs(error) > RESYNC_PERIODS * self.period_ns:
+                end = now
+            else:
+                end += int(error * CLOCK_GAIN)
+        t = end - np.arange(n - 1, -1, -1, dtype=np.int64) * self.period_ns
+        if n:
+            self.last_t = end
+        self.samples += n
+        return t, counts
+
+    def convert(self, counts):
+        """Raw accelerometer counts to m/s^2."""
+        return counts * (GRAVITY_MS2 / self.accel_scale)
+
+    def convert_gyro(self, counts):
+        """Raw gyroscope counts to deg/s."""
+        return counts * (1.0 / self.gyro_scale)
+
+    @staticmethod
+    def convert_temperature(counts):
+        """Raw temperature counts to degrees C."""
+        return counts / TEMP_SCALE + TEMP_OFFSET
+
+    def read(self):
+        """Drain the FIFO and return (t, accel) with accel in m/s^2."""
+        t, counts = self.read_raw()
+        return t, self.convert(counts[:, self.columns["accel"]])
+
+
+# ===============================
+# Sampling thread
+# ===============================
+class IntervalStats:
+    """Running statistics of the spacing between consecutive sample timestamps.
+
+    Intervals longer than 1.5 sample periods are counted as gaps.
+    """
+
+    def __init__(self, period_ns):
+        self.period_ns = period_ns
+        self.last_t = None
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.gaps = 0
+
+    def update(self, t):
+        if len(t) == 0:
+            return
+        if self.last_t is not None:
+            t = np.concatenate(([self.last_t], t))
+        self.last_t = int(t[-1])
+        d = np.diff(t).astype(np.float64)
+        if len(d) == 0:
+            return
+
+        # Chan's parallel update of mean and variance
+        n = len(d)
+        mean = d.mean()
+        m2 = ((d - mean) ** 2).sum()
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+        lo, hi = d.min(), d.max()
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        self.gaps += int(np.count_nonzero(d > 1.5 * self.period_ns))
+
+    def jitter_ns(self):
+        """Standard deviation of the sample interval in ns."""
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+    def summary(self):
+        if not self.count:
+            return "no samples"
+        return (f"interval {self.mean / 1e3:.1f} us "
+                f"(min {self.min / 1e3:.1f}, max {self.max / 1e3:.1f}, "
+                f"jitter {self.jitter_ns() / 1e3:.1f} us), {self.gaps} gaps")
+
+
+class Sampler(threading.Thread):
+    """Drains one FifoSensor into a RingBuffer at a fixed poll interval."""
+
+    def __init__(self, sensor, buffer, poll_interval=0.02, priority=-10):
+        super().__init__(name=f"sampler-0x{sensor.address:02X}", daemon=True)
+        self.sensor = sensor
+        self.buffer = buffer
+        self.poll_interval = poll_interval
+        self.priority = priority
+        self.stats = IntervalStats(sensor.period_ns)
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def overruns(self):
+        """Samples lost in the sensor FIFO and in the ring buffer."""
+        return self.sensor.overruns, self.buffer.overruns
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        try:
+            # Raising the priority needs root, sampling still works without it
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.priority)
+        except (OSError, AttributeError):
+            pass
+
+        next_wake = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                next_wake += self.poll_interval
+                delay = next_wake - time.monotonic()
+                if delay > 0:
+                    self._stop_event.wait(delay)
+                else:
+                    next_wake = time.monotonic()
+                t, counts = self.sensor.read_raw()
+                self.buffer.write(t, counts)
+                self.stats.update(t)
+        except Exception as e:
+            # Picked up by the publisher, which owns the error handling
+            self.error = e
+
+
+# ===============================
+# Simulated bus
+# ===============================
+def default_signal(t):
+    """Gravity on Z plus a 25 Hz vibration on X, in g."""
+    return 0.2 * math.sin(2 * math.pi * 25 * t), 0.0, 1.0
+
+
+FAKE_TEMPERATURE = 25.0     # degrees C of the emulated sensors
+
+
+class _FakeMPU6050:
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.regs = bytearray(128)
+        self.regs[PWR_MGMT_1] = PWR_MGMT_1_SLEEP
+        self.regs[WHO_AM_I] = 0x68
+        self.fifo = bytearray()
+        self.next_sample_ns = None
+
+    def running(self):
+        return not self.regs[PWR_MGMT_1] & PWR_MGMT_1_SLEEP
+
+    def period_ns(self):
+        rate = gyro_output_rate(self.regs[MPU_CONFIG] & 0x07)
+        return int(1e9 * (self.regs[SMPLRT_DIV] + 1) / rate)
+
+    def sample(self, t_ns):
+        """The 14 data register bytes: accel, temp and gyro.
+
+        A signal with a gyro(t) method turns the sensor at so many deg/s,
+        one without stands still; temperature is an optional attribute.
+        """
+        t = t_ns / 1e9
+        scale = ACCEL_SCALE.get(self.regs[ACCEL_CONFIG] & 0x18)
+        values = [a * scale for a in self.signal(t)]
+        values.append((getattr(self.signal, "temperature", FAKE_TEMPERATURE) - TEMP_OFFSET) * TEMP_SCALE)
+        gyro = getattr(self.signal, "gyro", None)
+        scale = GYRO_SCALE.get(self.regs[GYRO_CONFIG] & 0x18)
+        values += [w * scale for w in gyro(t)] if gyro is not None else [0, 0, 0]
+        return np.array([max(-32768, min(32767, int(v))) for v in values], dtype='>i2').tobytes()
+
+    def fifo_record(self, data):
+        """The bytes of a sample the FIFO_EN bits let into the FIFO."""
+        enabled = self.regs[FIFO_EN]
+        record = b""
+        if enabled & FIFO_EN_ACCEL:
+            record += data[0:6]
+        if enabled & FIFO_EN_TEMP:
+            record += data[6:8]
+        if enabled & FIFO_EN_GYRO:
+            record += data[8:14]
+        return record
+
+    def advance(self):
+        """Produce all samples due since the last bus access."""
+        now = time.monotonic_ns()
+        if not self.running():
+            self.next_sample_ns = None
+            return
+        period = self.period_ns()
+        if self.next_sample_ns is None:
+            self.next_sample_ns = now + period
+            return
+        while self.next_sample_ns <= now:
+            data = self.sample(self.next_sample_ns)
+            self.regs[ACCEL_XOUT0:ACCEL_XOUT0 + 14] = data
+            if self.regs[USER_CTRL] & USER_CTRL_FIFO_EN and self.regs[FIFO_EN]:
+                self.fifo += self.fifo_record(data)
+                if len(self.fifo) > FIFO_SIZE:
+                    # Like the real chip, the oldest bytes are overwritten
+                    del self.fifo[:len(self.fifo) - FIFO_SIZE]
+                    self.regs[INT_STATUS] |= INT_STATUS_FIFO_OFLOW
+            self.next_sample_ns += period
+
+    def write(self, reg, value):
+        if reg == USER_CTRL and value & USER_CTRL_FIFO_RESET:
+            self.fifo.clear()
+            value &= ~USER_CTRL_FIFO_RESET
+        self.regs[reg] = value & 0xFF
+
+    def read(self, reg):
+        if reg == FIFO_R_W:
+            if not self.fifo:
+                return 0xFF
+            value = self.fifo[0]
+            del self.fifo[0]
+            return value
+        if reg == FIFO_COUNTH:
+            return (len(self.fifo) >> 8) & 0xFF
+        if reg == FIFO_COUNTH + 1:
+            return len(self.fifo) & 0xFF
+        value = self.regs[reg]
+        if reg == INT_STATUS:
+            self.regs[INT_STATUS] = 0
+        return value
+
+
+class FakeSMBus:
+    """Drop-in replacement for smbus.SMBus with emulated MPU6050s.
+
+    Each transfer sleeps for the time it would take on a real bus of
+    bus_hz plus latency seconds of driver overhead, so throughput numbers
+    stay comparable to the Pi. Like on the real bus, one transfer at a
+    time: the sensors' Samplers wait for each other. signal is one signal
+    for all sensors or a dict of one per address.
+    """
+
+    def __init__(self, addresses=(0x68, 0x69), bus_hz=400000, signal=default_signal, latency=0.0):
+        self.devices = {addr: _FakeMPU6050(signal[addr] if isinstance(signal, dict) else signal)
+                        for addr in addresses}
+        self.bus_hz = bus_hz
+        self.latency = latency
+        self.transfers = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def _transfer(self, address, length):
+        if address not in self.devices:
+            raise OSError(121, "Remote I/O error")
+        # One transfer at a time for the whole transfer time, the sensors' Samplers wait for each other
+        with self._lock:
+            self.transfers += 1
+            self.bytes += length
+            if self.bus_hz:
+                # start, address, register, repeated start and data bytes
+                time.sleep((3 + length) * 9 / self.bus_hz + self.latency)
+            device = self.devices[address]
+            device.advance()
+        return device
+
+    def write_byte_data(self, address, register, value):
+        self._transfer(address, 1).write(register, value)
+
+    def read_byte_data(self, address, register):
+        return self._transfer(address, 1).read(register)
+
+    def write_i2c_block_data(self, address, register, data):
+        device = self._transfer(address, len(data))
+        for i, value in enumerate(data):
+            device.write(register + i, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        device = self._transfer(address, length)
+        if register == FIFO_R_W:
+            data = list(device.fifo[:length])
+            del device.fifo[:length]
+            return data + [0xFF] * (length - len(data))
+        return [device.read(register + i) for i in range(length)]
+
+    def close(self):
+        pass
@@ -0,0 +1,193 @@
+"""
+Offline analysis of recorded sessions.
+
+load() reads a Messdaten CSV recording (with its _freq.csv) or a .bfhrec
+session file into per-stream (t, values) arrays. The sensors of a session
+sample on their own clocks, with jitter and with gaps when messages were
+lost, so align() resamples them onto one uniform timebase with the
+Resample.StreamAligner the live recording uses: accelerations are
+interpolated linearly, the frequency readings are held until the next one,
+and grid points inside a gap of a stream are NaN for that stream.
+
+analyze() gives per session the statistics of every stream and, on the
+common timebase, the frequency over the aligned span and a Welch spectrum
+per sensor (Spectral.SpectralStage over the whole session, so the numbers
+match the live stage). Results are plain dicts and lists, ready for JSON.
+
+AnalysisCache keeps results keyed by a hash of the recording files and the
+analysis parameters, so analyzing a recording again is a file read.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+
+from Channels import is_frequency
+from Recorder import ChunkReader, load_csv
+from Resample import align_streams
+from Spectral import SpectralStage
+
+ANALYSIS_VERSION = 1    # part of the cache key, bump when results change
+MAX_GAP = 5.0           # periods without a sample that count as a gap
+NPERSEG = 256
+
+
+def session_files(path):
+    """The files a recording consists of: the CSV and its _freq.csv, or the .bfhrec file."""
+    files = [path]
+    freq_path = path.replace(".csv", "_freq.csv")
+    if path.endswith(".csv") and freq_path != path and os.path.exists(freq_path):
+        files.append(freq_path)
+    return files
+
+
+def load(path):
+    """{stream: (t, values)} with int64 ns timestamps and (n, k) float values."""
+    if path.endswith(".bfhrec"):
+        with ChunkReader(path) as reader:
+            streams = {}
+            for name, stream in reader.streams.items():
+                columns = reader.read(name)
+                names = [c for c, _ in stream["columns"][1:]]
+                values = np.column_stack([columns[c].astype(np.float64) for c in names])
+                streams[name] = (columns["t"], values)
+        return {name: s for name, s in streams.items() if len(s[0])}
+    return load_csv(path)
+
+
+def _rate(t, max_gap=MAX_GAP):
+    """Sample rate in Hz while the stream was running.
+
+    Samples of one message may share its timestamp, so the rate is the
+    samples per time between distinct timestamps, leaving out the gaps.
+    """
+    stamps, counts = np.unique(t, return_counts=True)
+    if len(stamps) < 2:
+        return 0.0
+    steps = np.diff(stamps)
+    running = steps <= max_gap * np.median(steps)
+    return counts[:-1][running].sum() / (steps[running].sum() / 1e9)
+
+
+def stream_stats(t, values):
+    """Sample count, time span, rate, the longest gap and per column mean, std, min and max."""
+    order = np.argsort(t, kind="stable")
+    t, values = t[order], values[order]
+    gaps = np.diff(t)
+    return {
+        "samples": len(t),
+        "start": int(t[0]),
+        "duration_s": (t[-1] - t[0]) / 1e9,
+        "rate_hz": _rate(t),
+        "max_gap_ms": gaps.max() / 1e6 if len(gaps) else 0.0,
+        "mean": np.nanmean(values, axis=0).tolist(),
+        "std": np.nanstd(values, axis=0).tolist(),
+        "min": np.nanmin(values, axis=0).tolist(),
+        "max": np.nanmax(values, axis=0).tolist(),
+    }
+
+
+def align(streams, rate=None, max_gap=MAX_GAP):
+    """Resample the streams onto one uniform timebase.
+
+    The grid covers the span all sensors have in common, at rate Hz (by
+    default the mean rate of the slowest sensor, so nothing is invented).
+    Returns (t, {name: (n, k) values}), or (None, {}) without an overlap.
+    """
+    sensors = {n: s for n, s in streams.items() if not is_frequency(n) and len(s[0]) > 1}
+    if not sensors:
+        return None, {}
+    start = max(int(t.min()) for t, _ in sensors.values())
+    end = min(int(t.max()) for t, _ in sensors.values())
+    rates = {n: _rate(np.sort(t), max_gap) for n, (t, _) in sensors.items()}
+    rate = rate or min(rates.values())
+    if end <= start or not rate:
+        return None, {}
+    # Same resampling as live recordings (Resample.py), gaps in periods of each stream
+    gaps = {n: max_gap / (r or rate) for n, r in rates.items()}
+    grid, aligned = align_streams(streams, rate, hold=[n for n in streams if is_frequency(n)],
+                                  max_gap=gaps, origin=start)
+    span = (grid >= start) & (grid <= end)
+    return grid[span], {name: values[span] for name, values in aligned.items()}
+
+
+def spectrum(t, values, nperseg=NPERSEG):
+    """Welch spectrum over a whole uniformly sampled record, NaN points set to the mean."""
+    segments = (len(values) - nperseg) // (nperseg // 2) + 1
+    if segments < 1 or np.isnan(values).all(axis=0).any():
+        return None
+    values = np.where(np.isnan(values), np.nanmean(values, axis=0), values)
+    stage = SpectralStage(nperseg, 0.5, segments)
+    stage.add("x", t, values)
+    stage.process()
+    result = stage.latest("x")
+    if result is None:
+        return None
+    return {
+        "freqs": result["freqs"].tolist(),
+        "psd": result["psd"].tolist(),
+        "dominant_hz": result["dominant_hz"].tolist(),
+        "rms": result["rms"].tolist(),
+        "bands": result["bands"].tolist(),
+        "band_limits": [list(b) for b in stage.bands],
+        "segments": segments,
+    }
+
+
+def analyze(path, rate=None, nperseg=NPERSEG, max_gap=MAX_GAP):
+    """Statistics, aligned span and spectra of one recording."""
+    streams = load(path)
+    result = {
+        "path": path,
+        "streams": {name: stream_stats(t, values) for name, (t, values) in streams.items()},
+        "aligned": None,
+        "spectra": {},
+    }
+    grid, aligned = align(streams, rate, max_gap)
+    if grid is None:
+        return result
+    span = {"start": int(grid[0]), "samples": len(grid), "duration_s": (grid[-1] - grid[0]) / 1e9,
+            "rate_hz": 1e9 / np.mean(np.diff(grid)) if len(grid) > 1 else 0.0}
+    for name, values in aligned.items():
+        if is_frequency(name):
+            valid = values[~np.isnan(values[:, 0]), 0]
+            span[name] = {"mean": float(valid.mean()), "min": float(valid.min()),
+                          "max": float(valid.max())} if len(valid) else None
+        else:
+            span.setdefault("gap_fraction", {})[name] = float(np.isnan(values[:, 0]).mean())
+            result["spectra"][name] = spectrum(grid, values, nperseg)
+    result["aligned"] = span
+    return result
+
+
+class AnalysisCache:
+    """Results on disk, one JSON file per recording content and parameter set."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, path, params):
+        digest = hashlib.sha256(json.dumps([ANALYSIS_VERSION, params], sort_keys=True).encode())
+        for name in session_files(path):
+            with open(name, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name first, parallel workers never see half a file
+        tmp = self._path(key) + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp, self._path(key))
@@ -0,0 +1,300 @@
+"""
+asyncio ingest core for the host.
+
+paho keeps its network thread; PahoBridge hands every message over to the
+event loop, at most `inbound` messages at a time. When they are all taken
+the paho thread waits, so it stops reading the socket and a burst is held
+back by TCP and the broker instead of growing memory on the host.
+
+The loop decodes each message once and offers the batch to every consumer
+through its own BatchQueue, bounded in samples, with a policy for when it
+is full:
+
+    block        wait for room, pushing back up to the inbound limit (recorder)
+    drop_newest  refuse the new batch
+    drop_oldest  evict the oldest batches (analytics)
+    coalesce     merge into the pending batch of the same stream, keeping only
+                 the newest samples (plotter)
+
+Every queue counts the samples that went in and out, were dropped or were
+coalesced into an already queued batch, plus its high water mark.
+
+With a Metrics.Telemetry, every message is stamped when paho hands it over
+and when it is decoded, see Metrics.py.
+"""
+import asyncio
+import inspect
+import threading
+import time
+from collections import deque
+import numpy as np
+
+import Codec
+from Channels import is_frequency
+
+POLICIES = ("block", "drop_newest", "drop_oldest", "coalesce")
+
+
+class BatchQueue:
+    """Bounded queue of (stream, timestamp, t, values) batches in front of one consumer.
+
+    A consumer with a handler is run by AsyncIngest on the loop (get());
+    one without is drained from another thread (drain()), e.g. the GUI
+    timer, and must not use the block policy.
+    """
+
+    def __init__(self, name, max_samples, policy="block", max_batches=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r}")
+        self.name = name
+        self.max_samples = max_samples
+        self.max_batches = max_batches or max_samples
+        self.policy = policy
+        self.samples = 0
+        self.counters = dict.fromkeys(("samples_in", "samples_out", "dropped", "coalesced", "high_water"), 0)
+        self.counters["blocked_s"] = 0.0
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._space = asyncio.Event()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _fits(self, n):
+        # An empty queue takes any batch, however large
+        return not self._items or (self.samples + n <= self.max_samples and len(self._items) < self.max_batches)
+
+    async def put(self, stream, timestamp, t, values):
+        n = len(t)
+        if self.policy == "block" and not self._fits(n):
+            start = time.perf_counter()
+            while not self._fits(n):
+                self._space.clear()
+                await self._space.wait()
+            self.counters["blocked_s"] += time.perf_counter() - start
+        with self._lock:
+            self.counters["samples_in"] += n
+            if self.policy == "coalesce":
+                self._coalesce(stream, timestamp, t, values)
+            else:
+                if self.policy == "drop_newest" and not self._fits(n):
+                    self.counters["dropped"] += n
+                    return
+                while self.policy == "drop_oldest" and not self._fits(n):
+                    self._evict()
+                self._items.append([stream, timestamp, t, values])
+                self.samples += n
+            self.counters["high_water"] = max(self.counters["high_water"], self.samples)
+        self._ready.set()
+
+    def _evict(self):
+        item = self._items.popleft()
+        self.samples -= len(item[2])
+        self.counters["dropped"] += len(item[2])
+
+    def _coalesce(self, stream, timestamp, t, values):
+        n = len(t)
+        pending = next((item for item in reversed(self._items) if item[0] == stream), None)
+        if pending is None:
+            self._items.append([stream, timestamp, t, values])
+        else:
+            pending[2] = np.concatenate((pending[2], t))
+            pending[3] = np.concatenate((pending[3], values))
+            self.counters["coalesced"] += n
+        self.samples += n
+        # Over the limit: the oldest samples go, the newest are what a plot shows
+        while self.samples > self.max_samples:
+            item = self._items[0]
+            excess = self.samples - self.max_samples
+            if excess >= len(item[2]):
+                self._evict()
+            else:
+                item[2], item[3] = item[2][excess:], item[3][excess:]
+                self.samples -= excess
+                self.counters["dropped"] += excess
+
+    async def get(self):
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        with self._lock:
+            item = self._items.popleft()
+            if item is not None:
+                self.samples -= len(item[2])
+                self.counters["samples_out"] += len(item[2])
+        self._space.set()
+        return item
+
+    def close(self):
+        """Queue the end marker: get() returns None after everything before it."""
+        with self._lock:
+            self._items.append(None)
+        self._ready.set()
+
+    def drain(self):
+        """Take everything queued (any thread); never call on a block queue."""
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+            self.samples = 0
+            self.counters["samples_out"] += sum(len(item[2]) for item in items)
+        return items
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, depth=self.samples, policy=self.policy)
+
+
+class AsyncIngest:
+    """Decodes messages on an event loop and fans them out to BatchQueues.
+
+    topics maps MQTT topics to stream names, either a dict or a
+    Channels.ChannelRegistry that subscribes with wildcards and names the
+    streams of new sensors as they appear. Frequency streams ("freq",
+    "<kit>/freq") carry the JSON frequency messages.
+
+    calibrations maps stream names to the Calibration.Calibration their
+    counts are converted with; streams without one use the scale of their
+    payloads.
+    """
+
+    def __init__(self, topics, inbound=1000, telemetry=None):
+        self.topics = topics
+        self.inbound = inbound
+        self.telemetry = telemetry
+        self.calibrations = {}
+        self.consumers = []
+        self.counters = dict.fromkeys(("messages", "samples", "errors", "inbound_high_water"), 0)
+        self.counters["submit_blocked_s"] = 0.0
+        self._slots = threading.Semaphore(inbound)
+        self._queue = None
+        self._loop = None
+        self._thread = None
+
+    def add_consumer(self, queue, handler=None):
+        """handler(stream, timestamp, t, values), plain or async, runs on the loop."""
+        self.consumers.append((queue, handler))
+        return queue
+
+    def submit(self, topic, payload):
+        """Hand a message to the loop (any thread). Waits while `inbound` messages are pending."""
+        received = time.time_ns()
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self._slots.acquire()
+            self.counters["submit_blocked_s"] += time.perf_counter() - start
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (topic, payload, received))
+
+    def _decode(self, topic, payload):
+        stream = self.topics.get(topic)
+        if stream is None:
+            return None
+        try:
+            if is_frequency(stream):
+                batch = Codec.decode_frequency(payload)
+            else:
+                batch = Codec.decode(payload, self.calibrations.get(stream))
+        except Codec.CodecError as e:
+            print(f"Dropped message on {topic}: {e}")
+            self.counters["errors"] += 1
+            return None
+        return stream, batch
+
+    async def run(self, started=None):
+        """Process messages until stop(); then let the consumers with a handler finish their queues."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        tasks = [asyncio.create_task(self._consume(q, h)) for q, h in self.consumers if h is not None]
+        if started is not None:
+            started.set()
+        while True:
+            topic, payload, received = await self._queue.get()
+            if topic is None:
+                break
+            self.counters["inbound_high_water"] = max(self.counters["inbound_high_water"], self._queue.qsize() + 1)
+            decoded = self._decode(topic, payload)
+            if decoded is not None:
+                stream, batch = decoded
+                if self.telemetry is not None and not is_frequency(stream):
+                    self.telemetry.message(stream, batch, received, time.time_ns())
+                self.counters["messages"] += 1
+                self.counters["samples"] += len(batch["t"])
+                for queue, _ in self.consumers:
+                    await queue.put(stream, batch["timestamp"], batch["t"], batch["values"])
+            # Released only now, so a blocked consumer also holds back paho
+            self._slots.release()
+        for queue, handler in self.consumers:
+            if handler is not None:
+                queue.close()
+        await asyncio.gather(*tasks)
+
+    async def _consume(self, queue, handler):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            # A failing handler loses its batch, not the consumer: a block queue would stall paho
+            try:
+                result = handler(*item)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"{queue.name} failed on {item[0]}: {e!r}")
+                self.counters["errors"] += 1
+
+    def start(self):
+        """Run the loop in a background thread."""
+        started = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(started),), name="ingest", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        """Finish the messages already submitted, then stop the loop thread."""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (None, None, None))
+        self._thread.join()
+
+    def stats(self):
+        stats = dict(self.counters, inbound_depth=self._queue.qsize() if self._queue else 0)
+        return stats, {queue.name: queue.stats() for queue, _ in self.consumers}
+
+
+class PahoBridge:
+    """paho client whose messages go to an AsyncIngest.
+
+    add_handler() sends the topics of a filter to a callback instead, run
+    on the paho thread, e.g. the clock answers of Metrics.ClockSync.
+    """
+
+    def __init__(self, ingest, broker, port=1883, client_id=""):
+        import paho.mqtt.client as mqtt
+        self.ingest = ingest
+        self.broker = broker
+        self.port = port
+        self.handlers = {}
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = lambda client, userdata, msg: ingest.submit(msg.topic, msg.payload)
+
+    def add_handler(self, topic_filter, handler):
+        """handler(topic, payload) for the messages matching topic_filter; call before start()."""
+        self.handlers[topic_filter] = handler
+        self.client.message_callback_add(topic_filter, lambda client, userdata, msg: handler(msg.topic, msg.payload))
+
+    def _on_connect(self, client, userdata, flags, reason, properties):
+        print(f"Connected to MQTT broker: {reason}")
+        topics = list(self.ingest.topics) + list(self.handlers)
+        client.subscribe([(topic, 0) for topic in topics])
+        print(f"Subscribed to {', '.join(topics)}")
+
+    def publish(self, topic, payload):
+        self.client.publish(topic, payload)
+
+    def start(self):
+        self.client.connect(self.broker, self.port, 60)
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
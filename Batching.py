@@ -0,0 +1,114 @@
+"""
+Time-based batching of sample arrays before they are published.
+
+A Batcher collects the samples for one topic and releases them as one
+message once the oldest pending sample has waited max_latency seconds or
+max_samples have piled up. The publish rate per topic is therefore bounded
+by 1 / max_latency (plus one message per max_samples) no matter how fast
+the sensors sample.
+
+add() also takes the time the samples were read from the sensor; after
+take(), acquired holds that time for the newest sample of the batch, for
+the stamps of the payload (Codec.py, Metrics.py).
+"""
+import time
+import numpy as np
+
+
+class Batcher:
+
+    def __init__(self, max_latency=0.02, max_samples=500):
+        self.max_latency_ns = int(max_latency * 1e9)
+        self.max_samples = max_samples
+        self._t = []
+        self._values = []
+        self._acquired = []     # [samples, read time] per add()
+        self.pending = 0
+        self.acquired = None
+        self._reset_stats(time.time_ns())
+
+    def _reset_stats(self, now):
+        self.stats_since = now
+        self.messages = 0
+        self.samples = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+
+    def add(self, t, values, acquired=None):
+        """Queue a batch of samples with acquisition timestamps t in ns, read at acquired ns (default now)."""
+        if len(t) == 0:
+            return
+        self._t.append(t)
+        self._values.append(values)
+        self._acquired.append([len(t), time.time_ns() if acquired is None else acquired])
+        self.pending += len(t)
+
+    def due(self, now=None):
+        if not self.pending:
+            return False
+        if self.pending >= self.max_samples:
+            return True
+        now = time.time_ns() if now is None else now
+        return now - self._t[0][0] >= self.max_latency_ns
+
+    def take(self, now=None):
+        """Remove up to max_samples of the oldest samples as one (t, values) batch.
+
+        The batch ends before a jump of the timeline (an overrun reset, a
+        resync, a restarted decimator), so its samples are evenly spaced
+        and a payload can carry them as a start and a period.
+        """
+        t = np.concatenate(self._t) if len(self._t) > 1 else self._t[0]
+        values = np.concatenate(self._values) if len(self._values) > 1 else self._values[0]
+        n = min(len(t), self.max_samples)
+        if n > 2:
+            d = np.diff(t[:n])
+            period = np.median(d)
+            jumps = np.flatnonzero(np.abs(d - period) > period / 2)
+            if len(jumps):
+                n = int(jumps[0]) + 1
+        if n < len(t):
+            self._t, self._values = [t[n:]], [values[n:]]
+        else:
+            self._t, self._values = [], []
+        self.pending -= n
+        left = n
+        while left:
+            count, self.acquired = self._acquired[0]
+            if count > left:
+                self._acquired[0][0] -= left
+                break
+            left -= count
+            self._acquired.pop(0)
+
+        now = time.time_ns() if now is None else now
+        latency = now - int(t[0])
+        self.messages += 1
+        self.samples += n
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        return t[:n], values[:n]
+
+    def flush(self, now=None):
+        """Take everything that is pending, regardless of age."""
+        batches = []
+        while self.pending:
+            batches.append(self.take(now))
+        return batches
+
+    def report(self, now=None):
+        """Statistics since the previous report, then start a new window.
+
+        Latency is the time the oldest sample of a message waited between
+        acquisition and publish.
+        """
+        now = time.time_ns() if now is None else now
+        elapsed = max(now - self.stats_since, 1) / 1e9
+        stats = {
+            "messages_per_s": self.messages / elapsed,
+            "samples_per_message": self.samples / self.messages if self.messages else 0.0,
+            "latency_ms": self.latency_sum / self.messages / 1e6 if self.messages else 0.0,
+            "latency_max_ms": self.latency_max / 1e6,
+        }
+        self._reset_stats(now)
+        return stats
@@ -0,0 +1,162 @@
+"""
+Calibration of the MPU6050 accelerometers: raw counts to m/s^2.
+
+The kit publishes raw int16 counts (Codec binary payloads) and, at the
+start of every run, the calibration of each sensor as JSON on
+Calibration/<kit>/<sensor>, through the spool ahead of the samples. The
+host converts every batch with it in one vectorized step (AsyncIngest)
+and records the calibration with the session (.bfhrec CALB records).
+
+A calibration is, per sensor,
+
+    counts_per_g  the range setting the offsets are counted in
+    offset        counts read at zero acceleration, per axis
+    gain          correction of the nominal sensitivity, per axis
+    axes          3x3 rotation from the sensor's axes to the kit's
+
+and turns counts into axes @ ((counts - offset) * gain) / counts_per_g
+in g, times GRAVITY_MS2. at_range() rescales it to another range setting.
+
+Calibrations come from static captures, counts read while the kit lies
+still (still_mean()):
+
+    level()   one capture with the kit level: the offsets, gravity taken
+              to lie on the axis that reads the most of it
+    fit()     six or more captures in different orientations, ideally
+              with every axis up and down once: offset and gain per axis,
+              fitted so that every capture reads 1 g
+    align()   one capture of a calibrated sensor as mounted: the rotation
+              that turns gravity onto the kit's Z axis
+
+calibrate-sensors.py runs them on the kit and keeps the result in
+calibration.json, {sensor: calibration}, which the kit reads at start.
+"""
+import json
+import os
+import time
+import numpy as np
+
+from Acquisition import GRAVITY_MS2
+
+CALIBRATION_PATH = "calibration.json"
+STILL_G = 0.02          # standard deviation per axis a still capture may have
+FIT_ITERATIONS = 20
+
+
+class Calibration:
+
+    def __init__(self, counts_per_g, offset=(0.0, 0.0, 0.0), gain=(1.0, 1.0, 1.0), axes=None, info=None):
+        self.counts_per_g = float(counts_per_g)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.gain = np.asarray(gain, dtype=np.float64)
+        self.axes = np.eye(3) if axes is None else np.asarray(axes, dtype=np.float64)
+        self.info = info or {}
+        # values = counts @ matrix.T - bias
+        self.matrix = self.axes * self.gain * (GRAVITY_MS2 / self.counts_per_g)
+        self.bias = self.matrix @ self.offset
+
+    def apply(self, counts):
+        """(n, 3) counts to (n, 3) float m/s^2."""
+        values = np.asarray(counts, dtype=np.float64) @ self.matrix.T
+        values -= self.bias
+        return values
+
+    def __call__(self, counts):
+        return self.apply(counts)
+
+    def at_range(self, counts_per_g):
+        """The same calibration for another range setting of the sensor."""
+        if counts_per_g == self.counts_per_g:
+            return self
+        return Calibration(counts_per_g, self.offset * (counts_per_g / self.counts_per_g), self.gain, self.axes,
+                           self.info)
+
+    def to_dict(self):
+        return {"counts_per_g": self.counts_per_g, "range_g": round(32768 / self.counts_per_g),
+                "offset": self.offset.tolist(), "gain": self.gain.tolist(), "axes": self.axes.tolist(),
+                "info": self.info}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["counts_per_g"], d["offset"], d["gain"], d["axes"], d.get("info"))
+
+
+def still_mean(counts, counts_per_g, still_g=STILL_G):
+    """Mean counts of a static capture; ValueError if the sensor moved."""
+    counts = np.asarray(counts, dtype=np.float64)
+    if len(counts) < 10:
+        raise ValueError(f"{len(counts)} samples are too few for a capture")
+    spread = counts.std(axis=0) / counts_per_g
+    if (spread > still_g).any():
+        raise ValueError(f"the sensor moved during the capture (spread {spread.max():.3f} g)")
+    return counts.mean(axis=0)
+
+
+def level(mean, counts_per_g):
+    """Offsets from one capture of the level kit."""
+    axis = int(np.argmax(np.abs(mean)))
+    gravity = np.zeros(3)
+    gravity[axis] = np.sign(mean[axis]) * counts_per_g
+    return Calibration(counts_per_g, mean - gravity, info={"method": "level", "time": time.time()})
+
+
+def fit(means, counts_per_g):
+    """Offset and gain per axis from captures in six or more orientations.
+
+    Gauss-Newton on |(mean - offset) * gain| = counts_per_g, starting from
+    the nominal sensor. ValueError if the orientations do not determine
+    all six.
+    """
+    means = np.asarray(means, dtype=np.float64)
+    if len(means) < 6:
+        raise ValueError(f"{len(means)} orientations, at least 6 are needed")
+    offset, gain = np.zeros(3), np.ones(3)
+    for _ in range(FIT_ITERATIONS):
+        v = (means - offset) * gain
+        norm = np.linalg.norm(v, axis=1)
+        residual = norm - counts_per_g
+        u = v / norm[:, None]
+        # d norm / d offset = -u * gain, d norm / d gain = u * (mean - offset)
+        jacobian = np.hstack((-u * gain, u * (means - offset)))
+        if np.linalg.matrix_rank(jacobian) < 6:
+            raise ValueError("the orientations do not cover every axis up and down")
+        step = np.linalg.lstsq(jacobian, -residual, rcond=None)[0]
+        offset += step[:3]
+        gain += step[3:]
+        if np.abs(step[:3]).max() < 1e-3:
+            break
+    rms = float(np.sqrt(np.mean(residual ** 2)) / counts_per_g)
+    return Calibration(counts_per_g, offset, gain,
+                       info={"method": "fit", "orientations": len(means), "rms_g": rms, "time": time.time()})
+
+
+def align(calibration, mean):
+    """calibration with the rotation that takes the gravity of a capture onto +Z."""
+    g = (mean - calibration.offset) * calibration.gain
+    g /= np.linalg.norm(g)
+    z = np.array([0.0, 0.0, 1.0])
+    axis = np.cross(g, z)
+    s, c = np.linalg.norm(axis), float(g @ z)
+    if s < 1e-12:
+        rotation = np.eye(3) if c > 0 else np.diag([1.0, -1.0, -1.0])
+    else:
+        # Rodrigues: the smallest rotation, about the horizontal axis g x z
+        k = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]]) / s
+        rotation = np.eye(3) + s * k + (1 - c) * k @ k
+    info = dict(calibration.info, aligned=time.time(), tilt_deg=float(np.degrees(np.arctan2(s, c))))
+    return Calibration(calibration.counts_per_g, calibration.offset, calibration.gain, rotation, info)
+
+
+def load(path=CALIBRATION_PATH):
+    """{sensor: Calibration} of a calibration file, empty if there is none."""
+    try:
+        with open(path) as f:
+            return {name: Calibration.from_dict(d) for name, d in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save(calibrations, path=CALIBRATION_PATH):
+    with open(path + ".tmp", "w") as f:
+        json.dump({name: c.to_dict() for name, c in calibrations.items()}, f, indent=1)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,130 @@
+"""
+Channel registry for hosts that serve several kits.
+
+Every kit publishes under its own id:
+
+    Sensor/<kit>/<sensor>     binary sample batches (Codec.py), e.g. Sensor/pi-lab2/s104
+    Sensor/<kit>/<sensor>gyro   gyroscope in deg/s and
+    Sensor/<kit>/<sensor>temp   temperature in degrees C, when the profile has them
+    Sensor/<kit>/Frequency    JSON frequency messages
+    Features/<kit>/<sensor>   JSON vibration features, when the kit computes them (Processing.py)
+    Calibration/<kit>/<sensor>  JSON calibration of the sensor, at the start of every run (Calibration.py)
+    Profile/<kit>/<sensor>      JSON acquisition settings of the sensor, likewise (Acquisition.py)
+
+Kits running older firmware publish on Sensor/<sensor> and Sensor/Frequency
+and keep working; their channels belong to the kit "".
+
+The host subscribes to both wildcards and the registry creates a channel
+the first time a topic sends a message. A channel's name is the stream
+name the ingest consumers see and the recordings use: "<kit>/<sensor>",
+with "freq" for the frequency topic ("pi-lab2/freq"), and just "<sensor>"
+or "freq" for the old topics.
+"""
+import threading
+import time
+
+PREFIX = "Sensor"
+FREQ_TOPIC = "Frequency"
+FEATURES_PREFIX = "Features"
+CALIBRATION_PREFIX = "Calibration"
+PROFILE_PREFIX = "Profile"
+GYRO_SUFFIX = "gyro"            # sensor names of the extra channels fit the 8 bytes of the Codec header
+TEMPERATURE_SUFFIX = "temp"
+
+
+def topic(kit, sensor, prefix=PREFIX):
+    """Topic a kit publishes a sensor (or FREQ_TOPIC) on."""
+    return f"{prefix}/{kit}/{sensor}" if kit else f"{prefix}/{sensor}"
+
+
+def is_frequency(stream):
+    """True for the stream names of frequency channels."""
+    return stream == "freq" or stream.endswith("/freq")
+
+
+def stream_kind(stream):
+    """"frequency", "gyro", "temperature" or "accel"."""
+    if is_frequency(stream):
+        return "frequency"
+    if stream.endswith(GYRO_SUFFIX):
+        return "gyro"
+    if stream.endswith(TEMPERATURE_SUFFIX):
+        return "temperature"
+    return "accel"
+
+
+class Channel:
+    """One sensor (or frequency input) of one kit."""
+
+    def __init__(self, name, kit, sensor, index):
+        self.name = name
+        self.kit = kit
+        self.sensor = sensor
+        self.index = index      # order of discovery
+        self.kind = stream_kind(name)
+        self.frequency = self.kind == "frequency"
+        self.columns = 1 if self.kind in ("frequency", "temperature") else 3
+        self.first_seen = time.time()
+
+
+class ChannelRegistry:
+    """Maps topics to channel names, creating channels on first use.
+
+    Used in place of the {topic: stream} dict of AsyncIngest: iterating
+    gives the subscriptions, get(topic) the stream name or None. Topics
+    outside the scheme and anything beyond max_channels are ignored, so a
+    misbehaving publisher cannot grow the host without bounds.
+    """
+
+    def __init__(self, prefix=PREFIX, max_channels=256):
+        self.prefix = prefix
+        self.max_channels = max_channels
+        self.rejected = 0
+        self._topics = {}       # topic -> name, also None for rejected topics
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return iter((f"{self.prefix}/+/+", f"{self.prefix}/+"))
+
+    def __len__(self):
+        return len(self._channels)
+
+    def parse(self, topic):
+        """(kit, channel name, sensor) of a topic, or None if it is not a sensor topic."""
+        levels = topic.split("/")
+        if levels[0] != self.prefix or len(levels) not in (2, 3) or not all(levels[1:]):
+            return None
+        kit, sensor = ("", levels[1]) if len(levels) == 2 else levels[1:]
+        stream = "freq" if sensor == FREQ_TOPIC else sensor
+        return kit, f"{kit}/{stream}" if kit else stream, sensor
+
+    def get(self, topic):
+        try:
+            return self._topics[topic]
+        except KeyError:
+            pass
+        with self._lock:
+            if topic in self._topics:
+                return self._topics[topic]
+            parsed = self.parse(topic)
+            if parsed is None or len(self._channels) >= self.max_channels:
+                self.rejected += 1
+                # A flood of new topics on a full registry must not grow the cache either
+                if parsed is None and len(self._topics) < 4 * self.max_channels:
+                    self._topics[topic] = None
+                return None
+            kit, name, sensor = parsed
+            if name not in self._channels:
+                self._channels[name] = Channel(name, kit, sensor, len(self._channels))
+                print(f"New channel {name} on {topic}")
+            self._topics[topic] = name
+            return name
+
+    def channel(self, name):
+        return self._channels[name]
+
+    def channels(self):
+        """All channels in the order they were discovered."""
+        with self._lock:
+            return list(self._channels.values())
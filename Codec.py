@@ -0,0 +1,199 @@
+"""
+Payload codec for sensor sample batches, shared by sensor-mqtt.py,
+sensor-mqtt-sim.py and Host.py.
+
+Two formats travel on the same topics and are told apart by the first
+bytes of the payload:
+
+JSON (legacy)
+    {"timestamp": ..., "samples": [{"t": ns, "x": .., "y": .., "z": ..}, ...]}
+
+Binary (version 1), little endian
+    header  magic "BFH", version u8, format u8, channels u8,
+            sensor id 8s, base timestamp i64 ns, sample period u32 ns,
+            sample count u32, scale f32
+    body    one column per channel, count values each, either int16 raw
+            counts (multiply by scale for physical units) or float32
+
+Sample i of a binary batch was taken at base timestamp + i * period.
+
+Version 2 is version 1 followed by the stamps trailer, acquired i64 ns
+(when the sensor loop read the newest sample) and published i64 ns (when
+the payload was encoded for publishing), both on the sensor's clock. The
+JSON payloads carry the same as "stamps": {"acquired": .., "published": ..}.
+decode() returns them as "stamps", None for unstamped payloads.
+
+The binary payloads of the kit carry the raw counts with the nominal
+scale of the sensor's range; the calibration of each sensor travels on
+its own topic (Calibration.py) and is applied by the host on decoding.
+
+Frequency messages stay JSON, {"timestamp": ..., "frequency_hz": ...};
+decode_frequency() turns them into the same batch dict with one sample.
+
+Feature messages (Processing.py) are JSON too, one list entry per window:
+{"sensor": .., "window_s": .., "t": [..], "mean": [[x, y, z], ..], "rms":
+.., "peak": .., "crest": ..}, mean, RMS and peak in physical units.
+"""
+import json
+import struct
+import time
+import numpy as np
+
+MAGIC = b"BFH"
+VERSION = 1
+STAMPED_VERSION = 2
+
+FORMAT_INT16 = 0
+FORMAT_FLOAT32 = 1
+_DTYPES = {FORMAT_INT16: np.dtype("<i2"), FORMAT_FLOAT32: np.dtype("<f4")}
+
+HEADER = struct.Struct("<3sBBB8sqIIf")
+STAMPS = struct.Struct("<qq")
+
+CHANNELS = ("x", "y", "z")
+FEATURES = ("mean", "rms", "peak", "crest")
+
+
+class CodecError(ValueError):
+    pass
+
+
+def is_binary(payload):
+    return payload[:3] == MAGIC
+
+
+def encode_binary(sensor, t0, period_ns, values, scale=1.0, acquired=None, published=None):
+    """Pack an (n, channels) array of int16 counts or floats into a binary payload.
+
+    With acquired (ns) the payload is stamped (version 2), published defaults to the time of this call.
+    """
+    values = np.asarray(values)
+    fmt = FORMAT_INT16 if values.dtype == np.int16 else FORMAT_FLOAT32
+    header = HEADER.pack(MAGIC, VERSION if acquired is None else STAMPED_VERSION, fmt, values.shape[1],
+                         sensor.encode("ascii"), int(t0), int(period_ns), len(values), scale)
+    body = np.ascontiguousarray(values.T, dtype=_DTYPES[fmt]).tobytes()
+    if acquired is None:
+        return header + body
+    return header + body + STAMPS.pack(int(acquired), time.time_ns() if published is None else int(published))
+
+
+def encode_json(timestamp, t, values, decimals=3, acquired=None):
+    """The legacy per-sample JSON payload from timestamps and an (n, 3) array."""
+    values = np.round(values, decimals).tolist()
+    data = {
+        "timestamp": timestamp,
+        "samples": [
+            {"t": ts, "x": v[0], "y": v[1], "z": v[2]}
+            for ts, v in zip(np.asarray(t).tolist(), values)
+        ],
+    }
+    if acquired is not None:
+        data["stamps"] = {"acquired": int(acquired), "published": time.time_ns()}
+    return json.dumps(data)
+
+
+def decode(payload, convert=None):
+    """Decode either payload format into a column batch.
+
+    Returns a dict with "sensor" (None for JSON), "timestamp", "t" as an
+    int64 array in ns, "values" as an (n, channels) float array in
+    physical units and "stamps" ({"acquired", "published"} or None).
+    convert(counts) turns the (n, channels) int16 counts of a binary
+    payload into physical units instead of its scale, e.g. a
+    Calibration.Calibration; JSON payloads arrive converted.
+    """
+    if is_binary(payload):
+        return _decode_binary(payload, convert)
+    try:
+        data = json.loads(payload)
+        samples = data.get("samples", [])
+        return {
+            "sensor": None,
+            "timestamp": data.get("timestamp", ""),
+            "t": np.array([s.get("t", 0) for s in samples], dtype=np.int64),
+            "values": np.array([[s.get(c, np.nan) for c in CHANNELS] for s in samples],
+                               dtype=np.float64).reshape(-1, len(CHANNELS)),
+            "stamps": data.get("stamps"),
+        }
+    # Also JSON that is not an object of sample objects
+    except (UnicodeDecodeError, ValueError, AttributeError, TypeError) as e:
+        raise CodecError(f"Unreadable payload: {e!r}") from e
+
+
+def decode_frequency(payload):
+    """Decode a JSON frequency message like decode(), as a batch of one sample.
+
+    "timestamp" is passed through as sent, "t" falls back to the time of
+    reception when the message has none.
+    """
+    try:
+        data = json.loads(payload)
+        timestamp = data.get("timestamp")
+        t = timestamp
+        # Older sensor firmware sends the timestamp wrapped in a list
+        if isinstance(t, (list, tuple)):
+            t = t[0] if t else None
+        return {
+            "sensor": None,
+            "timestamp": timestamp,
+            "t": np.array([int(t) if t else time.time_ns()], dtype=np.int64),
+            "values": np.array([[float(data.get("frequency_hz", 0.0))]]),
+            "stamps": data.get("stamps"),
+        }
+    except (UnicodeDecodeError, ValueError, AttributeError, TypeError) as e:
+        raise CodecError(f"Unreadable payload: {e!r}") from e
+
+
+def encode_features(sensor, window_s, features, scale=1.0, decimals=4):
+    """JSON feature message from Processing.Features.process() of raw counts, scaled to physical units."""
+    data = {"sensor": sensor, "window_s": window_s, "t": np.asarray(features["t"]).tolist()}
+    for name in FEATURES:
+        values = features[name] if name == "crest" else features[name] * scale
+        data[name] = np.round(values, decimals).tolist()
+    return json.dumps(data)
+
+
+def decode_features(payload):
+    """Decode a feature message: "t" as int64 array, every feature as a (windows, channels) array."""
+    try:
+        data = json.loads(payload)
+        result = {"sensor": data.get("sensor"), "window_s": data.get("window_s"),
+                  "t": np.array(data["t"], dtype=np.int64)}
+        for name in FEATURES:
+            result[name] = np.array(data[name], dtype=np.float64).reshape(len(result["t"]), -1)
+    except (UnicodeDecodeError, ValueError, KeyError, TypeError, AttributeError) as e:
+        raise CodecError(f"Unreadable feature message: {e}") from e
+    return result
+
+
+def _decode_binary(payload, convert=None):
+    if len(payload) < HEADER.size:
+        raise CodecError("Truncated header")
+    magic, version, fmt, channels, sensor, t0, period, count, scale = HEADER.unpack_from(payload)
+    if version not in (VERSION, STAMPED_VERSION):
+        raise CodecError(f"Unsupported payload version {version}")
+    if fmt not in _DTYPES:
+        raise CodecError(f"Unknown sample format {fmt}")
+
+    dtype = _DTYPES[fmt]
+    end = HEADER.size + count * channels * dtype.itemsize
+    if len(payload) != end + (STAMPS.size if version == STAMPED_VERSION else 0):
+        raise CodecError("Payload length does not match header")
+    stamps = None
+    if version == STAMPED_VERSION:
+        acquired, published = STAMPS.unpack_from(payload, end)
+        stamps = {"acquired": acquired, "published": published}
+    columns = np.frombuffer(payload, dtype=dtype, offset=HEADER.size, count=count * channels).reshape(channels, count)
+    if fmt != FORMAT_INT16:
+        values = columns.T.astype(np.float64)
+    elif convert is not None:
+        values = convert(columns.T)
+    else:
+        values = columns.T * scale
+    return {
+        "sensor": sensor.rstrip(b"\0").decode("ascii"),
+        "timestamp": t0,
+        "t": t0 + np.arange(count, dtype=np.int64) * period,
+        "values": values,
+        "stamps": stamps,
+    }
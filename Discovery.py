@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Discovery of the host (the MQTT broker) among the access point's clients.
+
+The kit is the access point and dnsmasq its DHCP server; the laptop that
+runs Host.py is one of the clients. Discovery reads the candidates
+straight from the kernel's neighbour table (/proc/net/arp) and dnsmasq's
+lease file instead of running iw and arp, and takes the first one whose
+broker port accepts a connection, so a phone on the access point is not
+mistaken for the host. The last host found is cached in a file and tried
+first, which makes a restart or an error reset connect at once when the
+laptop is still there.
+
+Between rounds find() waits for an event instead of polling once a
+second: dnsmasq runs this file as its dhcp-script on every lease change
+(dnsmasq.conf: dhcp-script=<path>/Discovery.py), which sends the change
+to the kit's event socket. Without events the neighbour table is read
+every POLL_INTERVAL.
+
+Backends provide neighbors() -> [(ip, mac)], newest first, and
+wait(timeout) -> True on a change. ProcBackend reads the system's files,
+FakeBackend is driven by the caller for benches.
+
+    Discovery.py add|old|del <mac> <ip> [hostname]    (called by dnsmasq)
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ARP_PATH = "/proc/net/arp"
+LEASES_PATH = "/var/lib/misc/dnsmasq.leases"
+EVENT_SOCKET = "/tmp/bfh-discovery.sock"
+CACHE_PATH = "broker-ip.json"
+PORT = 1883
+PROBE_TIMEOUT = 0.3     # seconds a broker port may take to accept
+PROBE_INTERVAL = 1.0    # seconds before a candidate that did not answer is probed again
+POLL_INTERVAL = 0.2     # seconds between neighbour table reads without events
+ARP_COMPLETE = 0x2
+
+
+def probe(ip, port=PORT, timeout=PROBE_TIMEOUT):
+    """True if ip accepts TCP connections on port."""
+    try:
+        with socket.create_connection((ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class ProcBackend:
+
+    def __init__(self, interface="wlan0", arp_path=ARP_PATH, leases_path=LEASES_PATH, events=EVENT_SOCKET):
+        self.interface = interface
+        self.arp_path = arp_path
+        self.leases_path = leases_path
+        self.announced = {}     # ip -> mac of the leases dnsmasq reported, newest last
+        self._events = None
+        if events:
+            try:
+                if os.path.exists(events):
+                    os.remove(events)
+                self._events = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._events.bind(events)
+                # dnsmasq may run its script as another user
+                os.chmod(events, 0o666)
+            except OSError as e:
+                print(f"No discovery events on {events} ({e}), polling instead")
+                self._events = None
+
+    def neighbors(self):
+        """Clients dnsmasq announced and clients with a lease, newest first, then the other neighbours."""
+        found = [(ip, mac) for ip, mac in reversed(self.announced.items())]
+        try:
+            with open(self.leases_path) as f:
+                leases = [line.split() for line in f]
+            # Fields: expiry, mac, ip, hostname, client id
+            for lease in sorted((l for l in leases if len(l) >= 3), key=lambda l: -int(l[0])):
+                found.append((lease[2], lease[1].lower()))
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(self.arp_path) as f:
+                next(f)
+                for line in f:
+                    # IP address, HW type, flags, HW address, mask, device
+                    parts = line.split()
+                    if len(parts) >= 6 and parts[5] == self.interface and int(parts[2], 16) & ARP_COMPLETE:
+                        found.append((parts[0], parts[3].lower()))
+        except (OSError, StopIteration, ValueError):
+            pass
+        return found
+
+    def wait(self, timeout):
+        """Wait for a dnsmasq event; returns True if one came."""
+        if self._events is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return False
+        self._events.settimeout(timeout)
+        try:
+            self._event(self._events.recv(256))
+        except socket.timeout:
+            return False
+        # Take everything queued, one round handles them all
+        self._events.setblocking(False)
+        try:
+            while True:
+                self._event(self._events.recv(256))
+        except BlockingIOError:
+            pass
+        return True
+
+    def _event(self, message):
+        # "add|old|del <mac> <ip> [hostname]", the arguments of dnsmasq's dhcp-script
+        parts = message.decode(errors="replace").split()
+        if len(parts) < 3:
+            return
+        action, mac, ip = parts[:3]
+        self.announced.pop(ip, None)
+        if action in ("add", "old"):
+            self.announced[ip] = mac.lower()
+
+
+class FakeBackend:
+    """Clients joined and left by the caller; wait() wakes up on every change."""
+
+    def __init__(self):
+        self.clients = []
+        self._changed = threading.Condition()
+        self._version = 0
+        self._seen = 0
+
+    def join(self, ip, mac="02:00:00:00:00:01"):
+        with self._changed:
+            self.clients.insert(0, (ip, mac))
+            self._version += 1
+            self._changed.notify_all()
+
+    def leave(self, ip):
+        with self._changed:
+            self.clients = [c for c in self.clients if c[0] != ip]
+            self._version += 1
+            self._changed.notify_all()
+
+    def neighbors(self):
+        with self._changed:
+            self._seen = self._version
+            return list(self.clients)
+
+    def wait(self, timeout):
+        with self._changed:
+            return self._changed.wait_for(lambda: self._version != self._seen, timeout)
+
+
+class Discovery:
+
+    def __init__(self, backend=None, cache=CACHE_PATH, port=PORT, check=None):
+        """check(ip) decides whether ip runs the broker, by default a connection to port."""
+        self.backend = backend if backend is not None else ProcBackend()
+        self.cache = cache
+        self.check = check if check is not None else (lambda ip: probe(ip, port))
+        self.probes = 0
+        self._probed = {}       # ip -> time of its last failed probe
+
+    def cached(self):
+        if not self.cache:
+            return None
+        try:
+            with open(self.cache) as f:
+                return json.load(f)["ip"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, ip):
+        if not self.cache or ip == self.cached():
+            return
+        with open(self.cache + ".tmp", "w") as f:
+            json.dump({"ip": ip, "time": time.time()}, f)
+        os.replace(self.cache + ".tmp", self.cache)
+
+    def forget(self):
+        """Drop the cached host, e.g. after its broker went away for good."""
+        if self.cache and os.path.exists(self.cache):
+            os.remove(self.cache)
+
+    def lookup(self):
+        """One round: the cached host or the first client running the broker, None if there is none."""
+        now = time.monotonic()
+        candidates = [ip for ip, _ in self.backend.neighbors()]
+        cached = self.cached()
+        if cached is not None:
+            candidates.insert(0, cached)
+        for ip in dict.fromkeys(candidates):
+            if ip in self._probed and now - self._probed[ip] < PROBE_INTERVAL:
+                continue
+            self.probes += 1
+            if self.check(ip):
+                self._probed.pop(ip, None)
+                self._save(ip)
+                return ip
+            self._probed[ip] = now
+        return None
+
+    def find(self, timeout=None):
+        """Wait for the host; returns its IP, or None after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ip = self.lookup()
+            if ip is not None:
+                return ip
+            wait = PROBE_INTERVAL
+            if self._probed:
+                # Come back when the first failed candidate may be probed again
+                wait = max(0.0, min(self._probed.values()) + PROBE_INTERVAL - time.monotonic())
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                wait = min(wait, left)
+            if self.backend.wait(wait):
+                # A change: probe everything again
+                self._probed.clear()
+
+
+def notify(args, path=EVENT_SOCKET):
+    """dnsmasq's dhcp-script: pass the lease change on to a waiting kit, if any."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.sendto(" ".join(args).encode(), path)
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    notify(sys.argv[1:])
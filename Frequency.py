@@ -0,0 +1,281 @@
+"""
+Frequency measurement on the frequency input.
+
+Edge sources only collect rising edge timestamps (int64 ns on
+CLOCK_MONOTONIC) into a timestamp-only RingBuffer. FrequencyMeter drains
+them and computes the frequency over a gate window: periods far from the
+median of the window (bounces, missed edges, late callbacks) are rejected
+and the rest averaged, so the result is edges per time over the whole
+gate instead of 1 / the last period.
+
+Backends:
+    GpiodEdges      kernel edge events through libgpiod. The kernel stamps
+                    each edge in its interrupt handler; one thread reads
+                    them in bulk, so neither the timestamp nor the GIL
+                    depend on Python scheduling.
+    CallbackEdges   gpiozero callback stamping time.monotonic_ns(), for
+                    systems without libgpiod.
+    SimulatedEdges  generated edges with jitter, late edges, bounces and
+                    missed edges, for the benches and runs without hardware.
+"""
+import threading
+import time
+import numpy as np
+
+from RingBuffer import RingBuffer
+
+EDGE_CAPACITY = 1 << 16
+OUTLIER_MADS = 4
+
+
+class EdgeSource:
+    """Base class: edges go into self.buffer, drain() takes them out."""
+
+    def __init__(self, capacity=EDGE_CAPACITY):
+        self.buffer = RingBuffer(capacity, width=0)
+        self.clock = time.monotonic_ns
+
+    def poll(self):
+        pass
+
+    def drain(self):
+        """All edges collected since the last call as an int64 ns array."""
+        self.poll()
+        t, _ = self.buffer.read()
+        return t
+
+    def overruns(self):
+        return self.buffer.overruns
+
+    def close(self):
+        pass
+
+
+class CallbackEdges(EdgeSource):
+    """Stamps edges in gpiozero's callback thread; device is a DigitalInputDevice."""
+
+    def __init__(self, device, capacity=EDGE_CAPACITY):
+        super().__init__(capacity)
+        self.device = device
+        device.when_activated = self._edge
+
+    def _edge(self):
+        # Keep the callback as short as possible, it holds the GIL:
+        # one store into the ring instead of a RingBuffer.write call
+        buffer = self.buffer
+        if buffer.head - buffer.tail < buffer.capacity:
+            buffer.t[buffer.head % buffer.capacity] = time.monotonic_ns()
+            buffer.head += 1
+        else:
+            buffer.overruns += 1
+
+    def close(self):
+        self.device.when_activated = None
+        self.device.close()
+
+
+class GpiodEdges(EdgeSource):
+    """Kernel timestamped rising edges of one GPIO line, read by a thread.
+
+    Works with the libgpiod 2.x bindings (pip gpiod) and the 1.x bindings
+    shipped as python3-libgpiod.
+    """
+
+    def __init__(self, line, chip="/dev/gpiochip0", capacity=EDGE_CAPACITY, max_events=256):
+        super().__init__(capacity)
+        import gpiod
+        self.line = line
+        self.max_events = max_events
+        self.error = None
+        self._stop = threading.Event()
+        if hasattr(gpiod, "request_lines"):
+            from gpiod.line import Bias, Clock, Edge
+            settings = gpiod.LineSettings(edge_detection=Edge.RISING, bias=Bias.PULL_DOWN,
+                                          event_clock=Clock.MONOTONIC)
+            self._request = gpiod.request_lines(chip, consumer="bfh-frequency", config={line: settings})
+            self._read = self._read_v2
+        else:
+            self._chip = gpiod.Chip(chip)
+            self._request = self._chip.get_line(line)
+            self._request.request(consumer="bfh-frequency", type=gpiod.LINE_REQ_EV_RISING_EDGE,
+                                  flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_DOWN)
+            self._read = self._read_v1
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _read_v2(self):
+        if not self._request.wait_edge_events(0.2):
+            return None
+        events = self._request.read_edge_events(self.max_events)
+        return np.fromiter((e.timestamp_ns for e in events), dtype=np.int64, count=len(events))
+
+    def _read_v1(self):
+        if not self._request.event_wait(nsec=200_000_000):
+            return None
+        events = self._request.event_read_multiple()
+        return np.fromiter((e.sec * 1_000_000_000 + e.nsec for e in events), dtype=np.int64, count=len(events))
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                t = self._read()
+                if t is not None:
+                    self.buffer.write(t, None)
+        except Exception as e:
+            self.error = e
+
+    def drain(self):
+        if self.error is not None:
+            raise self.error
+        return super().drain()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._request.release()
+
+
+class SimulatedEdges(EdgeSource):
+    """Edges of a square wave at `frequency` Hz, generated up to the clock on poll().
+
+    jitter_ns is the standard deviation of the timestamp noise, late_rate
+    the share of edges delayed by an exponential delay of mean late_ns
+    (a busy callback thread), bounce_rate the share followed by a second
+    edge bounce_ns later and miss_rate the share that is lost.
+    """
+
+    def __init__(self, frequency=50.0, jitter_ns=0, late_rate=0.0, late_ns=0, bounce_rate=0.0,
+                 bounce_ns=20_000, miss_rate=0.0, seed=None, clock=time.monotonic_ns,
+                 capacity=EDGE_CAPACITY):
+        super().__init__(capacity)
+        self.frequency = frequency
+        self.jitter_ns = jitter_ns
+        self.late_rate = late_rate
+        self.late_ns = late_ns
+        self.bounce_rate = bounce_rate
+        self.bounce_ns = bounce_ns
+        self.miss_rate = miss_rate
+        self.rng = np.random.default_rng(seed)
+        self.clock = clock
+        self._next = clock()    # ideal time of the next edge
+        self._held = np.empty(0, dtype=np.int64)   # edges stamped later than now
+
+    def generate(self, t_end):
+        """Ideal edges up to t_end turned into the timestamps a backend would see."""
+        if self.frequency <= 0:
+            self._next = t_end
+            return np.empty(0, dtype=np.int64)
+        period = 1e9 / self.frequency
+        n = max(0, int((t_end - self._next) // period) + 1)
+        ideal = self._next + np.round(np.arange(n) * period).astype(np.int64)
+        self._next += int(round(n * period))
+        t = ideal
+        if self.jitter_ns:
+            t = t + self.rng.normal(0, self.jitter_ns, n).astype(np.int64)
+        if self.late_rate:
+            late = self.rng.random(n) < self.late_rate
+            t = t + np.where(late, self.rng.exponential(self.late_ns, n), 0).astype(np.int64)
+        if self.miss_rate:
+            t = t[self.rng.random(len(t)) >= self.miss_rate]
+        if self.bounce_rate:
+            bounce = t[self.rng.random(len(t)) < self.bounce_rate] + self.bounce_ns
+            t = np.concatenate((t, bounce))
+        return np.sort(t)
+
+    def poll(self):
+        t = np.sort(np.concatenate((self._held, self.generate(self.clock()))))
+        now = self.clock()
+        ready = t <= now
+        self._held = t[~ready]
+        self.buffer.write(t[ready], None)
+
+
+class FrequencyMeter:
+    """Frequency over the last `gate` seconds of edges of a source.
+
+    Inner edges displaced from the middle of their neighbours by more than
+    `glitch` periods (bounces, late edges, the edges around a missed one)
+    are rejected, and each remaining gap counts as the whole number of
+    median periods nearest to it. The period is then fitted by least
+    squares to the edge times against their cycle numbers, once more
+    without edges further than OUTLIER_MADS robust deviations from the
+    line, so timestamp noise averages out over the whole gate.
+
+    Below 2 / gate Hz the window is stretched back to the last
+    `min_periods` periods, as long as the newest edge is not older than
+    `timeout` seconds; otherwise the input counts as stopped.
+    """
+
+    def __init__(self, source, gate=0.5, glitch=0.25, min_periods=2, timeout=2.0):
+        self.source = source
+        self.gate_ns = int(gate * 1e9)
+        self.glitch = glitch
+        self.min_periods = min_periods
+        self.timeout_ns = int(timeout * 1e9)
+        self.edges = np.empty(0, dtype=np.int64)
+        self.frequency = 0.0
+        self.periods = 0        # periods counted by the last update
+        self.rejected = 0       # edges rejected by the last update
+
+    def update(self, now=None):
+        """Take the new edges and return the frequency in Hz."""
+        new = self.source.drain()
+        if len(new):
+            self.edges = np.concatenate((self.edges, new))
+        now = self.source.clock() if now is None else now
+        keep = np.searchsorted(self.edges, now - max(self.gate_ns, self.timeout_ns))
+        self.edges = self.edges[max(0, min(keep, len(self.edges) - self.min_periods - 1)):]
+
+        self.frequency, self.periods, self.rejected = 0.0, 0, 0
+        if len(self.edges) < 2 or now - self.edges[-1] > self.timeout_ns:
+            return self.frequency
+        start = np.searchsorted(self.edges, now - self.gate_ns)
+        start = max(0, min(start, len(self.edges) - self.min_periods - 1))
+        edges = self.edges[start:]
+        d = np.diff(edges).astype(np.float64)
+        median = np.median(d)
+        if median <= 0:
+            return self.frequency
+        # How far each inner edge sits off the middle of its neighbours:
+        # half a period for a bounce or next to a missed edge, half the delay
+        # for a late edge and its neighbours
+        keep = np.ones(len(edges), dtype=bool)
+        keep[1:-1] = np.abs(d[:-1] - d[1:]) <= 2 * self.glitch * median
+        if keep.sum() >= max(2, len(edges) // 2):
+            edges = edges[keep]
+        cycles = np.maximum(1, np.rint(np.diff(edges) / median))
+        index = np.concatenate(([0.0], np.cumsum(cycles)))
+        t = (edges - edges[0]).astype(np.float64)
+        self.periods = int(index[-1])
+        self.rejected = int((~keep).sum())
+
+        # Least squares period over all edges, refitted without the late ones
+        for _ in range(2):
+            period, offset = self._fit(index, t)
+            residual = np.abs(t - (offset + period * index))
+            limit = max(OUTLIER_MADS * 1.4826 * np.median(residual), 0.01 * period)
+            ok = residual <= limit
+            if ok.all() or ok.sum() < 2:
+                break
+            self.rejected += int(len(ok) - ok.sum())
+            index, t = index[ok], t[ok]
+        self.frequency = 1e9 / period if period > 0 else 0.0
+        return self.frequency
+
+    @staticmethod
+    def _fit(index, t):
+        x = index - index.mean()
+        period = (x * (t - t.mean())).sum() / (x * x).sum()
+        return period, t.mean() - period * index.mean()
+
+
+def open_edges(backend, pin, chip="/dev/gpiochip0"):
+    """Edge source for a backend name: "gpiod", "gpiozero" or "sim"."""
+    if backend == "gpiod":
+        return GpiodEdges(pin, chip)
+    if backend == "gpiozero":
+        from gpiozero import DigitalInputDevice
+        return CallbackEdges(DigitalInputDevice(pin))
+    if backend == "sim":
+        return SimulatedEdges()
+    raise ValueError(f"unknown frequency backend {backend!r}")
@@ -1,34 +1,44 @@
 
-import subprocess
+import socket
 import re
 from enum import Enum
+from Discovery import Discovery
 # ----------- Detect the single connected client -----------
+_discovery = None
+
 def get_single_client_ip():
-    """Return the IP of the single client connected to wlan0."""
-    # Get MAC addresses using iw
-    try:
-        iw_output = subprocess.check_output(["iw", "dev", "wlan0", "station", "dump"], text=True)
-        macs = re.findall(r"Station ([0-9a-f:]{17})", iw_output)
-        if not macs:
-            return None
-        mac = macs[0]  # pick the first (and only) client
-    except subprocess.CalledProcessError:
-        return None
+    """Return the IP of the client on wlan0 that runs the broker, None if there is none yet.
 
-    # Map MAC to IP using arp
-    try:
-        arp_output = subprocess.check_output(["arp", "-n"], text=True)
-        ip_map = {}
-        for line in arp_output.splitlines():
-            parts = line.split()
-            if len(parts) >= 3:
-                ip_addr, _, mac_addr = parts[0], parts[1], parts[2]
-                ip_map[mac_addr.lower()] = ip_addr
-        return ip_map.get(mac.lower())
-    except subprocess.CalledProcessError:
-        return None
+    One round of Discovery.py without waiting; Discovery.find() waits for it.
+    """
+    global _discovery
+    if _discovery is None:
+        _discovery = Discovery()
+    return _discovery.lookup()
     
 
+# ----------- Kit id for the MQTT topics -----------
+def get_kit_id():
+    """Hostname plus the end of the board serial (or wlan0 MAC), unique per kit
+    even when every Pi keeps the default hostname."""
+    suffix = ""
+    try:
+        with open("/proc/cpuinfo") as f:
+            serial = re.search(r"^Serial\s*:\s*([0-9a-f]+)", f.read(), re.M)
+        if serial:
+            suffix = serial.group(1)[-6:]
+    except OSError:
+        pass
+    if not suffix:
+        try:
+            with open("/sys/class/net/wlan0/address") as f:
+                suffix = f.read().strip().replace(":", "")[-6:]
+        except OSError:
+            pass
+    name = socket.gethostname()
+    return f"{name}-{suffix}" if suffix else name
+
+
 class States(Enum):
     Default = 0,
     SettingUpHW = 1,
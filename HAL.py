@@ -0,0 +1,155 @@
+"""
+Hardware abstraction of the kit: status LED, buttons, frequency input and
+the I2C bus of the MPU6050s.
+
+open_hal(config) returns the devices of config["hal"]:
+
+    "pi"   gpiozero RGBLED and Buttons, the edge backend of Frequency.py
+           and smbus.SMBus; these are only imported here, so nothing
+           touches GPIO or I2C before the kit starts
+    "sim"  SimLed and SimButton, SimulatedEdges and the emulated MPU6050s
+           of Acquisition.FakeSMBus, which runs anywhere NumPy does
+
+Both provide led, buttons (button1 and button2), edges and open_bus(), the
+arguments Kit.py takes. The IMU is the bus: FifoSensor drives real and
+emulated MPU6050s alike, so everything above it runs unchanged.
+
+The simulated sensors replay a recorded session (load_traces, a Messdaten
+CSV or .bfhrec file) at the ODR the kit sets up, sim_speed times faster or
+slower, or play a VibrationSignal without a trace; their gyroscopes stand
+still. Each bus transfer takes its time at sim_i2c_hz plus
+sim_i2c_latency of driver overhead.
+"""
+import time
+import numpy as np
+
+import Analysis
+from Acquisition import GRAVITY_MS2, FakeSMBus
+from Channels import is_frequency, stream_kind
+from Frequency import SimulatedEdges, open_edges
+from Vibration import VibrationSignal
+
+I2C_HZ = 400000         # fast mode, i2c_arm_baudrate of Install.txt
+I2C_LATENCY = 60e-6     # seconds of ioctl and driver time per transfer, a rough figure for a Pi
+SIM_FREQUENCY = 25.0    # Hz of the simulated edges without a frequency in the trace
+
+
+class TraceSignal:
+    """A recorded accelerometer stream as a signal of time, looping, in g.
+
+    Samples between the recorded ones are interpolated linearly, so the
+    trace can be replayed at any ODR; speed > 1 plays it faster.
+    """
+
+    def __init__(self, t, values, speed=1.0, frequency=None):
+        """t in ns and values in m/s^2 as Analysis.load() returns them; frequency of the shaft in Hz."""
+        self.t = (t - t[0]) / 1e9
+        self.g = values / GRAVITY_MS2
+        self.duration = self.t[-1]
+        self.speed = speed
+        self.frequency = None if frequency is None else frequency * speed
+
+    def values(self, t):
+        """(n, 3) acceleration in g at the times t (seconds)."""
+        t = np.mod(np.asarray(t, dtype=np.float64) * self.speed, self.duration)
+        return np.column_stack([np.interp(t, self.t, self.g[:, k]) for k in range(3)])
+
+    def __call__(self, t):
+        x, y, z = self.values([t])[0]
+        return float(x), float(y), float(z)
+
+
+def load_traces(path, speed=1.0):
+    """{sensor: TraceSignal} of a recorded session, with the median running frequency of the recording."""
+    streams = Analysis.load(path)
+    frequency = None
+    for name, (_, values) in streams.items():
+        running = values[:, 0][values[:, 0] > 0] if is_frequency(name) else []
+        if len(running):
+            frequency = float(np.median(running))
+    traces = {name: TraceSignal(t, values, speed, frequency)
+              for name, (t, values) in streams.items() if stream_kind(name) == "accel"}
+    if not traces:
+        raise ValueError(f"no accelerometer stream in {path}")
+    return traces
+
+
+class SimLed:
+    """Records what the kit shows instead of lighting anything."""
+
+    def __init__(self):
+        self.color = (0, 0, 0)
+        self.blinks = 0
+
+    def off(self):
+        self.color = (0, 0, 0)
+
+    def blink(self, on_time=1, off_time=1, on_color=(1, 1, 1), n=None, background=True):
+        # Not waited for, a simulated run starts at once
+        self.blinks += 1
+
+
+class SimButton:
+    """A button pressed press_after seconds after it was made (never with None), or by press()."""
+
+    def __init__(self, press_after=None):
+        self.pressed_at = None if press_after is None else time.monotonic() + press_after
+
+    @property
+    def is_active(self):
+        return self.pressed_at is not None and time.monotonic() >= self.pressed_at
+
+    def press(self):
+        self.pressed_at = time.monotonic()
+
+    def release(self):
+        self.pressed_at = None
+
+
+class PiHal:
+
+    def __init__(self, config):
+        from gpiozero import RGBLED, Button
+        self.config = config
+        red, green, blue = config["led_pins"]
+        self.led = RGBLED(red=red, green=green, blue=blue)
+        self.buttons = [Button(pin, pull_up=False) for pin in config["button_pins"]]
+        self.edges = open_edges(config["freq_backend"], config["freq_pin"], config["freq_chip"])
+
+    def open_bus(self):
+        import smbus
+        return smbus.SMBus(self.config["i2c_bus"])
+
+
+class SimHal:
+
+    def __init__(self, config):
+        self.config = config
+        addresses = config["addresses"]
+        trace = config.get("sim_trace")
+        speed = config.get("sim_speed", 1.0)
+        if trace:
+            # One recorded sensor per address, in the order of the recording
+            traces = list(load_traces(trace, speed).values())
+            self.signals = {addr: traces[i % len(traces)] for i, addr in enumerate(addresses)}
+        else:
+            seed = config.get("sim_seed", 1)
+            self.signals = {addr: VibrationSignal(seed * 1000 + i, config["odr"])
+                            for i, addr in enumerate(addresses)}
+        frequency = next(iter(self.signals.values())).frequency or SIM_FREQUENCY
+        self.led = SimLed()
+        self.buttons = [SimButton(config.get("sim_press")), SimButton()]
+        self.edges = SimulatedEdges(frequency, jitter_ns=20_000, seed=config.get("sim_seed", 1))
+
+    def open_bus(self):
+        return FakeSMBus(self.config["addresses"], self.config.get("sim_i2c_hz", I2C_HZ), self.signals,
+                         self.config.get("sim_i2c_latency", I2C_LATENCY))
+
+
+def open_hal(config):
+    """PiHal or SimHal, as config["hal"] says."""
+    if config["hal"] == "pi":
+        return PiHal(config)
+    if config["hal"] == "sim":
+        return SimHal(config)
+    raise ValueError(f"unknown hal {config['hal']!r}")
@@ -1,239 +1,298 @@
-import json
-import csv
-import threading
-import paho.mqtt.client as mqtt
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from collections import deque
+import json
 import time
+import numpy as np
+import Calibration
+import Codec
+import Metrics
+from AsyncIngest import AsyncIngest, BatchQueue, PahoBridge
+from Acquisition import GRAVITY_MS2
+from Channels import (CALIBRATION_PREFIX, FEATURES_PREFIX, GYRO_SUFFIX, PROFILE_PREFIX, ChannelRegistry,
+                      is_frequency, stream_kind)
+from Recorder import SessionRecorder
+from Plotter import LiveFigure
+from Spectral import SpectralStage
 
 # ===============================
 # Configuration
 # ===============================
 MQTT_BROKER = "192.168.4.245"
 MQTT_PORT = 1883
-TOPIC_SENSOR1 = "Sensor/s104"
-TOPIC_SENSOR2 = "Sensor/s105"
-TOPIC_FREQ = "Sensor/Frequency"
+TOPIC_PREFIX = "Sensor"    # kits publish on Sensor/<kit>/<sensor>, see Channels.py
+MAX_CHANNELS = 256         # channels accepted before new topics are ignored
+MAX_PANELS = 8             # channels that get a plot, in order of discovery
 
 MAX_POINTS = 4600
-INITIAL_POINTS = 100
+DECIMATE = True   # draw a min/max envelope per pixel column instead of every sample
+FFT_SEGMENT = 256     # samples per FFT segment (50 % overlap)
+FFT_SEGMENTS = 8      # segments averaged per Welch window
 
 
 timestring = time.strftime("%d_%m_%H_%M_%S")
 CSV_FILE = "Messdaten/Messung_" + timestring + ".csv"
+CSV_FLUSH_INTERVAL = 1.0  # seconds between flushes of the CSV files
+CSV_FSYNC = False         # also force every flush to disk
+RECORD_FORMAT = "both"    # "csv", "chunks" (compressed .bfhrec session file, see Recorder.py) or "both"
+CSV_LAYOUT = "aligned"    # "aligned": both sensors resampled to one clock (Resample.py), "rows": one row per sample
+ALIGN_RATE = None         # Hz of the aligned CSV rows, None: the output rate in the first kit profile
+RINGLOG_DIR = "Messdaten/ringlog"  # memory-mapped logs of the most recent samples per channel, None to disable
+RINGLOG_RECORDS = 1 << 22         # records per channel (~70 min at 1 kHz, 80 MB for x/y/z)
+
+INBOUND_MESSAGES = 500      # messages between paho and the ingest loop before paho has to wait
+RECORD_QUEUE = 1 << 17      # samples queued for the recorder (block: never dropped)
+ANALYTICS_QUEUE = 8192      # samples queued for the spectra (drop_oldest)
+PLOT_QUEUE = MAX_POINTS     # samples queued per frame for the plots (coalesce)
+STATS_INTERVAL = 10         # seconds between ingest counter and latency printouts
+CLOCK_INTERVAL = 2          # seconds between clock pings to the kits (Metrics.ClockSync)
+METRICS_TOPIC = Metrics.METRICS_PREFIX + "/host"  # where the latency report is published, None to disable
+STATS_FILE = CSV_FILE.replace(".csv", "_stats.jsonl")  # reports of host and kits as JSON lines, None to disable
 
 # ===============================
-# Data buffers
+# Recording (sensor CSV + separate frequency file, .bfhrec, ring logs)
 # ===============================
-# Accelerometers
-x1_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-y1_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-z1_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-
-x2_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-y2_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-z2_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-
-freq_data = deque([0]*INITIAL_POINTS, maxlen=MAX_POINTS)
-
-# Message queues
-msg_queue1 = deque()
-msg_queue2 = deque()
-msg_queue_freq = deque()
-data_lock = threading.Lock()
-
-# Flags to show which sensors are active
-sensor1_active = False
-sensor2_active = False
-freq_active = False
+# Files stay open for the whole session, rows are written in the background
+session = SessionRecorder(CSV_FILE, RECORD_FORMAT,
+                          sensors=(),   # the first two sensors to report get the CSV columns
+                          metadata={
+                              "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                              "broker": MQTT_BROKER,
+                              "topics": [f"{TOPIC_PREFIX}/+/+", f"{TOPIC_PREFIX}/+"],
+                          },
+                          flush_interval=CSV_FLUSH_INTERVAL, fsync=CSV_FSYNC,
+                          ringlog_dir=RINGLOG_DIR, ringlog_records=RINGLOG_RECORDS,
+                          csv_layout=CSV_LAYOUT, align_rate=ALIGN_RATE)
 
 # ===============================
-# CSV Logging (sensor data + separate frequency file)
+# Ingest (asyncio loop in a background thread, see AsyncIngest.py)
 # ===============================
-csv_lock = threading.Lock()
-
-# File names
-SENSOR_CSV_FILE = CSV_FILE
-FREQ_CSV_FILE = CSV_FILE.replace(".csv", "_freq.csv")
+# Channels of all kits, created as their first message arrives
+channels = ChannelRegistry(TOPIC_PREFIX, MAX_CHANNELS)
+# Latency per stage from the kit's sensor loop to the plot, see Metrics.py
+telemetry = Metrics.Telemetry()
+stats_file = Metrics.StatsFile(STATS_FILE) if STATS_FILE else None
 
-# Store the latest known readings
-latest_s1 = {'x': '', 'y': '', 'z': ''}
-latest_s2 = {'x': '', 'y': '', 'z': ''}
-
-def log_sensor_samples(timestamp, s1_samples=None, s2_samples=None):
+def record(stream, timestamp, t, values):
     """
-    Logs all sensor samples to the main CSV file.
+    Recorder consumer, runs on the ingest loop.
     """
-    global latest_s1, latest_s2
-
-    with csv_lock:
-        with open(SENSOR_CSV_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-
-            if s1_samples:
-                for s in s1_samples:
-                    latest_s1 = s
-                    writer.writerow([
-                        timestamp,
-                        s.get('x', ''), s.get('y', ''), s.get('z', ''),
-                        latest_s2.get('x', ''), latest_s2.get('y', ''), latest_s2.get('z', '')
-                    ])
-
-            elif s2_samples:
-                for s in s2_samples:
-                    latest_s2 = s
-                    writer.writerow([
-                        timestamp,
-                        latest_s1.get('x', ''), latest_s1.get('y', ''), latest_s1.get('z', ''),
-                        s.get('x', ''), s.get('y', ''), s.get('z', '')
-                    ])
-
-def log_frequency(timestamp, freq):
+    if is_frequency(stream):
+        session.frequency(timestamp, float(values[0, 0]), stream)
+    else:
+        session.samples(stream, str(timestamp), t, values)
+        telemetry.age("record", stream, t)
+
+def analyse(stream, timestamp, t, values):
     """
-    Logs frequency data to its own CSV file.
+    Analytics consumer, runs on the ingest loop.
     """
-    with csv_lock:
-        with open(FREQ_CSV_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, freq])
-
-# ===============================
-# MQTT Callbacks
-# ===============================
-def on_message(client, userdata, msg):
-    global sensor1_active, sensor2_active, freq_active
-
-    payload = json.loads(msg.payload.decode('utf-8'))
-    timestamp = str(payload.get("timestamp", ""))
-
-    with data_lock:
-        if msg.topic == TOPIC_SENSOR1:
-            samples = payload.get('samples', [])
-            if samples:
-                sensor1_active = True
-                msg_queue1.extend(samples)
-                log_sensor_samples(timestamp, s1_samples=samples)
-
-        elif msg.topic == TOPIC_SENSOR2:
-            samples = payload.get('samples', [])
-            if samples:
-                sensor2_active = True
-                msg_queue2.extend(samples)
-                log_sensor_samples(timestamp, s2_samples=samples)
-
-        elif msg.topic == TOPIC_FREQ:
-            freq = payload.get('frequency_hz', 0.0)
-            freq_active = True
-            msg_queue_freq.append(freq)
-            log_frequency(timestamp, freq)
-
+    if stream_kind(stream) == "accel":
+        spectral.add(stream, t, values)
+        spectral.process()
 
-def on_connect(client, userdata, flags, rc):
-    print(f"Connected to MQTT broker with code {rc}")
-    client.subscribe([(TOPIC_SENSOR1, 0), (TOPIC_SENSOR2, 0), (TOPIC_FREQ, 0)])
-    print(f"Subscribed to {TOPIC_SENSOR1}, {TOPIC_SENSOR2}, {TOPIC_FREQ}")
+ingest = AsyncIngest(channels, INBOUND_MESSAGES, telemetry)
+ingest.add_consumer(BatchQueue("recorder", RECORD_QUEUE, "block"), record)
+ingest.add_consumer(BatchQueue("analytics", ANALYTICS_QUEUE, "drop_oldest"), analyse)
+plot_queue = ingest.add_consumer(BatchQueue("plotter", PLOT_QUEUE, "coalesce"))
 
 
 # ===============================
 # Plot setup
 # ===============================
-fig, axs = plt.subplots(3, 1, figsize=(10, 8), sharex=True)
-(ax1, ax2, ax3) = axs
-fig.suptitle("Real-Time Sensor Data")
-
-# --- Sensor 1 ---
-line1x, = ax1.plot([], [], 'r', label='X')
-line1y, = ax1.plot([], [], 'g', label='Y')
-line1z, = ax1.plot([], [], 'b', label='Z')
-ax1.set_ylim(-22, 22)
-ax1.set_ylabel("Accel s104 (g)")
-ax1.legend()
-
-# --- Sensor 2 ---
-line2x, = ax2.plot([], [], 'r', label='X')
-line2y, = ax2.plot([], [], 'g', label='Y')
-line2z, = ax2.plot([], [], 'b', label='Z')
-ax2.set_ylim(-22, 22)
-ax2.set_ylabel("Accel s105 (g)")
-ax2.legend()
-
-# --- Frequency ---
-line_freq, = ax3.plot([], [], 'm', label='Frequency (Hz)')
-ax3.set_ylim(0, 200)
-ax3.set_xlabel("Sample")
-ax3.set_ylabel("Freq (Hz)")
-ax3.legend()
-
-# Hide all plots initially
-ax1.set_visible(False)
-ax2.set_visible(False)
-ax3.set_visible(False)
+# Panels are added as channels appear, each with its own preallocated buffer
+live = LiveFigure([], MAX_POINTS, decimate=DECIMATE)
+fig = live.fig
+panels = {}     # channel name -> panel index
+
+def add_panels():
+    new = channels.channels()[len(panels):]
+    for channel in new:
+        if len(panels) >= MAX_PANELS:
+            panels[channel.name] = None
+            print(f"No panel for {channel.name}, MAX_PANELS = {MAX_PANELS} reached")
+        elif channel.frequency:
+            panels[channel.name] = live.add_panel(
+                {"ylabel": f"Freq {channel.kit} (Hz)" if channel.kit else "Freq (Hz)", "ylim": (0, 200),
+                 "lines": [('Frequency (Hz)', 'm')]})
+        elif channel.kind == "temperature":
+            panels[channel.name] = live.add_panel(
+                {"ylabel": f"Temp {channel.name} (°C)", "ylim": (0, 60), "lines": [('Temperature', 'k')]})
+        elif channel.kind == "gyro":
+            # The full scale of the sensor's profile, which arrives before its first samples
+            limit = profiles.get(channel.name[:-len(GYRO_SUFFIX)], {}).get("gyro_range_dps", 250)
+            panels[channel.name] = live.add_panel(
+                {"ylabel": f"Gyro {channel.name} (°/s)", "ylim": (-limit, limit),
+                 "lines": [('X', 'r'), ('Y', 'g'), ('Z', 'b')]})
+        else:
+            limit = 1.1 * GRAVITY_MS2 * profiles.get(channel.name, {}).get("accel_range_g", 2)
+            panels[channel.name] = live.add_panel(
+                {"ylabel": f"Accel {channel.name} (m/s²)", "ylim": (-limit, limit),
+                 "lines": [('X', 'r'), ('Y', 'g'), ('Z', 'b')]})
+    if new:
+        fig.tight_layout()
+
+# Spectra of the plotted accelerometers, compared with the edge counted frequencies
+spectral = SpectralStage(FFT_SEGMENT, 0.5, FFT_SEGMENTS)
+last_freq = {}
+last_status = None
+
+def plotted_sensors():
+    return [name for name, ix in panels.items() if ix is not None and stream_kind(name) == "accel"]
+
+def spectral_status():
+    parts = []
+    for name in plotted_sensors():
+        r = spectral.latest(name)
+        if r is not None:
+            axis = int(np.argmax(r["rms"]))
+            parts.append(f"{name}: peak {r['dominant_hz'][axis]:.1f} Hz ({'xyz'[axis]}), "
+                         f"rms {np.round(r['rms'], 2).tolist()}")
+    if parts:
+        parts += [f"edges {name}: {f:.1f} Hz" for name, f in last_freq.items()]
+    return "   ".join(parts)
+
+def print_stats():
+    counters, queues = ingest.stats()
+    report = telemetry.report()
+    print(Metrics.format_report(report))
+    report.update(ingest=counters, queues=queues, channels=len(channels))
+    if METRICS_TOPIC:
+        bridge.publish(METRICS_TOPIC, json.dumps(report))
+    if stats_file is not None:
+        stats_file.write(dict(report, source="host"))
+    print(f"Ingest: {counters['messages']} messages, {counters['samples']} samples, "
+          f"{len(channels)} channels, {counters['errors']} errors, inbound {counters['inbound_depth']}/{INBOUND_MESSAGES} "
+          f"(max {counters['inbound_high_water']}), paho waited {counters['submit_blocked_s']:.1f} s")
+    for name, q in queues.items():
+        print(f"  {name:<9} {q['policy']:<11} depth {q['depth']:6d} (max {q['high_water']}), "
+              f"dropped {q['dropped']}, coalesced {q['coalesced']}, blocked {q['blocked_s']:.1f} s")
+    if session.aligner is not None and session.aligner.late:
+        print(f"  aligned CSV: {session.aligner.late} samples arrived too late for their rows")
+    for stream, f in list(last_features.items()):
+        print(f"Features {stream} ({f['window_s']} s): rms {np.round(f['rms'][-1], 3).tolist()}, "
+              f"peak {np.round(f['peak'][-1], 3).tolist()}, crest {np.round(f['crest'][-1], 2).tolist()}")
+
+last_features = {}  # newest feature message per kit sensor
+
+def kit_features(topic, payload):
+    """Features/<kit>/<sensor> of kits that process on the device (Processing.py), runs on paho's thread."""
+    try:
+        batch = Codec.decode_features(payload)
+    except Codec.CodecError:
+        return
+    stream = topic.split("/", 1)[1]
+    session.features(stream, batch)
+    if len(batch["t"]):
+        last_features[stream] = batch
+
+def kit_calibration(topic, payload):
+    """Calibration/<kit>/<sensor>: the sensor's counts are converted with it from now on, runs on paho's thread."""
+    try:
+        d = json.loads(payload)
+        calibration = Calibration.Calibration.from_dict(d)
+    except (ValueError, KeyError, TypeError):
+        print(f"Ignored calibration on {topic}")
+        return
+    stream = topic.split("/", 1)[1]
+    # Published ahead of the run's samples, so it is in place before their first batch is decoded
+    ingest.calibrations[stream] = calibration
+    session.calibration(stream, d)
+    print(f"Calibration {stream}: {d.get('info', {}).get('method', 'nominal')}, ±{d['range_g']} g")
+
+profiles = {}   # acquisition settings per kit sensor
+
+def kit_profile(topic, payload):
+    """Profile/<kit>/<sensor>: the settings of the sensor's run go into the session, runs on paho's thread."""
+    stream = topic.split("/", 1)[1]
+    try:
+        profile = json.loads(payload)
+        line = (f"Profile {stream}: {profile.get('profile')}, {profile['odr']:.0f} Hz, {profile['bandwidth_hz']} Hz "
+                f"low-pass, ±{profile['accel_range_g']} g, {' '.join(profile['channels'])}")
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Dropped profile on {topic}: {e!r}")
+        return
+    if profiles.get(stream) != profile:
+        print(line)
+    profiles[stream] = profile
+    session.profile(stream, profile)
+
+def kit_metrics(topic, payload):
+    """Metrics/<kit> reports of the kits go into the stats file next to the host's."""
+    kit = topic.split("/", 1)[1]
+    if stats_file is not None and topic != METRICS_TOPIC:
+        try:
+            stats_file.write(dict(json.loads(payload), source=kit))
+        except (ValueError, TypeError):
+            pass
 
 # ===============================
 # Update function
 # ===============================
-def update(frame):
-    global sensor1_active, sensor2_active, freq_active
-
-    with data_lock:
-        while msg_queue1:
-            s = msg_queue1.popleft()
-            x1_data.append(s['x'])
-            y1_data.append(s['y'])
-            z1_data.append(s['z'])
-        while msg_queue2:
-            s = msg_queue2.popleft()
-            x2_data.append(s['x'])
-            y2_data.append(s['y'])
-            z2_data.append(s['z'])
-        while msg_queue_freq:
-            f = msg_queue_freq.popleft()
-            freq_data.append(f)
-
-    # Show only active plots
-    ax1.set_visible(sensor1_active)
-    ax2.set_visible(sensor2_active)
-    ax3.set_visible(freq_active)
-
-    # Update Sensor 1
-    if sensor1_active:
-        line1x.set_data(range(len(x1_data)), list(x1_data))
-        line1y.set_data(range(len(y1_data)), list(y1_data))
-        line1z.set_data(range(len(z1_data)), list(z1_data))
-        ax1.set_xlim(max(0, len(x1_data) - MAX_POINTS), len(x1_data))
-
-    # Update Sensor 2
-    if sensor2_active:
-        line2x.set_data(range(len(x2_data)), list(x2_data))
-        line2y.set_data(range(len(y2_data)), list(y2_data))
-        line2z.set_data(range(len(z2_data)), list(z2_data))
-        ax2.set_xlim(max(0, len(x2_data) - MAX_POINTS), len(x2_data))
-
-    # Update Frequency
-    if freq_active:
-        line_freq.set_data(range(len(freq_data)), list(freq_data))
-        ax3.set_xlim(max(0, len(freq_data) - MAX_POINTS), len(freq_data))
-
-    return line1x, line1y, line1z, line2x, line2y, line2z, line_freq
+last_stats = time.monotonic()
+last_ping = 0.0
+drawn = []      # (stream, t) of the batches in the current frame
+
+def update():
+    global last_status, last_stats, last_ping
+
+    if time.monotonic() - last_ping >= CLOCK_INTERVAL:
+        bridge.publish(Metrics.PING_TOPIC, telemetry.clock.ping())
+        last_ping = time.monotonic()
+
+    # Channels are registered before their first batch is queued
+    add_panels()
+    # Coalesced: at most one batch per stream and frame
+    for stream, timestamp, t, values in plot_queue.drain():
+        if is_frequency(stream):
+            last_freq[stream] = values[-1, 0]
+        ix = panels[stream]
+        if ix is None:
+            continue
+        live.extend(ix, values)
+        drawn.append((stream, t))
+        # Show only active plots
+        live.set_active(ix, True)
+
+    # New spectra arrive from the ingest loop
+    status = [r and r["t"] for r in map(spectral.latest, plotted_sensors())]
+    if status != last_status:
+        last_status = status
+        live.set_status(spectral_status())
+
+    if time.monotonic() - last_stats >= STATS_INTERVAL:
+        print_stats()
+        last_stats = time.monotonic()
+
+def rendered():
+    """The frame is on screen: the render stage of its batches."""
+    now = time.time_ns()
+    for stream, t in drawn:
+        telemetry.age("render", stream, t, now)
+    drawn.clear()
 
 # ===============================
 # Start animation
 # ===============================
-ani = FuncAnimation(fig, update, interval=100, blit=False)
+timer = live.start(update, interval=100, after=rendered)
 
 # ===============================
 # MQTT Client
 # ===============================
-client = mqtt.Client()
-client.on_connect = on_connect
-client.on_message = on_message
-client.connect(MQTT_BROKER, MQTT_PORT, 60)
-client.loop_start()
+ingest.start()
+bridge = PahoBridge(ingest, MQTT_BROKER, MQTT_PORT)
+# Kits answer the clock pings, their offsets put the kit stamps on the host clock
+bridge.add_handler(Metrics.PONG_TOPICS, lambda topic, payload: telemetry.clock.pong(topic.split("/")[1], payload))
+bridge.add_handler(Metrics.METRICS_PREFIX + "/+", kit_metrics)
+bridge.add_handler(FEATURES_PREFIX + "/#", kit_features)
+bridge.add_handler(PROFILE_PREFIX + "/#", kit_profile)
+bridge.add_handler(CALIBRATION_PREFIX + "/#", kit_calibration)
+bridge.start()
 
 # ===============================
 # Show plot
 # ===============================
 plt.tight_layout()
 plt.show()
-client.loop_stop()
+print_stats()   # published through the bridge, so while it still runs
+bridge.stop()
+ingest.stop()   # the recorder queue is written out before this returns
+session.close()
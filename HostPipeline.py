@@ -0,0 +1,266 @@
+"""
+Multi-process host: ingest/decode, recording and visualization in separate
+processes, so neither a slow redraw nor disk writes hold the GIL of the
+process that receives the MQTT messages.
+
+    ingest    paho client, decodes every message and writes the samples of
+              each stream to two SharedRings: a lossless one for the
+              recorder and a lossy one for the GUI; the kits' profiles go
+              to both through a Queue each
+    record    drains the lossless rings into a SessionRecorder
+    view      the GUI in the main process (host-mp.py), reads the lossy rings
+
+Each stage counts messages, samples and the time it was busy in a shared
+StageMetrics block; Pipeline.report() turns two snapshots into rates and
+adds the depth, overruns and skipped records of every ring.
+
+The stage functions only take picklable arguments (ring and metrics names,
+a config dict, an Event, the profile Queues), so the pipeline also works with the spawn start
+method used on Windows and macOS.
+"""
+import json
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+import Codec
+from Recorder import SessionRecorder
+from SharedRing import SharedRing, attach
+
+STAGES = ("ingest", "record", "view")
+FIELDS = ("messages", "samples", "busy_s", "errors")
+
+
+class StageMetrics:
+    """Shared counters, one row per stage; each stage only writes its own row."""
+
+    def __init__(self, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=8 * len(STAGES) * len(FIELDS))
+            self.owner = True
+        else:
+            self.shm = attach(name)
+            self.owner = False
+        self.name = self.shm.name
+        self.counters = np.ndarray((len(STAGES), len(FIELDS)), dtype=np.float64, buffer=self.shm.buf)
+        if self.owner:
+            self.counters[:] = 0
+
+    def add(self, stage, messages=0, samples=0, busy=0.0, errors=0):
+        row = self.counters[STAGES.index(stage)]
+        row += (messages, samples, busy, errors)
+
+    def snapshot(self):
+        return self.counters.copy()
+
+    def close(self):
+        self.counters = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Ingest:
+    """Decodes messages into the (record, view) rings of their stream.
+
+    rings maps each stream name to the names of its two rings. The
+    profiles on config["profile_topics"] ({topic: stream name}) are put on
+    the (record, view) profile Queues as (stream name, profile dict), the
+    view only gets the ones that changed.
+    """
+
+    def __init__(self, config, rings, metrics_name, profiles=None):
+        self.topics = config["topics"]
+        self.profile_topics = config.get("profile_topics", {})
+        self.metrics = StageMetrics(metrics_name)
+        self.rings = {name: (SharedRing(r), SharedRing(v)) for name, (r, v) in rings.items()}
+        self.profiles = profiles
+        self.latest = {}
+
+    def profile(self, topic, payload):
+        name = self.profile_topics[topic]
+        try:
+            profile = json.loads(payload)
+            float(profile["odr"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Dropped profile on {topic}: {e!r}")
+            self.metrics.add("ingest", errors=1)
+            return
+        if self.profiles is not None:
+            record, view = self.profiles
+            record.put((name, profile))
+            if self.latest.get(name) != profile:
+                view.put((name, profile))
+        self.latest[name] = profile
+        self.metrics.add("ingest", 1)
+
+    def handle(self, topic, payload):
+        if topic in self.profile_topics:
+            self.profile(topic, payload)
+            return
+        start = time.perf_counter()
+        name = self.topics.get(topic)
+        try:
+            batch = Codec.decode_frequency(payload) if name == "freq" else Codec.decode(payload)
+            t, values = batch["t"], batch["values"]
+        except Codec.CodecError as e:
+            print(f"Dropped message on {topic}: {e}")
+            self.metrics.add("ingest", errors=1)
+            return
+        record, view = self.rings[name]
+        record.write(t, values)
+        view.write(t, values)
+        self.metrics.add("ingest", 1, len(t), time.perf_counter() - start)
+
+    def close(self):
+        for record, view in self.rings.values():
+            record.close()
+            view.close()
+        self.metrics.close()
+
+
+def ingest(config, rings, metrics_name, stop, profiles):
+    """Ingest process: MQTT messages into the rings until stop is set."""
+    import paho.mqtt.client as mqtt
+
+    stage = Ingest(config, rings, metrics_name, profiles)
+
+    def on_message(client, userdata, msg):
+        # paho 2 does not catch what a callback raises, its network loop would end
+        try:
+            stage.handle(msg.topic, msg.payload)
+        except Exception as e:
+            print(f"Dropped message on {msg.topic}: {e!r}")
+            stage.metrics.add("ingest", errors=1)
+
+    def on_connect(client, userdata, flags, reason, properties):
+        print(f"Connected to MQTT broker: {reason}")
+        topics = list(stage.topics) + list(stage.profile_topics)
+        client.subscribe([(topic, 0) for topic in topics])
+        print(f"Subscribed to {', '.join(topics)}")
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(config["broker"], config["port"], 60)
+    client.loop_start()
+    stop.wait()
+    client.loop_stop()
+    client.disconnect()
+    stage.close()
+
+
+def record(config, rings, metrics_name, stop, profiles):
+    """Recording process: drains the profiles and the lossless rings into the session files."""
+    metrics = StageMetrics(metrics_name)
+    attached = {name: SharedRing(r) for name, (r, _) in rings.items()}
+    session = SessionRecorder(config["csv_file"], config["record_format"],
+                              sensors=[n for n in attached if n != "freq"],
+                              metadata=config.get("metadata"),
+                              flush_interval=config["flush_interval"], fsync=config["fsync"],
+                              ringlog_dir=config["ringlog_dir"], ringlog_records=config["ringlog_records"],
+                              csv_layout=config.get("csv_layout", "rows"), align_rate=config.get("align_rate"))
+    while True:
+        # Check before draining, so everything written before stop is recorded
+        stopping = stop.is_set()
+        start = time.perf_counter()
+        # Ahead of the samples, a profile may set the rate of the aligned CSV
+        while True:
+            try:
+                session.profile(*profiles[0].get_nowait())
+            except queue.Empty:
+                break
+        samples = 0
+        for name, ring in attached.items():
+            t, values = ring.read()
+            if not len(t):
+                continue
+            samples += len(t)
+            if name == "freq":
+                for ti, v in zip(t.tolist(), values[:, 0].tolist()):
+                    session.frequency(ti, v)
+            else:
+                session.samples(name, str(t[0]), t, values)
+        if samples:
+            metrics.add("record", 1, samples, time.perf_counter() - start)
+        if stopping:
+            break
+        time.sleep(config["record_interval"])
+    session.close()
+    for ring in attached.values():
+        ring.close()
+    metrics.close()
+
+
+class Pipeline:
+    """Creates the rings and metrics and runs the ingest and record processes.
+
+    streams maps stream names to their number of columns; config holds the
+    broker, topics ({topic: stream name}), profile_topics (the same for the
+    kits' Profile messages) and the SessionRecorder settings.
+    source is the ingest process function, replaced by a generator in the benches.
+    """
+
+    def __init__(self, config, streams, record_capacity, view_capacity, source=ingest):
+        self.config = config
+        self.metrics = StageMetrics()
+        self.rings = {name: (SharedRing(capacity=record_capacity, columns=columns),
+                             SharedRing(capacity=view_capacity, columns=columns, lossless=False))
+                      for name, columns in streams.items()}
+        names = {name: (r.name, v.name) for name, (r, v) in self.rings.items()}
+        self.profiles = (mp.Queue(), mp.Queue())    # (record, view)
+        # Ingest stops first, so the recorder still gets everything it wrote
+        self.stops = [mp.Event(), mp.Event()]
+        self.processes = [mp.Process(target=target, name=f"host-{target.__name__}",
+                                     args=(config, names, self.metrics.name, stop, self.profiles))
+                          for target, stop in zip((source, record), self.stops)]
+        self._last = (time.monotonic(), self.metrics.snapshot())
+
+    def start(self):
+        for p in self.processes:
+            p.start()
+
+    def view(self, name):
+        """The lossy ring the GUI reads a stream from."""
+        return self.rings[name][1]
+
+    def new_profiles(self):
+        """(stream name, profile) of the profiles that changed since the last call, for the GUI."""
+        profiles = []
+        while True:
+            try:
+                profiles.append(self.profiles[1].get_nowait())
+            except queue.Empty:
+                return profiles
+
+    def report(self):
+        """Rates per stage since the previous report, plus the state of every ring."""
+        now, counters = time.monotonic(), self.metrics.snapshot()
+        then, last = self._last
+        self._last = (now, counters)
+        elapsed = max(now - then, 1e-9)
+        delta = counters - last
+        stages = {stage: {
+            "messages_per_s": delta[i, 0] / elapsed,
+            "samples_per_s": delta[i, 1] / elapsed,
+            "busy": delta[i, 2] / elapsed,
+            "errors": int(counters[i, 3]),
+        } for i, stage in enumerate(STAGES)}
+        rings = {name: {
+            "record_depth": len(r), "record_overruns": r.overruns,
+            "view_depth": len(v), "view_skipped": v.skipped,
+        } for name, (r, v) in self.rings.items()}
+        return stages, rings
+
+    def close(self):
+        """Stop the processes (the recorder drains its rings first) and free the shared memory."""
+        for stop, p in zip(self.stops, self.processes):
+            stop.set()
+            p.join()
+        for r, v in self.rings.values():
+            for ring in (r, v):
+                ring.close()
+                ring.unlink()
+        self.metrics.close()
@@ -0,0 +1,602 @@
+"""
+The kit's state machine: sensors, host, broker connection and runs.
+
+sensor-mqtt.py builds a Kit from the real devices and calls run(); the
+benches build one from fakes (Acquisition.FakeSMBus, Discovery.FakeBackend,
+MiniBroker). The states are Functions.States, shown on the LED:
+
+    Default           off       full reset, everything is closed
+    SettingUpHW       red       MPU6050s on the I2C bus
+    ConnectingHost    orange    waiting for the host (Discovery.py)
+    ConnectingBroker  yellow    first MQTT connection to the host
+    Idelling          blue      connected, waiting for button1
+    Preparing         blinking  a run starts
+    Running           green     sampling, spooling and forwarding
+
+Errors are classified by what failed, and only that is set up again:
+
+    SENSOR   an I2C error of a sampler or while setting up: the failed
+             sensors are set up again on the open bus and a run resumes;
+             the broker connection stays. After CONNECT_ATTEMPTS failed
+             set ups the bus is scanned again
+    BROKER   the first connection to the broker failed: retried after a
+             backoff, and after CONNECT_ATTEMPTS the host is looked up
+             again. A connection that breaks later is no error: paho
+             reconnects by itself every reconnect_min..reconnect_max s
+             while the spool (Spool.py) keeps the messages, and if the
+             link stays down for host_lost s and discovery finds the
+             host at another address, the kit connects there instead,
+             without leaving its state
+    UNKNOWN  anything else: everything is closed and the machine starts
+             over from Default, as it did on every error before
+
+Repeated failures wait a backoff doubling from BACKOFF_MIN to BACKOFF_MAX
+seconds. Recovery counts the failures per kind and times each recovery
+until the machine is back in Idelling or Running, and how long the broker
+link was down; the report goes out with the kit's metrics.
+
+The sensors run with the acquisition profile of config["profile"]
+(Acquisition.py), whose gyroscope and temperature channels are published
+as streams of their own (Channels.py). Samples leave the kit as raw
+counts. Every run starts with the settings of each sensor on
+Profile/<kit>/<sensor> and its calibration from the calibration file
+(Calibration.py, nominal without one) on Calibration/<kit>/<sensor>,
+ahead of its samples in the spool; the host records both and converts
+the counts with the calibration.
+"""
+import json
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import Calibration
+import Channels
+import Codec
+import Metrics
+from Acquisition import FifoSensor, Sampler
+from Batching import Batcher
+from Functions import States
+from Processing import Processor
+from RingBuffer import RingBuffer
+from Spool import Forwarder
+
+SENSOR, BROKER, UNKNOWN = "sensor", "broker", "unknown"
+LINK = "link"               # outages of an established broker connection
+CONNECT_ATTEMPTS = 3        # failures before the host is looked up again or the bus rescanned
+BACKOFF_MIN = 0.1           # seconds before the first retry
+BACKOFF_MAX = 5.0           # seconds between retries at most
+HOST_CHECK_INTERVAL = 5.0   # seconds between host lookups while the link is down
+FIND_TIMEOUT = 1.0          # seconds per wait for the host, the state is stepped in between
+
+
+class Failure(Exception):
+    """An error of one of the kinds above; sensors are the indices of the failed sensors."""
+
+    def __init__(self, kind, error, sensors=()):
+        super().__init__(f"{kind} error: {error!r}")
+        self.kind = kind
+        self.error = error
+        self.sensors = sensors
+
+
+class Backoff:
+
+    def __init__(self, minimum=BACKOFF_MIN, maximum=BACKOFF_MAX):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next(self):
+        """Seconds to wait before the next attempt."""
+        delay = min(self.maximum, self.minimum * 2 ** self.attempts)
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
+
+
+class Recovery:
+    """Failures and recovery times per kind."""
+
+    def __init__(self):
+        self.kinds = {}
+        self.pending = None     # (kind, state, monotonic time) of the failure being recovered from
+        self.last = None
+
+    def _kind(self, kind):
+        return self.kinds.setdefault(kind, {"failures": 0, "recoveries": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+    def failed(self, kind, state, error):
+        self._kind(kind)["failures"] += 1
+        if self.pending is None:
+            self.pending = (kind, state, time.monotonic())
+        print(f"{state.name}: {kind} error {error!r}")
+
+    def _record(self, kind, ms):
+        s = self._kind(kind)
+        s["recoveries"] += 1
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+
+    def recovered(self, state):
+        if self.pending is None:
+            return
+        kind, failed_in, since = self.pending
+        self.pending = None
+        ms = (time.monotonic() - since) * 1e3
+        self._record(kind, ms)
+        self.last = {"kind": kind, "failed_in": failed_in.name, "state": state.name, "ms": ms}
+        print(f"Recovered from the {kind} error in {failed_in.name} in {ms:.0f} ms, now {state.name}")
+
+    def outage(self, ms):
+        self._kind(LINK)["failures"] += 1
+        self._record(LINK, ms)
+        print(f"Broker link back after {ms:.0f} ms")
+
+    def report(self):
+        """{kind: {"failures", "recoveries", "mean_ms", "max_ms"}} plus the last recovery."""
+        out = {kind: {"failures": s["failures"], "recoveries": s["recoveries"],
+                      "mean_ms": s["total_ms"] / s["recoveries"] if s["recoveries"] else 0.0,
+                      "max_ms": s["max_ms"]}
+               for kind, s in self.kinds.items()}
+        return {"kinds": out, "last": self.last}
+
+
+class Kit:
+
+    def __init__(self, config, led, button, open_bus, freq_meter, discovery, spool):
+        """config holds the settings of sensor-mqtt.py by lower case name; open_bus() returns an SMBus."""
+        if config["payload_format"] == "json" and list(config["profile"]["channels"]) != ["accel"]:
+            raise ValueError("JSON payloads carry only the accelerometer, use binary ones for gyro and temp")
+        self.config = config
+        self.kit_id = config["kit_id"]
+        self.led = led
+        self.button = button
+        self.open_bus = open_bus
+        self.freq_meter = freq_meter
+        self.discovery = discovery
+        self.spool = spool
+        self.state = States.Default
+        self.recovery = Recovery()
+        self.backoff = Backoff()
+
+        self.bus = None
+        self.sensors = []
+        self.names = []
+        self.calibrations = {}      # sensor name -> Calibration at the sensor's range
+        self.failed = set()         # sensors to set up again
+        self.host = None
+        self.client = None
+        self.forwarder = None
+        self.connect_attempts = 0
+        self.link_down = None       # monotonic time the broker link went down
+        self.host_checked = 0.0
+        self.waiting_since = None
+        self.resume = False         # start the run again once the sensors are back
+        self.down = False
+        self.samplers = []
+        self.processors = []
+        self.batchers = []
+        self.frequency = 0.0
+        self.last_publish = time.time()
+        self.last_stats = time.time()
+
+    # ------------ STATEMACHINE ---------------
+    def run(self, stop=None):
+        """Step the machine until the threading.Event stop is set (forever without one)."""
+        while stop is None or not stop.is_set():
+            self.step()
+
+    def step(self):
+        try:
+            match self.state:
+
+                case States.Default: #OFF
+                    self.led.off()
+                    self._close()
+                    time.sleep(self.backoff.next())
+                    self.state = States.SettingUpHW
+
+                case States.SettingUpHW: #RED
+                    self.led.color = (1, 0, 0)
+                    self._setup_hw()
+
+                case States.ConnectingHost: #ORANGE
+                    self.led.color = (1, 0.45, 0)
+                    self._find_host()
+
+                case States.ConnectingBroker: #YELLOW
+                    self.led.color = (1, 1, 0)
+                    try:
+                        self.client = self._connect(self.host)
+                    except OSError as e:
+                        raise Failure(BROKER, e)
+                    self.forwarder = Forwarder(self.spool, self.client, self.config["forward_window"])
+                    self.connect_attempts = 0
+                    self.down = False
+                    self.state = States.Idelling
+
+                case States.Idelling: #BLUE
+                    self.led.color = (0, 0, 1)
+                    time.sleep(self.config["publish_tick"])
+                    # Whatever a run left in the spool goes out now
+                    self._forward()
+                    self._watch_link()
+
+                    if not self.button.is_active:
+                        self.down = True
+                    if self.button.is_active and self.down:
+                        self.state = States.Preparing
+
+                case States.Preparing: #BLUE BLINK
+                    self.led.blink(on_time=0.5, off_time=0.5, on_color=(0, 0, 1), n=5, background=False)
+                    self._start_run()
+                    self.state = States.Running
+
+                case States.Running: #GREEN
+                    self.led.color = (0, 1, 0)
+                    self._run_tick()
+
+        except Failure as f:
+            self._recover(f)
+        except Exception as e:
+            self._recover(Failure(UNKNOWN, e))
+
+        if self.recovery.pending is not None and self.state in (States.Idelling, States.Running):
+            self.recovery.recovered(self.state)
+            self.backoff.reset()
+
+    def _recover(self, failure):
+        state = self.state
+        self.recovery.failed(failure.kind, state, failure.error)
+        if failure.kind == SENSOR:
+            self.failed.update(failure.sensors)
+            if state == States.Running:
+                # Keep what was sampled, the run goes on after the sensors are set up again
+                self._stop_run()
+                self.resume = True
+            else:
+                if self.backoff.attempts >= CONNECT_ATTEMPTS:
+                    # The sensor stays away: scan the bus again, the broker connection stays
+                    self._close_bus()
+                time.sleep(self.backoff.next())
+            self.state = States.SettingUpHW
+        elif failure.kind == BROKER:
+            self.connect_attempts += 1
+            if self.connect_attempts >= CONNECT_ATTEMPTS:
+                print(f"No broker at {self.host} after {self.connect_attempts} attempts, looking for the host again")
+                # From Idelling or Running: end the run, what it sampled waits in the spool
+                try:
+                    self._stop_run()
+                except Exception:
+                    self.samplers = []
+                # The broker would drop the next connection for this one with the same client id
+                if self.client is not None:
+                    try:
+                        self._close_client(self.client)
+                    except Exception:
+                        pass
+                self.client = None
+                self.forwarder = None
+                self.link_down = None
+                self.discovery.forget()
+                self.connect_attempts = 0
+                self.state = States.ConnectingHost
+            time.sleep(self.backoff.next())
+        else:
+            try:
+                self._stop_run()
+            except Exception:
+                self.samplers = []
+            self.spool.flush()
+            self.resume = False
+            self.state = States.Default
+
+    # ------------ Sensors ---------------
+    def _setup_hw(self):
+        if self.bus is None:
+            self.bus = self.open_bus()
+        if not self.sensors:
+            self._connect_sensors()
+        else:
+            # The bus and the other sensors stay as they are
+            for ix in sorted(self.failed or range(len(self.sensors))):
+                try:
+                    self.sensors[ix].setup()
+                except (TimeoutError, OSError) as e:
+                    raise Failure(SENSOR, e, (ix,))
+                print(f"Set up MPU6050 at 0x{self.sensors[ix].address:02X} again")
+        self.failed = set()
+        if self.client is None:
+            self.state = States.ConnectingHost
+        elif self.resume:
+            self.resume = False
+            self._start_run()
+            self.state = States.Running
+        else:
+            self.state = States.Idelling
+
+    def _connect_sensors(self):
+        # Read on every scan of the bus, calibrate-sensors.py may have run in between
+        calibrations = Calibration.load(self.config.get("calibration", Calibration.CALIBRATION_PATH))
+        for addr in self.config["addresses"]:
+            try:
+                sensor = FifoSensor.from_profile(self.bus, addr, self.config["profile"])
+                sensor.setup()
+                name = "s" + str(addr)
+                self.sensors.append(sensor)
+                self.names.append(name)
+                calibration = calibrations.get(name, Calibration.Calibration(sensor.accel_scale))
+                self.calibrations[name] = calibration.at_range(sensor.accel_scale)
+                print(f"Connected to MPU6050 at 0x{addr:02X} ({sensor.odr:.0f} Hz FIFO, "
+                      f"profile {self.config['profile']['name']}: {' '.join(sensor.channels)})")
+                if self.config["poll_interval"] > sensor.fifo_seconds / 2:
+                    print(f"POLL_INTERVAL is more than half of the {sensor.fifo_seconds * 1e3:.0f} ms "
+                          f"the FIFO takes to fill, expect overruns")
+            except (TimeoutError, OSError) as e:
+                print(f"No response from 0x{addr:02X}: {e}")
+        if not self.sensors:
+            raise Failure(SENSOR, OSError("no MPU6050 on the bus"))
+
+    # ------------ Host and broker ---------------
+    def _find_host(self):
+        if self.waiting_since is None:
+            print("Waiting for a client to connect to the Pi AP...")
+            self.waiting_since = time.monotonic()
+        ip = self.discovery.find(timeout=FIND_TIMEOUT)
+        if ip is None:
+            return
+        print(f"Detected client IP: {ip} after {(time.monotonic() - self.waiting_since) * 1e3:.0f} ms")
+        self.waiting_since = None
+        self.host = ip
+        self.state = States.ConnectingBroker
+
+    def _connect(self, broker_ip):
+        """A connected, looping paho client; OSError if the broker does not accept the connection."""
+        kit_id = self.kit_id
+        # One client id per kit, the broker drops the older of two connections with the same id
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"kit-{kit_id}")
+        # Answer the host's clock pings right away, they measure the offset between the clocks
+        client.on_connect = lambda client, userdata, flags, reason, properties: client.subscribe(Metrics.PING_TOPIC)
+        client.message_callback_add(Metrics.PING_TOPIC, lambda client, userdata, msg: client.publish(
+            Metrics.pong_topic(kit_id), Metrics.pong_payload(msg.payload, time.time_ns())))
+        # Spooled messages go at QoS 1, paho resends what is in flight after it reconnected by itself
+        client.max_inflight_messages_set(self.config["forward_window"])
+        client.reconnect_delay_set(self.config["reconnect_min"], self.config["reconnect_max"])
+        client.connect_timeout = self.config["connect_timeout"]
+
+        client.connect(broker_ip, self.config["port"], 60)
+        client.loop_start()
+        deadline = time.monotonic() + self.config["connect_timeout"]
+        while not client.is_connected():
+            if time.monotonic() > deadline:
+                self._close_client(client)
+                raise TimeoutError(f"no CONNACK from {broker_ip}")
+            time.sleep(0.005)
+        print(f"Connected to MQTT broker at {broker_ip}")
+        print(f"Publishing accelerometer data to {broker_ip} on {Channels.topic(kit_id, '+')}...")
+        return client
+
+    def _close_client(self, client):
+        # Disconnecting first wakes paho's loop, which then ends at once
+        client.disconnect()
+        client.loop_stop()
+
+    def _forward(self):
+        try:
+            self.forwarder.pump()
+        except OSError as e:
+            # The spooled messages stay, the next pump tries again
+            raise Failure(BROKER, e)
+
+    def _watch_link(self):
+        """Time broker outages; move to the host's new address if it has one."""
+        now = time.monotonic()
+        if self.client.is_connected():
+            if self.link_down is not None:
+                self.recovery.outage((now - self.link_down) * 1e3)
+                self.link_down = None
+            return
+        if self.link_down is None:
+            print(f"Broker link to {self.host} lost, paho reconnects")
+            self.link_down = now
+        if now - self.link_down < self.config["host_lost"] or now - self.host_checked < HOST_CHECK_INTERVAL:
+            return
+        self.host_checked = now
+        ip = self.discovery.lookup()
+        if ip is None or ip == self.host:
+            return
+        print(f"Host moved from {self.host} to {ip}")
+        try:
+            client = self._connect(ip)
+        except OSError as e:
+            print(f"No broker at {ip}: {e!r}")
+            return
+        old, self.client, self.host = self.client, client, ip
+        # The new connection starts again from the last acknowledged message
+        self.forwarder = Forwarder(self.spool, client, self.config["forward_window"])
+        self._close_client(old)
+
+    # ------------ Runs ---------------
+    def _start_run(self):
+        c = self.config
+        self.samplers = []
+        for s in self.sensors:
+            s.reset()
+            buffer = RingBuffer(int(s.odr * c["buffer_seconds"]), s.width)
+            sampler = Sampler(s, buffer, c["poll_interval"])
+            sampler.start()
+            self.samplers.append(sampler)
+        self.processors = [Processor(s.period_ns, c["processing"], c["decimation"], c["feature_window"],
+                                     feature_columns=s.columns["accel"])
+                           for s in self.sensors]
+        # Decimated samples leave the filter already delay_ns old
+        self.batchers = [Batcher(c["max_batch_latency"] + p.delay_ns / 1e9, c["max_batch_samples"])
+                         for p in self.processors]
+        # The host records and converts the run's counts with these, so they go out ahead of the first batch
+        for name, s, p in zip(self.names, self.sensors, self.processors):
+            topic = Channels.topic(self.kit_id, name, Channels.PROFILE_PREFIX)
+            # output_hz: the rate the samples are published at, after the decimator
+            settings = dict(s.settings(), profile=c["profile"]["name"], output_hz=1e9 / p.output_period_ns)
+            self.spool.append(topic, json.dumps(settings).encode())
+            topic = Channels.topic(self.kit_id, name, Channels.CALIBRATION_PREFIX)
+            self.spool.append(topic, json.dumps(self.calibrations[name].to_dict()).encode())
+
+    def _stop_run(self):
+        """Stop sampling and spool everything sampled so far."""
+        samplers, self.samplers = self.samplers, []
+        now = time.time_ns()
+        for ix, s in enumerate(samplers):
+            s.stop()
+            # What the sampler read before it stopped, also after an error
+            t, counts, features = self.processors[ix].process(*s.buffer.read())
+            self.batchers[ix].add(t, counts)
+            self._publish_samples(ix, now, self._take_batches(self.batchers[ix], flush=True))
+            self._publish_features(ix, features)
+        self.spool.flush()
+
+    def _run_tick(self):
+        c = self.config
+        time.sleep(c["publish_tick"])
+        now = time.time_ns()
+        for ix, s in enumerate(self.samplers):
+            # --- Take all samples the sampling thread has buffered ---
+            if s.error is not None:
+                raise Failure(SENSOR, s.error, (ix,))
+            t, counts = s.buffer.read()
+            acquired = time.time_ns()
+            t, counts, features = self.processors[ix].process(t, counts)
+            self.batchers[ix].add(t, counts, acquired)
+            self._publish_samples(ix, now, self._take_batches(self.batchers[ix]))
+            self._publish_features(ix, features)
+
+        if (time.time() - self.last_publish) >= c["freq_interval"]:
+            #FREQUENCY
+            self.frequency = self.freq_meter.update()
+            topic = Channels.topic(self.kit_id, Channels.FREQ_TOPIC)
+            payload = json.dumps({
+                "timestamp": now,
+                "frequency_hz": round(self.frequency, 2)
+            })
+            self.spool.append(topic, payload.encode())
+            self.last_publish = time.time()
+
+        self._forward()
+        self._watch_link()
+
+        if (time.time() - self.last_stats) >= c["stats_interval"]:
+            self._print_stats()
+            self.last_stats = time.time()
+
+        if not self.button.is_active:
+            self._stop_run()
+            # Stay connected, the spool drains while idle
+            self.state = States.Idelling
+
+    def _print_stats(self):
+        reports = []
+        for ix, s in enumerate(self.samplers):
+            fifo_overruns, buffer_overruns = s.overruns()
+            print(f"Sensor {self.names[ix]}: {s.stats.summary()}, "
+                  f"overruns fifo={fifo_overruns} buffer={buffer_overruns}")
+            b = self.batchers[ix].report()
+            reports.append(b)
+            print(f"Published Sensor {self.names[ix]}: {b['messages_per_s']:.1f} msg/s, "
+                  f"{b['samples_per_message']:.1f} samples/msg, "
+                  f"latency {b['latency_ms']:.1f} ms (max {b['latency_max_ms']:.1f} ms)")
+        meter = self.freq_meter
+        print(f"Frequency: {self.frequency:.2f} Hz "
+              f"({meter.periods} periods, {meter.rejected} edges rejected, "
+              f"{meter.source.overruns()} edges dropped)")
+        spool = self.spool
+        print(f"Spool: {self.forwarder.backlog_bytes / 1e6:.2f} MB to send, "
+              f"{spool.pending_bytes / 1e6:.2f} MB unacknowledged, "
+              f"{spool.dropped_bytes / 1e6:.1f} MB dropped over {spool.max_bytes / 1e6:.0f} MB")
+        for kind, r in self.recovery.report()["kinds"].items():
+            print(f"Recovery {kind}: {r['failures']} failures, {r['recoveries']} recovered "
+                  f"in {r['mean_ms']:.0f} ms (max {r['max_ms']:.0f} ms)")
+        self._publish_metrics(reports)
+
+    def _publish_metrics(self, reports):
+        """Sampling and publish statistics of this kit on Metrics/<kit>."""
+        sensors = {}
+        for ix, s in enumerate(self.samplers):
+            fifo_overruns, buffer_overruns = s.overruns()
+            sensors[self.names[ix]] = dict(reports[ix], interval_us=s.stats.mean / 1e3,
+                                           jitter_us=s.stats.jitter_ns() / 1e3, gaps=s.stats.gaps,
+                                           fifo_overruns=fifo_overruns, buffer_overruns=buffer_overruns)
+        meter = self.freq_meter
+        self.client.publish(f"{Metrics.METRICS_PREFIX}/{self.kit_id}", json.dumps({
+            "time": time.time(), "sensors": sensors, "frequency_hz": self.frequency,
+            "frequency_periods": meter.periods, "edges_rejected": meter.rejected,
+            "edges_dropped": meter.source.overruns(), "recovery": self.recovery.report(),
+        }))
+
+    def _encode_samples(self, ix, timestamp, t, counts, acquired):
+        """(topic, payload) of each stream of a batch: the accelerometer, then gyro and temp if sampled."""
+        c = self.config
+        name, sensor = self.names[ix], self.sensors[ix]
+        acquired = acquired if c["stamp_payloads"] else None
+        accel = counts[:, sensor.columns["accel"]]
+        if c["payload_format"] == "json":
+            payload = Codec.encode_json(timestamp, t, self.calibrations[name].apply(accel), acquired=acquired)
+            return [(Channels.topic(self.kit_id, name), payload.encode())]
+        # Binary batches are uniformly spaced, use the period the timeline actually has
+        decimation = c["decimation"] if c["processing"] in ("decimated", "both") else 1
+        period = (t[-1] - t[0]) / (len(t) - 1) if len(t) > 1 else sensor.period_ns * decimation
+        payloads = [(Channels.topic(self.kit_id, name),
+                     Codec.encode_binary(name, t[0], period, accel, sensor.convert(1), acquired))]
+        if "gyro" in sensor.columns:
+            gyro = name + Channels.GYRO_SUFFIX
+            payloads.append((Channels.topic(self.kit_id, gyro), Codec.encode_binary(
+                gyro, t[0], period, counts[:, sensor.columns["gyro"]], sensor.convert_gyro(1), acquired)))
+        if "temp" in sensor.columns:
+            # Counts with an offset, sent as float32 degrees
+            temp = name + Channels.TEMPERATURE_SUFFIX
+            celsius = sensor.convert_temperature(counts[:, sensor.columns["temp"]].astype(np.float32))
+            payloads.append((Channels.topic(self.kit_id, temp),
+                             Codec.encode_binary(temp, t[0], period, celsius, 1.0, acquired)))
+        return payloads
+
+    def _take_batches(self, batcher, flush=False):
+        """(t, counts, acquired) of the batches that are due, or of all pending samples."""
+        batches = []
+        while batcher.pending and (flush or batcher.due()):
+            t, counts = batcher.take()
+            batches.append((t, counts, batcher.acquired))
+        return batches
+
+    def _publish_samples(self, ix, timestamp, batches):
+        for t, counts, acquired in batches:
+            for topic, payload in self._encode_samples(ix, timestamp, t, counts, acquired):
+                self.spool.append(topic, payload)
+
+    def _publish_features(self, ix, features):
+        if features is None:
+            return
+        topic = Channels.topic(self.kit_id, self.names[ix], Channels.FEATURES_PREFIX)
+        payload = Codec.encode_features(self.names[ix], self.config["feature_window"], features,
+                                        self.sensors[ix].convert(1))
+        self.spool.append(topic, payload.encode())
+
+    def _close(self):
+        """Close the broker connection and the bus, for a full reset."""
+        if self.client is not None:
+            try:
+                self._close_client(self.client)
+            except Exception:
+                pass
+        self.client = None
+        self.forwarder = None
+        self.link_down = None
+        self._close_bus()
+
+    def _close_bus(self):
+        if self.bus is not None:
+            self.bus.close()
+        self.bus = None
+        self.sensors = []
+        self.names = []
+        self.calibrations = {}
+        self.failed = set()
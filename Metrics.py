@@ -0,0 +1,288 @@
+"""
+Latency and throughput instrumentation from the sensor loop to the plot.
+
+Every sample batch is followed through these stages; each is stamped when
+the batch leaves it:
+
+    acquire   the Pi's sensor loop read the newest sample        (Pi clock)
+    publish   the payload was encoded and handed to paho         (Pi clock)
+    receive   paho on the host delivered the message             (host clock)
+    decode    the ingest loop decoded it
+    record    the recorder queued it for writing
+    render    the plot drew it
+
+The Pi stamps travel in the payload (Codec "stamps"). Telemetry keeps, per
+stage, a LatencyHistogram of the age of the newest sample when the batch
+left that stage, plus messages and samples for the rates. The Pi stamps
+are moved to the host clock with the offset ClockSync estimates, so the
+ages of all stages share one time base and a table of them shows where
+time goes.
+
+ClockSync works like NTP. The host publishes Clock/ping with its send time
+t1. Every kit answers on Clock/<kit>/pong with t1, its receive time t2 and
+its send time t3, and the host notes the arrival t4:
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2     kit clock minus host clock
+    delay  = (t4 - t1) - (t3 - t2)           round trip on the wire
+
+Of the last CLOCK_SAMPLES answers the one with the smallest delay is used:
+its offset error is at most half its delay.
+
+report() gives rates and percentiles per stage since the previous report
+and the totals; Host.py publishes it on Metrics/host and appends it to a
+JSON lines stats file, sensor-mqtt.py publishes its own on Metrics/<kit>.
+"""
+import json
+import threading
+import time
+from collections import deque
+import numpy as np
+
+STAGES = ("acquire", "publish", "receive", "decode", "record", "render")
+PERCENTILES = (50, 90, 99, 99.9)
+CLOCK_SAMPLES = 16
+PING_TOPIC = "Clock/ping"
+PONG_TOPICS = "Clock/+/pong"
+METRICS_PREFIX = "Metrics"
+
+
+def pong_topic(kit):
+    return f"Clock/{kit}/pong"
+
+
+class LatencyHistogram:
+    """HDR-style histogram of non-negative integers (µs by default).
+
+    Values up to 2 ** sub_bits are counted exactly, above that every power
+    of two range is split into 2 ** (sub_bits - 1) buckets, so a value is
+    off by less than 1 part in 2 ** (sub_bits - 1) (0.8 % with the
+    default 8 bits) over the whole range up to highest. Recording a value
+    is one increment, merging two histograms an addition.
+    """
+
+    def __init__(self, highest=3_600_000_000, sub_bits=8):
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.highest = highest
+        self.counts = np.zeros(self._index(np.array([highest]))[0] + 1, dtype=np.int64)
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, values):
+        # Bits above the sub-bucket resolution select the power of two range
+        exponent = np.frexp(values.astype(np.float64))[1]
+        bucket = np.maximum(exponent - self.sub_bits, 0)
+        return bucket * self.half + (values >> bucket)
+
+    def _value(self, index):
+        """Highest value that falls into a bucket."""
+        bucket = np.maximum(index // self.half - 1, 0)
+        return ((index - bucket * self.half + 1) << bucket) - 1
+
+    def record(self, values):
+        """Count one value or an array of values; negatives count as 0, too large ones as highest."""
+        if isinstance(values, (int, np.integer)):
+            # One value per message is the common case, keep it out of NumPy
+            v = min(max(int(values), 0), self.highest)
+            bucket = max(v.bit_length() - self.sub_bits, 0)
+            self.counts[bucket * self.half + (v >> bucket)] += 1
+            self.total += 1
+            self.min = v if self.min is None else min(self.min, v)
+            self.max = max(self.max, v)
+            self.sum += v
+            return
+        values = np.clip(np.atleast_1d(np.asarray(values, dtype=np.int64)), 0, self.highest)
+        if not len(values):
+            return
+        np.add.at(self.counts, self._index(values), 1)
+        self.total += len(values)
+        low = int(values.min())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = max(self.max, int(values.max()))
+        self.sum += int(values.sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sum += other.sum
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def percentile(self, p):
+        if not self.total:
+            return 0
+        rank = max(1, int(np.ceil(p / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(int(self._value(index)), self.max)
+
+    def summary(self, scale=1e-3):
+        """count, mean, max and PERCENTILES, in ms for µs values."""
+        result = {"count": self.total,
+                  "mean": self.sum / self.total * scale if self.total else 0.0,
+                  "max": self.max * scale}
+        for p in PERCENTILES:
+            result[f"p{p:g}"] = self.percentile(p) * scale
+        return result
+
+
+class ClockSync:
+    """Offset of each kit's clock against the host clock, from ping/pong exchanges."""
+
+    def __init__(self, samples=CLOCK_SAMPLES):
+        self.samples = {}
+        self.size = samples
+        self._best = {}
+        self._lock = threading.Lock()
+
+    def ping(self):
+        """Payload for PING_TOPIC."""
+        return json.dumps({"t1": time.time_ns()})
+
+    def pong(self, kit, payload, received=None):
+        """Take a kit's answer; returns (offset, delay) in ns or None if unreadable."""
+        t4 = time.time_ns() if received is None else received
+        try:
+            data = json.loads(payload)
+            t1, t2, t3 = int(data["t1"]), int(data["t2"]), int(data["t3"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        offset = ((t2 - t1) + (t3 - t4)) // 2
+        delay = (t4 - t1) - (t3 - t2)
+        with self._lock:
+            window = self.samples.setdefault(kit, deque(maxlen=self.size))
+            window.append((delay, offset))
+            self._best[kit] = min(window)
+        return offset, delay
+
+    def offset(self, kit):
+        """Kit clock minus host clock in ns, None before the first answer."""
+        best = self._best.get(kit)
+        return best[1] if best else None
+
+    def error(self, kit):
+        """Upper bound of the offset error in ns (half the round trip used)."""
+        best = self._best.get(kit)
+        return best[0] // 2 if best else None
+
+    def state(self):
+        return {kit: {"offset_ms": best[1] / 1e6, "error_ms": best[0] / 2e6}
+                for kit, best in list(self._best.items())}
+
+
+def pong_payload(ping, received, sent=None):
+    """A kit's answer to a ping payload, received at `received` ns and sent at `sent` (default now) on its clock."""
+    t1 = json.loads(ping)["t1"]
+    return json.dumps({"t1": t1, "t2": received, "t3": time.time_ns() if sent is None else sent})
+
+
+class Telemetry:
+    """Per stage latency histograms (ms in reports) and rates, safe to use from several threads.
+
+    Latencies are the age of the newest sample of a batch when it left a
+    stage. Streams are "<kit>/<sensor>" names (Channels.py); the kit picks
+    the clock offset for its samples. Without an offset yet, the host
+    stages of that kit are not recorded, the acquire and publish stages
+    (both on the Pi clock) are.
+    """
+
+    def __init__(self, clock=None, stages=STAGES):
+        self.clock = clock or ClockSync()
+        self.stages = stages
+        self.window = {s: LatencyHistogram() for s in stages}
+        self.totals = {s: LatencyHistogram() for s in stages}
+        self.counts = {s: [0, 0] for s in stages}       # messages, samples since the last report
+        self.unsynced = 0
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self._start = self._last
+
+    def _to_host(self, stream):
+        kit = stream.rsplit("/", 1)[0] if "/" in stream else ""
+        return self.clock.offset(kit)
+
+    def _add(self, stage, age_ns, samples):
+        with self._lock:
+            self.window[stage].record(age_ns // 1000)
+            self.counts[stage][0] += 1
+            self.counts[stage][1] += samples
+
+    def message(self, stream, batch, received, decoded):
+        """Stages up to decode of one message, from its Pi stamps and the host stamps in ns."""
+        t = batch["t"]
+        if not len(t):
+            return
+        newest = int(t[-1])
+        stamps = batch.get("stamps")
+        if stamps:
+            self._add("acquire", stamps["acquired"] - newest, len(t))
+            self._add("publish", stamps["published"] - newest, len(t))
+        offset = self._to_host(stream)
+        if offset is None:
+            self.unsynced += 1
+            return
+        self._add("receive", received - (newest - offset), len(t))
+        self._add("decode", decoded - (newest - offset), len(t))
+
+    def age(self, stage, stream, t, now=None):
+        """A host stage is done with the samples t (Pi clock ns) of a stream."""
+        if not len(t):
+            return
+        offset = self._to_host(stream)
+        if offset is None:
+            return
+        now = time.time_ns() if now is None else now
+        self._add(stage, now - (int(t[-1]) - offset), len(t))
+
+    def report(self):
+        """Rates and latencies per stage since the previous report, then the totals."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._last, 1e-9)
+            stages = {}
+            for s in self.stages:
+                messages, samples = self.counts[s]
+                stages[s] = dict(self.window[s].summary(),
+                                 messages_per_s=messages / elapsed, samples_per_s=samples / elapsed)
+                self.totals[s].merge(self.window[s])
+                self.window[s].reset()
+                self.counts[s] = [0, 0]
+            totals = {s: self.totals[s].summary() for s in self.stages}
+            self._last = now
+        return {"time": time.time(), "interval_s": elapsed, "uptime_s": now - self._start,
+                "stages": stages, "totals": totals, "clocks": self.clock.state(), "unsynced": self.unsynced}
+
+
+def format_report(report):
+    """Table of a Telemetry report for the console."""
+    lines = [f"{'stage':<8}{'msg/s':>8}{'samples/s':>11}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+             f"{'p99.9 ms':>10}{'max ms':>9}"]
+    for stage, s in report["stages"].items():
+        if s["count"]:
+            lines.append(f"{stage:<8}{s['messages_per_s']:>8.1f}{s['samples_per_s']:>11.0f}{s['p50']:>9.2f}"
+                         f"{s['p90']:>9.2f}{s['p99']:>9.2f}{s['p99.9']:>10.2f}{s['max']:>9.2f}")
+    for kit, c in report["clocks"].items():
+        lines.append(f"clock {kit or '(no kit id)'}: offset {c['offset_ms']:+.3f} ms +- {c['error_ms']:.3f} ms")
+    return "\n".join(lines)
+
+
+class StatsFile:
+    """Appends reports as JSON lines, from any thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, report):
+        line = json.dumps(report) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
@@ -0,0 +1,176 @@
+"""
+Minimal MQTT 3.1.1 broker for the benches and for runs without mosquitto.
+
+Supports what the kit uses: CONNECT, SUBSCRIBE/UNSUBSCRIBE with + and #
+wildcards, PUBLISH at QoS 0 and 1 (forwarded at QoS 0), PINGREQ and
+DISCONNECT. No retained messages, sessions or authentication.
+
+A subscriber that does not keep up slows down the publishers: forwarding
+waits until the subscriber's socket buffer has drained, so backpressure
+reaches the publishing client through TCP instead of piling up in memory.
+
+    python MiniBroker.py [--port 1883]
+"""
+import argparse
+import asyncio
+import struct
+import threading
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter matching with + and #."""
+    p, t = pattern.split("/"), topic.split("/")
+    for i, level in enumerate(p):
+        if level == "#":
+            return True
+        if i >= len(t) or (level != "+" and level != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+def _packet(kind, body, flags=0):
+    header = bytearray([kind << 4 | flags])
+    n = len(body)
+    while True:
+        byte, n = n % 128, n // 128
+        header.append(byte | (0x80 if n else 0))
+        if not n:
+            break
+    return bytes(header) + body
+
+
+def _string(data, pos):
+    n = struct.unpack_from(">H", data, pos)[0]
+    return data[pos + 2:pos + 2 + n].decode(), pos + 2 + n
+
+
+class _Client:
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.filters = set()
+
+
+class MiniBroker:
+
+    def __init__(self, host="127.0.0.1", port=1883):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self.messages_in = 0
+        self.messages_out = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self._tasks = set()
+
+    async def serve(self, started=None):
+        """Run the broker on the current event loop until stop() or cancellation."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if started is not None:
+            started.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            self._server.close()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def start(self):
+        """Run the broker in a background thread; returns the port (useful with port=0)."""
+        started = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(started),),
+                                        name="mini-broker", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _read_packet(self, reader):
+        first = (await reader.readexactly(1))[0]
+        length, shift = 0, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+    async def _handle(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        self._tasks.add(asyncio.current_task())
+        try:
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                if kind == CONNECT:
+                    writer.write(_packet(CONNACK, b"\x00\x00"))
+                elif kind == PUBLISH:
+                    await self._publish(writer, flags, body)
+                elif kind == SUBSCRIBE:
+                    packet_id, pos, granted = body[:2], 2, bytearray()
+                    while pos < len(body):
+                        pattern, pos = _string(body, pos)
+                        pos += 1
+                        client.filters.add(pattern)
+                        granted.append(0)
+                    writer.write(_packet(SUBACK, packet_id + bytes(granted)))
+                elif kind == UNSUBSCRIBE:
+                    pos = 2
+                    while pos < len(body):
+                        pattern, pos = _string(body, pos)
+                        client.filters.discard(pattern)
+                    writer.write(_packet(UNSUBACK, body[:2]))
+                elif kind == PINGREQ:
+                    writer.write(_packet(PINGRESP, b""))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            self._tasks.discard(asyncio.current_task())
+            writer.close()
+
+    async def _publish(self, writer, flags, body):
+        topic, end = _string(body, 0)
+        pos = end
+        if (flags >> 1) & 3:
+            # QoS 1: acknowledge, then forward without the packet id at QoS 0
+            writer.write(_packet(PUBACK, body[pos:pos + 2]))
+            pos += 2
+        self.messages_in += 1
+        packet = _packet(PUBLISH, body[:end] + body[pos:])
+        for client in list(self.clients):
+            if any(topic_matches(f, topic) for f in client.filters):
+                client.writer.write(packet)
+                self.messages_out += 1
+                await client.writer.drain()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    broker = MiniBroker(args.host, args.port)
+    print(f"MQTT broker on {args.host}:{args.port}")
+    try:
+        asyncio.run(broker.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,262 @@
+"""
+Live plotting backend for Host.py.
+
+Samples go into preallocated NumPy ring buffers with one bulk copy per
+message batch. Each frame only updates the y data of the lines on a fixed
+x-axis and blits them over a cached background; the full figure is only
+redrawn when it is resized or a panel is shown or hidden.
+
+With decimation on, a panel keeps a min/max envelope per pixel column
+(EnvelopeBuffer) instead of every sample, so the number of points drawn
+depends on the plot width and not on the sample rate, and short peaks
+stay visible.
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+class PlotBuffer:
+    """Ring buffer holding the newest `size` samples of `channels` channels."""
+
+    def __init__(self, channels, size):
+        self.size = size
+        self.data = np.full((channels, size), np.nan)
+        self.pos = 0        # slot of the oldest sample
+        self.count = 0      # samples ever added
+        self._out = np.empty_like(self.data)
+
+    def extend(self, values):
+        """Append an (n, channels) array."""
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        if n >= self.size:
+            self.data[:] = values[-self.size:].T
+            self.pos = 0
+        else:
+            first = min(n, self.size - self.pos)
+            self.data[:, self.pos:self.pos + first] = values[:first].T
+            self.data[:, :n - first] = values[first:].T
+            self.pos = (self.pos + n) % self.size
+        self.count += n
+
+    def ordered(self):
+        """All channels oldest to newest, in a reused (channels, size) array."""
+        tail = self.size - self.pos
+        self._out[:, :tail] = self.data[:, self.pos:]
+        self._out[:, tail:] = self.data[:, :self.pos]
+        return self._out
+
+
+class EnvelopeBuffer:
+    """Min/max envelope of the newest `size` samples, one bucket per pixel column.
+
+    Samples are reduced as they arrive: complete buckets are stored as one
+    (min, max) pair in a ring, samples of the unfinished bucket only update
+    a running min/max. Nothing is recomputed over the whole window.
+    ordered() returns min, max, min, max, ... for x positions given by x.
+    """
+
+    def __init__(self, channels, size, columns):
+        self.bucket = max(1, -(-size // columns))
+        self.columns = max(1, size // self.bucket)
+        self.size = self.columns * self.bucket
+        self.lo = np.full((channels, self.columns), np.nan)
+        self.hi = np.full((channels, self.columns), np.nan)
+        self.pos = 0        # slot of the oldest bucket
+        self.count = 0      # samples ever added
+        self._part_lo = np.full(channels, np.inf)
+        self._part_hi = np.full(channels, -np.inf)
+        self._part_n = 0
+        self._out = np.empty((channels, 2 * self.columns))
+        self.x = np.repeat(np.arange(self.columns) * self.bucket, 2)
+
+    def _push(self, lo, hi):
+        """Store complete buckets, given as (m, channels) min and max arrays."""
+        m = len(lo)
+        if m >= self.columns:
+            self.lo[:] = lo[-self.columns:].T
+            self.hi[:] = hi[-self.columns:].T
+            self.pos = 0
+            return
+        first = min(m, self.columns - self.pos)
+        self.lo[:, self.pos:self.pos + first] = lo[:first].T
+        self.hi[:, self.pos:self.pos + first] = hi[:first].T
+        self.lo[:, :m - first] = lo[first:].T
+        self.hi[:, :m - first] = hi[first:].T
+        self.pos = (self.pos + m) % self.columns
+
+    def _add_partial(self, values):
+        np.minimum(self._part_lo, values.min(axis=0), out=self._part_lo)
+        np.maximum(self._part_hi, values.max(axis=0), out=self._part_hi)
+        self._part_n += len(values)
+        if self._part_n == self.bucket:
+            self._push(self._part_lo[None, :], self._part_hi[None, :])
+            self._part_lo.fill(np.inf)
+            self._part_hi.fill(-np.inf)
+            self._part_n = 0
+
+    def extend(self, values):
+        """Append an (n, channels) array."""
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        self.count += n
+        i = 0
+        if self._part_n:
+            i = min(self.bucket - self._part_n, n)
+            self._add_partial(values[:i])
+        full = (n - i) // self.bucket
+        if full:
+            block = values[i:i + full * self.bucket].reshape(full, self.bucket, -1)
+            self._push(block.min(axis=1), block.max(axis=1))
+            i += full * self.bucket
+        if i < n:
+            self._add_partial(values[i:])
+
+    def ordered(self):
+        """Envelope of all channels, oldest bucket first, in a reused array."""
+        tail = self.columns - self.pos
+        for src, offset in ((self.lo, 0), (self.hi, 1)):
+            self._out[:, offset:2 * tail:2] = src[:, self.pos:]
+            self._out[:, 2 * tail + offset::2] = src[:, :self.pos]
+        return self._out
+
+
+class Panel:
+
+    def __init__(self, ax, lines, buffer):
+        self.ax = ax
+        self.lines = lines
+        self.buffer = buffer
+        self.drawn = -1     # buffer.count at the last frame
+
+
+class LiveFigure:
+    """A column of panels sharing a fixed sample axis, drawn with blitting.
+
+    panels is a list of dicts with "ylabel", "ylim" and "lines", a list of
+    (label, color) pairs, one per channel; add_panel() appends more later.
+    All panels start hidden.
+    With decimate, panels hold a min/max envelope per pixel column.
+    """
+
+    def __init__(self, panels, max_points, title="Real-Time Sensor Data", figsize=(10, 8), decimate=False):
+        self.max_points = max_points
+        self.decimate = decimate
+        self.fig = plt.figure(figsize=figsize)
+        self.fig.suptitle(title)
+        self.canvas = self.fig.canvas
+        self.x = np.arange(max_points)
+        self.panels = []
+        for spec in panels:
+            self.add_panel(spec)
+
+        # One line of text below the panels, drawn like the lines
+        self.status = self.fig.text(0.01, 0.005, "", fontsize=9, animated=True)
+        self._status_changed = False
+
+        self.background = None
+        self.full_draws = 0
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def add_panel(self, spec):
+        """Append a hidden panel below the others, e.g. for a newly discovered sensor; returns its index."""
+        grid = self.fig.add_gridspec(len(self.panels) + 1, 1)
+        for panel, cell in zip(self.panels, grid):
+            panel.ax.set_subplotspec(cell)
+            panel.ax.tick_params(labelbottom=False)
+            panel.ax.set_xlabel("")
+        ax = self.fig.add_subplot(grid[-1], sharex=self.panels[0].ax if self.panels else None)
+        channels = len(spec["lines"])
+        if self.decimate:
+            columns = int(ax.get_position().width * self.fig.get_figwidth() * self.fig.dpi)
+            buffer = EnvelopeBuffer(channels, self.max_points, columns)
+            x = buffer.x
+        else:
+            buffer = PlotBuffer(channels, self.max_points)
+            x = self.x
+        lines = [ax.plot(x, np.full(len(x), np.nan), color, label=label, animated=True)[0]
+                 for label, color in spec["lines"]]
+        ax.set_ylim(*spec["ylim"])
+        ax.set_ylabel(spec["ylabel"])
+        ax.legend()
+        ax.set_visible(False)
+        ax.set_xlim(0, self.max_points - 1)
+        ax.set_xlabel("Sample")
+        self.panels.append(Panel(ax, lines, buffer))
+        # Every other panel moved
+        self.background = None
+        self.canvas.draw_idle()
+        return len(self.panels) - 1
+
+    def extend(self, index, values):
+        self.panels[index].buffer.extend(values)
+
+    def set_status(self, text):
+        if text != self.status.get_text():
+            self.status.set_text(text)
+            self._status_changed = True
+
+    def set_active(self, index, active):
+        """Show or hide a panel; only a change triggers a full redraw."""
+        ax = self.panels[index].ax
+        if ax.get_visible() != active:
+            ax.set_visible(active)
+            self.background = None
+            self.canvas.draw_idle()
+
+    def set_ylim(self, index, low, high):
+        """Change the y range of a panel, e.g. once a sensor's profile is known."""
+        ax = self.panels[index].ax
+        if ax.get_ylim() != (low, high):
+            ax.set_ylim(low, high)
+            self.background = None
+            self.canvas.draw_idle()
+
+    def _on_draw(self, event):
+        # A full draw leaves out the animated lines. On screen it becomes the
+        # background, then the lines go on top (also when saving a figure).
+        if event.canvas is self.canvas:
+            self.full_draws += 1
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines(event.renderer)
+
+    def _draw_lines(self, renderer=None):
+        renderer = renderer or self.canvas.get_renderer()
+        self.status.draw(renderer)
+        for panel in self.panels:
+            if panel.ax.get_visible():
+                for line in panel.lines:
+                    line.draw(renderer)
+
+    def draw_frame(self):
+        """Update changed lines and blit them over the cached background."""
+        changed = self._status_changed
+        self._status_changed = False
+        for panel in self.panels:
+            if panel.ax.get_visible() and panel.drawn != panel.buffer.count:
+                for line, y in zip(panel.lines, panel.buffer.ordered()):
+                    line.set_ydata(y)
+                panel.drawn = panel.buffer.count
+                changed = True
+        if self.background is None or not changed:
+            # Nothing new, or waiting for the full redraw which draws the lines as well
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_lines()
+        self.canvas.blit(self.fig.bbox)
+
+    def start(self, update, interval=100, after=None):
+        """Call update() and draw a frame every interval ms, then after() if given."""
+        def tick():
+            update()
+            self.draw_frame()
+            if after is not None:
+                after()
+        self.timer = self.canvas.new_timer(interval=interval)
+        self.timer.add_callback(tick)
+        self.timer.start()
+        return self.timer
@@ -0,0 +1,169 @@
+"""
+Optional processing on the kit between acquisition and publish.
+
+Decimator
+    anti-aliasing low-pass and decimation by an integer factor. The filter
+    is a linear phase FIR (Blackman windowed sinc) whose stop band starts
+    at the new Nyquist frequency, so nothing above it folds back into the
+    decimated band. Only every factor-th output is computed, as one matrix
+    product per batch. Output timestamps are those of the input sample at
+    the centre of the filter, so the filter delay does not shift the data
+    against the other sensors; they are published that much later.
+
+Features
+    per axis over fixed windows of the raw samples: the mean (gravity and
+    tilt), RMS and peak of the signal without that mean, and the crest
+    factor peak / RMS, which rises with impacts like a bearing defect's
+    long before the RMS does.
+
+Processor
+    one per sensor, with the mode sensor-mqtt.py publishes in:
+
+        "raw"         the samples as acquired, nothing is computed
+        "decimated"   the low-passed, decimated samples
+        "features"    only the features, one message per window
+        "both"        decimated samples and features
+
+Everything works on the int16 counts of a batch at once; decimated
+samples are rounded back to counts so the payloads stay the same.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MODES = ("raw", "decimated", "features", "both")
+TRANSITION = 0.4    # transition band as a fraction of the decimated Nyquist frequency
+RESET_PERIODS = 4   # a jump of more sample periods restarts the filter
+
+
+def lowpass(factor, transition=TRANSITION):
+    """FIR taps passing up to (1 - transition) of the decimated Nyquist frequency, stopping from it."""
+    nyquist = 0.5 / factor                          # in units of the input rate
+    width = transition * nyquist
+    taps = int(np.ceil(5.5 / width)) | 1            # Blackman: about 5.5 / taps wide, 74 dB down
+    cutoff = nyquist - width / 2
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return h / h.sum()
+
+
+class Decimator:
+
+    def __init__(self, factor, period_ns=None, transition=TRANSITION):
+        self.factor = factor
+        self.taps = lowpass(factor, transition)[::-1].copy()
+        self.period_ns = period_ns
+        self.reset()
+
+    def reset(self):
+        self._t = np.empty(0, dtype=np.int64)
+        self._x = None
+        self._next = 0      # position of the next output window in the kept samples
+
+    def process(self, t, values):
+        """Filter and decimate a batch: (t, (n, channels)) -> (t, (m, channels) float)."""
+        t = np.asarray(t, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if self._x is None:
+            self._x = np.empty((0, values.shape[1]))
+        if not self.period_ns or not len(t):
+            return self._filter(t, values)
+        # The sensor was reset or samples were lost: do not filter across a jump.
+        # jumps are the indices in t that start a new run
+        previous = self._t[-1:]
+        jumps = np.flatnonzero(np.diff(np.concatenate((previous, t))) > RESET_PERIODS * self.period_ns)
+        jumps += 1 - len(previous)
+        if not len(jumps):
+            return self._filter(t, values)
+        parts = []
+        for start, stop in zip(np.concatenate(([0], jumps)), np.concatenate((jumps, [len(t)]))):
+            if start in jumps:
+                self.reset()
+                self._x = np.empty((0, values.shape[1]))
+            if stop > start:
+                parts.append(self._filter(t[start:stop], values[start:stop]))
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def _filter(self, t, values):
+        x = np.concatenate((self._x, values))
+        ts = np.concatenate((self._t, t))
+        n = len(self.taps)
+        count = max(0, (len(x) - n - self._next) // self.factor + 1)
+        if count:
+            windows = sliding_window_view(x, n, axis=0)[self._next::self.factor][:count]
+            out = windows @ self.taps
+            out_t = ts[self._next + (n - 1) // 2::self.factor][:count]
+        else:
+            out = np.empty((0, values.shape[1]))
+            out_t = np.empty(0, dtype=np.int64)
+        # Keep what the next windows still need
+        start = self._next + count * self.factor
+        keep = min(start, max(len(x) - n + 1, 0))
+        self._x, self._t = x[keep:], ts[keep:]
+        self._next = start - keep
+        return out_t, out
+
+
+class Features:
+
+    def __init__(self, window):
+        self.window = window
+        self._t = np.empty(0, dtype=np.int64)
+        self._x = None
+
+    def process(self, t, values):
+        """Features of every window completed by this batch, None if none was.
+
+        Returns a dict of "t" (last sample of each window) and "mean",
+        "rms", "peak" and "crest", each a (windows, channels) array in the
+        units of values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        x = values if self._x is None else np.concatenate((self._x, values))
+        ts = np.concatenate((self._t, np.asarray(t, dtype=np.int64)))
+        k = len(x) // self.window
+        self._x, self._t = x[k * self.window:], ts[k * self.window:]
+        if not k:
+            return None
+        blocks = x[:k * self.window].reshape(k, self.window, -1)
+        mean = blocks.mean(axis=1)
+        deviation = blocks - mean[:, None, :]
+        rms = np.sqrt((deviation ** 2).mean(axis=1))
+        peak = np.abs(deviation).max(axis=1)
+        crest = np.divide(peak, rms, out=np.zeros_like(peak), where=rms > 0)
+        return {"t": ts[self.window - 1:k * self.window:self.window], "mean": mean, "rms": rms,
+                "peak": peak, "crest": crest}
+
+
+class Processor:
+    """Processing of one sensor's batches in one of MODES."""
+
+    def __init__(self, period_ns, mode="raw", factor=4, window=0.5, transition=TRANSITION, feature_columns=None):
+        """feature_columns: the columns features are computed of (a slice), None for all."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown processing mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.period_ns = period_ns
+        self.decimator = Decimator(factor, period_ns, transition) if mode in ("decimated", "both") else None
+        self.features = Features(max(1, round(window * 1e9 / period_ns))) if mode in ("features", "both") else None
+        self.feature_columns = slice(None) if feature_columns is None else feature_columns
+
+    @property
+    def output_period_ns(self):
+        return self.period_ns * (self.decimator.factor if self.decimator else 1)
+
+    @property
+    def delay_ns(self):
+        """How much older than the newest input the newest output sample is."""
+        return (len(self.decimator.taps) - 1) // 2 * self.period_ns if self.decimator else 0
+
+    def process(self, t, counts):
+        """(t, counts, features) to publish for a batch of raw counts; features is None or Features.process()."""
+        features = None
+        if self.features is not None and len(t):
+            features = self.features.process(t, counts[:, self.feature_columns])
+        if self.mode == "features":
+            return t[:0], counts[:0], features
+        if self.decimator is not None:
+            t, values = self.decimator.process(t, counts)
+            counts = np.clip(np.rint(values), -32768, 32767).astype(np.int16)
+        return t, counts, features
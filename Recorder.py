@@ -0,0 +1,690 @@
+"""
+Recording of received sensor data on the host.
+
+Both writers keep their output file open for the whole session and write
+from a background thread, so the MQTT callback only has to queue data.
+
+CsvWriter
+    the text format of the Messdaten/Messung_*.csv files.
+
+ChunkRecorder / ChunkReader
+    a compact binary session file (.bfhrec) with typed, zlib compressed
+    columns per stream and a chunk index, so a time range can be read
+    without scanning the whole file.
+
+SessionRecorder
+    all outputs of a Host.py session (CSV, .bfhrec and ring logs) behind
+    one samples() / frequency() call per message.
+
+load_csv() imports the CSV recordings in both layouts:
+
+    rows      one row per sample of one sensor under its message
+              timestamp, the other sensor's last values repeated
+    aligned   one row per point of a uniform clock with every sensor
+              interpolated to it and the frequency as the last column
+              (Resample.py); the file starts with a "# aligned" line
+              and "# columns" lines name the sensors
+
+.bfhrec layout, little endian. After the 8 byte magic the file is a
+sequence of records, each a 4 byte type, u32 length and body:
+
+    META  JSON session metadata
+    STRM  JSON stream definition {"id", "name", "columns": [[name, dtype], ...]}
+    CHNK  u16 stream id, u32 count, i64 t_min, i64 t_max, then the zlib
+          compressed columns: timestamps as int64 deltas (the first one
+          absolute) followed by each value column
+    CALB  JSON {"stream", "t", "calibration"}: the calibration (Calibration.py)
+          the stream's values were converted with from time t (ns) on
+    PROF  JSON {"stream", "t", "profile"}: the acquisition settings of the
+          stream's sensor from time t on (Acquisition.FifoSensor.settings())
+    INDX  JSON {"streams": [...], "chunks": [[stream id, offset, count, t_min, t_max], ...],
+          "calibrations": [CALB bodies], "profiles": [PROF bodies]}
+
+Kits send their settings when a run starts, after the META record of a
+host session is written; ChunkReader.metadata holds them as "profiles",
+{stream: the first PROF body}, with all of them in ChunkReader.profiles.
+
+The INDX record is written on close and found through a 16 byte footer
+(u64 offset of the INDX record, "BFHRECIX"). A file without footer, e.g.
+after a crash, is still readable by scanning the records.
+"""
+import csv
+import io
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+from Channels import stream_kind
+from Codec import FEATURES
+from RingLog import RingLog
+from Resample import StreamAligner
+
+_CLOSE = object()
+# Records of what a stream's values mean, kind of queued item -> record type
+INFO_RECORDS = {"calibration": b"CALB", "profile": b"PROF"}
+
+
+class BackgroundWriter:
+    """Queue plus writer thread shared by the recorders.
+
+    Subclasses implement _write(items) and _flush(), and _finish() to
+    write trailing data before the file is closed.
+    """
+
+    def __init__(self, path, mode, flush_interval, **open_args):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, mode, **open_args)
+        self._thread = threading.Thread(target=self._run, name=f"rec-{os.path.basename(path)}", daemon=True)
+
+    def _start(self):
+        self._thread.start()
+
+    def close(self):
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _write(self, items):
+        raise NotImplementedError
+
+    def _flush(self):
+        self._file.flush()
+
+    def _finish(self):
+        pass
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        closing = False
+        while not closing:
+            try:
+                items = [self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))]
+            except queue.Empty:
+                items = []
+            # Take whatever else piled up so it goes out in one go
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _CLOSE in items:
+                closing = True
+                items = [item for item in items if item is not _CLOSE]
+            self._write(items)
+
+            if closing or time.monotonic() >= next_flush:
+                self._flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self._finish()
+        self._file.close()
+
+
+# ===============================
+# CSV
+# ===============================
+class CsvWriter(BackgroundWriter):
+    """Buffered CSV output with one long-lived file handle.
+
+    Rows are queued with write_rows() and written in bulk by a background
+    thread. The file is flushed every flush_interval seconds and, if fsync
+    is set, forced to disk as well. close() writes everything still queued.
+    """
+
+    def __init__(self, path, flush_interval=1.0, fsync=False):
+        super().__init__(path, 'a', flush_interval, newline='')
+        self.fsync = fsync
+        self.rows_written = 0
+        self._writer = csv.writer(self._file)
+        self._start()
+
+    def write_rows(self, rows):
+        """Queue a list of rows. Returns immediately."""
+        if rows:
+            self._queue.put(rows)
+
+    def write_block(self, text):
+        """Queue already formatted CSV text (complete lines)."""
+        if text:
+            self._queue.put(text)
+
+    def _write(self, items):
+        for item in items:
+            if isinstance(item, str):
+                self._file.write(item)
+            else:
+                self._writer.writerows(item)
+                self.rows_written += len(item)
+
+    def _flush(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+
+ALIGNED_HEADER = "# aligned"
+
+
+def aligned_header(rate):
+    return f"{ALIGNED_HEADER} {rate:g} Hz\n"
+
+
+def aligned_columns(first, name):
+    """Comment line naming the sensor of the column group starting at column first."""
+    return f"# columns {first}-{first + 2}: {name}\n"
+
+
+def format_aligned(t, columns, decimals=3):
+    """CSV text of aligned rows: timestamps t and an (n, k) array, NaN as an empty field."""
+    if not len(t):
+        return ""
+    text = io.StringIO()
+    np.savetxt(text, columns, fmt=f"%.{decimals}f", delimiter=",")
+    lines = text.getvalue().replace("nan", "").splitlines()
+    return "".join(f"{ti},{line}\n" for ti, line in zip(t.tolist(), lines))
+
+
+def load_csv(path):
+    """Load a Messdaten CSV recording into per-stream arrays.
+
+    Handles the layouts written by Host.py: bracketed timestamps with a
+    separate _freq.csv file, plain timestamps with the frequency in an
+    eighth column, and aligned files. Rows where a sensor's values were
+    only forward-filled from the other sensor's message are dropped for
+    that sensor.
+
+    Returns {"s104": (t, values), "s105": (t, values), "freq": (t, values)}
+    with int64 ns timestamps and float (n, k) values; empty streams are left out.
+    Aligned files name their sensors themselves.
+    """
+    streams = {}
+    t, cols, comments = _read_columns(path)
+    if comments and comments[0].startswith(ALIGNED_HEADER):
+        names = {}
+        for line in comments[1:]:
+            first, _, name = line[len("# columns "):].partition(": ")
+            names[int(first.split("-")[0])] = name.strip()
+        for k in range((cols.shape[1] - 1) // 3):
+            name = names.get(2 + 3 * k, ("s104", "s105")[k] if k < 2 else f"s{104 + k}")
+            present = ~np.isnan(cols[:, 3 * k:3 * k + 3]).any(axis=1)
+            streams[name] = (t[present], cols[present, 3 * k:3 * k + 3])
+        has_freq = ~np.isnan(cols[:, -1])
+        streams["freq"] = (t[has_freq], cols[has_freq, -1:])
+    elif len(t):
+        s1, s2 = cols[:, 0:3], cols[:, 3:6]
+        own1, own2 = _own_rows(s1, s2)
+        streams["s104"] = (t[own1], s1[own1])
+        streams["s105"] = (t[own2], s2[own2])
+        if cols.shape[1] > 6:
+            has_freq = ~np.isnan(cols[:, 6])
+            streams["freq"] = (t[has_freq], cols[has_freq, 6:7])
+
+    freq_path = path.replace(".csv", "_freq.csv")
+    if freq_path != path and os.path.exists(freq_path):
+        ft, fcols, _ = _read_columns(freq_path)
+        streams["freq"] = (ft, fcols[:, 0:1])
+    return {name: s for name, s in streams.items() if len(s[0])}
+
+
+def _read_columns(path):
+    """Timestamps (int64), value columns (float, NaN where empty) and comment lines of a CSV recording."""
+    with open(path) as f:
+        text = f.read().replace("[", "").replace("]", "")
+    lines = text.splitlines()
+    comments = []
+    if "#" in text:
+        comments = [line for line in lines if line.startswith("#")]
+        lines = [line for line in lines if not line.startswith("#")]
+        text = "\n".join(lines)
+    if not lines:
+        return np.empty(0, dtype=np.int64), np.empty((0, 7)), comments
+    width = max(len(line.split(",")) for line in lines[:100]) - 1
+
+    # Fast path for files with a fixed number of fields: the timestamps
+    # keep all their digits as int64, the values are parsed in one NumPy
+    # call once the empty fields are filled in
+    heads, _, rests = zip(*(line.partition(",") for line in lines))
+    try:
+        t = np.array(heads).astype(np.int64)
+    except ValueError:
+        t = None
+    if t is not None and width:
+        body = ("," + ",".join(rests) + ",").replace(",,", ",nan,").replace(",,", ",nan,")
+        cols = np.fromstring(body[1:-1], sep=",")
+        if cols.size == len(lines) * width:
+            return t, cols.reshape(len(lines), width), comments
+
+    # Ragged or damaged files, e.g. the last line of a crashed session
+    t = np.genfromtxt(io.StringIO(text), delimiter=",", usecols=0, dtype=np.int64)
+    cols = np.genfromtxt(io.StringIO(text), delimiter=",", usecols=range(1, width + 1),
+                         dtype=np.float64, filling_values=np.nan)
+    return np.atleast_1d(t), cols.reshape(len(np.atleast_1d(t)), width), comments
+
+
+def _own_rows(a, b):
+    """Which rows carry a new sample of sensor a and which one of sensor b.
+
+    Host.py logged one row per sample of one sensor and repeated the last
+    values of the other. A row belongs to the sensor whose values changed;
+    when neither changed it belongs to the same sensor as the row before.
+    """
+    present_a = ~np.isnan(a).any(axis=1)
+    present_b = ~np.isnan(b).any(axis=1)
+
+    def changed(v, present):
+        prev = np.vstack((np.full((1, v.shape[1]), np.nan), v[:-1]))
+        return present & ~(v == prev).all(axis=1)
+
+    new_a, new_b = changed(a, present_a), changed(b, present_b)
+    owner = np.where(new_a & ~new_b, 1, np.where(new_b & ~new_a, 2, 0))
+    # Carry the owner forward over rows where neither sensor changed
+    idx = np.where(owner > 0, np.arange(len(owner)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    owner = owner[idx]
+    return (owner == 1) & present_a, (owner == 2) & present_b
+
+
+# ===============================
+# Chunked binary recording
+# ===============================
+FILE_MAGIC = b"BFHREC01"
+INDEX_MAGIC = b"BFHRECIX"
+RECORD = struct.Struct("<4sI")
+CHUNK = struct.Struct("<HIqq")
+FOOTER = struct.Struct("<Q8s")
+
+
+class ChunkRecorder(BackgroundWriter):
+    """Writes a .bfhrec session file.
+
+    Samples are buffered per stream and written as one compressed chunk
+    once chunk_samples have accumulated, or every flush_interval seconds.
+    """
+
+    def __init__(self, path, metadata=None, chunk_samples=8192, flush_interval=5.0, level=1):
+        super().__init__(path, 'wb', flush_interval)
+        self.chunk_samples = chunk_samples
+        self.level = level
+        self.streams = {}
+        self._streams_lock = threading.Lock()
+        self._stream_defs = []
+        self._pending = {}
+        self._chunks = []
+        self._info = {kind: [] for kind in INFO_RECORDS}
+        self._file.write(FILE_MAGIC)
+        self._record(b"META", json.dumps(metadata or {}).encode())
+        self._start()
+
+    def add_stream(self, name, columns=("x", "y", "z"), dtype="<f4"):
+        """Declare a stream; appending to an unknown name declares it with the defaults."""
+        if name in self.streams:
+            return
+        # Streams may be declared from more than one thread (Host.py records kit features from paho's)
+        with self._streams_lock:
+            if name not in self.streams:
+                self.streams[name] = len(self.streams)
+                self._queue.put(("stream", name, list(columns), dtype))
+
+    def add_calibration(self, name, calibration):
+        """Queue the calibration dict (Calibration.to_dict()) the values of a stream are converted with from now on."""
+        self._queue.put(("calibration", name, time.time_ns(), calibration))
+
+    def add_profile(self, name, profile):
+        """Queue the acquisition settings of a stream's sensor from now on."""
+        self._queue.put(("profile", name, time.time_ns(), profile))
+
+    def append(self, name, t, values):
+        """Queue samples: int64 timestamps in ns and an (n, columns) array."""
+        if len(t) == 0:
+            return
+        self.add_stream(name, ("x", "y", "z")[:np.shape(values)[1]])
+        self._queue.put(("data", name, np.asarray(t, dtype=np.int64), np.asarray(values)))
+
+    def _record(self, kind, body):
+        offset = self._file.tell()
+        self._file.write(RECORD.pack(kind, len(body)))
+        self._file.write(body)
+        return offset
+
+    def _write(self, items):
+        for kind, name, a, b in items:
+            if kind == "stream":
+                definition = {"id": self.streams[name], "name": name,
+                              "columns": [["t", "<i8"]] + [[c, b] for c in a]}
+                self._stream_defs.append(definition)
+                self._pending[name] = []
+                self._record(b"STRM", json.dumps(definition).encode())
+            elif kind in INFO_RECORDS:
+                record = {"stream": name, "t": a, kind: b}
+                self._info[kind].append(record)
+                self._record(INFO_RECORDS[kind], json.dumps(record).encode())
+            else:
+                self._pending[name].append((a, b))
+                if sum(len(t) for t, _ in self._pending[name]) >= self.chunk_samples:
+                    self._write_chunk(name)
+
+    def _write_chunk(self, name):
+        pending = self._pending[name]
+        if not pending:
+            return
+        self._pending[name] = []
+        t = np.concatenate([t for t, _ in pending])
+        values = np.concatenate([v for _, v in pending])
+        dtype = self._stream_defs[self.streams[name]]["columns"][1][1]
+
+        deltas = np.diff(t, prepend=np.int64(0))
+        data = deltas.tobytes() + np.ascontiguousarray(values.T, dtype=dtype).tobytes()
+        body = CHUNK.pack(self.streams[name], len(t), int(t.min()), int(t.max())) + zlib.compress(data, self.level)
+        offset = self._record(b"CHNK", body)
+        self._chunks.append([self.streams[name], offset, len(t), int(t.min()), int(t.max())])
+
+    def _flush(self):
+        for name in self._pending:
+            self._write_chunk(name)
+        self._file.flush()
+
+    def _finish(self):
+        index = {"streams": self._stream_defs, "chunks": self._chunks,
+                 "calibrations": self._info["calibration"], "profiles": self._info["profile"]}
+        offset = self._record(b"INDX", json.dumps(index).encode())
+        self._file.write(FOOTER.pack(offset, INDEX_MAGIC))
+
+
+class ChunkReader:
+    """Random access to a .bfhrec file through its chunk index."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        if self._file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{path} is not a .bfhrec recording")
+        self.metadata = {}
+        self._load_index()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_record(self, offset):
+        self._file.seek(offset)
+        header = self._file.read(RECORD.size)
+        if len(header) < RECORD.size:
+            return None, None
+        kind, length = RECORD.unpack(header)
+        body = self._file.read(length)
+        if len(body) < length:
+            return None, None
+        return kind, body
+
+    def _load_index(self):
+        kind, body = self._read_record(len(FILE_MAGIC))
+        if kind == b"META":
+            self.metadata = json.loads(body)
+
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        index = None
+        if size >= len(FILE_MAGIC) + FOOTER.size:
+            self._file.seek(size - FOOTER.size)
+            offset, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+            if magic == INDEX_MAGIC:
+                kind, body = self._read_record(offset)
+                if kind == b"INDX":
+                    index = json.loads(body)
+        if index is None:
+            index = self._scan()
+
+        self.streams = {s["name"]: s for s in index["streams"]}
+        # {stream: [{"stream", "t", "calibration"}, ...]} in the order they were recorded, the same for profiles
+        self.calibrations = {}
+        for record in index.get("calibrations", []):
+            self.calibrations.setdefault(record["stream"], []).append(record)
+        self.profiles = {}
+        for record in index.get("profiles", []):
+            self.profiles.setdefault(record["stream"], []).append(record)
+        if self.profiles:
+            self.metadata["profiles"] = {name: records[0]["profile"] for name, records in self.profiles.items()}
+        self._chunks = {s["id"]: [] for s in index["streams"]}
+        for stream, offset, count, t_min, t_max in index["chunks"]:
+            self._chunks[stream].append((offset, count, t_min, t_max))
+
+    def _scan(self):
+        """Rebuild the index of a file that was not closed properly."""
+        streams, chunks, calibrations, profiles = [], [], [], []
+        offset = len(FILE_MAGIC)
+        while True:
+            kind, body = self._read_record(offset)
+            if kind is None or kind == b"INDX":
+                break
+            if kind == b"STRM":
+                streams.append(json.loads(body))
+            elif kind == b"CHNK":
+                stream, count, t_min, t_max = CHUNK.unpack_from(body)
+                chunks.append([stream, offset, count, t_min, t_max])
+            elif kind == b"CALB":
+                calibrations.append(json.loads(body))
+            elif kind == b"PROF":
+                profiles.append(json.loads(body))
+            offset += RECORD.size + len(body)
+        return {"streams": streams, "chunks": chunks, "calibrations": calibrations, "profiles": profiles}
+
+    def chunks(self, name):
+        """(offset, count, t_min, t_max) of every chunk of a stream."""
+        return self._chunks[self.streams[name]["id"]]
+
+    def read(self, name, t_start=None, t_end=None):
+        """Columns of a stream as a dict of arrays, optionally limited to t_start <= t <= t_end."""
+        columns = self.streams[name]["columns"]
+        parts = []
+        for offset, count, t_min, t_max in self.chunks(name):
+            if (t_start is not None and t_max < t_start) or (t_end is not None and t_min > t_end):
+                continue
+            kind, body = self._read_record(offset)
+            data = zlib.decompress(body[CHUNK.size:])
+            t = np.cumsum(np.frombuffer(data, dtype="<i8", count=count))
+            pos = count * 8
+            chunk = {"t": t}
+            for col, dtype in columns[1:]:
+                dtype = np.dtype(dtype)
+                chunk[col] = np.frombuffer(data, dtype=dtype, count=count, offset=pos)
+                pos += count * dtype.itemsize
+            if t_start is not None or t_end is not None:
+                keep = np.ones(count, dtype=bool)
+                if t_start is not None:
+                    keep &= t >= t_start
+                if t_end is not None:
+                    keep &= t <= t_end
+                chunk = {col: v[keep] for col, v in chunk.items()}
+            parts.append(chunk)
+
+        if not parts:
+            return {col: np.empty(0, dtype=dtype) for col, dtype in columns}
+        return {col: np.concatenate([p[col] for p in parts]) for col, _ in columns}
+
+
+# ===============================
+# Session outputs
+# ===============================
+CSV_SENSORS = 2     # x/y/z column groups of the Messung_*.csv layout
+COLUMNS = {"temperature": ("celsius",)}     # of the streams that are not x/y/z
+DEFAULT_ALIGN_RATE = 500.0  # Hz of the aligned rows for kits that send no profile, their ODR
+
+
+class SessionRecorder:
+    """Everything Host.py records in one session.
+
+    record_format selects the CSV files ("csv"), the .bfhrec file next to
+    them ("chunks") or "both"; ringlog_dir adds one RingLog per stream, None
+    leaves them out.
+
+    Every stream gets its own .bfhrec stream and ring log, declared when its
+    first samples arrive. Only accelerometer streams go into the CSV,
+    which has room for CSV_SENSORS sensors:
+    sensors are the streams in CSV column order, free columns go to the
+    first other streams that arrive. The _freq.csv file takes the first
+    frequency stream.
+
+    csv_layout "rows" writes the original Messung_*.csv rows, "aligned"
+    the CSV sensors and the first frequency stream resampled to align_rate
+    Hz by a Resample.StreamAligner (see load_csv()). With align_rate None
+    the rate is the output rate of the first profile recorded, so the rows
+    neither alias nor invent samples; DEFAULT_ALIGN_RATE if samples come
+    first.
+    """
+
+    def __init__(self, csv_file, record_format="both", sensors=("s104", "s105"), metadata=None,
+                 flush_interval=1.0, fsync=False, ringlog_dir=None, ringlog_records=1 << 22,
+                 csv_layout="rows", align_rate=None):
+        self.sensors = list(sensors)
+        self.sensor_writer = None
+        self.freq_writer = None
+        self.recorder = None
+        self.aligner = None
+        self.align_pending = False  # aligned layout waiting for its rate
+        self.align_lock = threading.Lock()  # profiles may come in on another thread than the samples
+        if record_format in ("csv", "both"):
+            self.sensor_writer = CsvWriter(csv_file, flush_interval, fsync)
+            self.freq_writer = CsvWriter(csv_file.replace(".csv", "_freq.csv"), flush_interval, fsync)
+            if csv_layout == "aligned" and align_rate is None:
+                self.align_pending = True
+            elif csv_layout == "aligned":
+                self.start_aligner(align_rate)
+        if record_format in ("chunks", "both"):
+            self.recorder = ChunkRecorder(csv_file.replace(".csv", ".bfhrec"), metadata)
+            for name in self.sensors:
+                self.recorder.add_stream(name, ("x", "y", "z"))
+        self.freq_stream = None
+        self.ringlog_dir = ringlog_dir
+        self.ringlog_records = ringlog_records
+        # Ring logs survive restarts, an existing log for a stream is continued
+        self.ringlogs = {}
+        # Latest known readings (x, y, z) per sensor, repeated in the rows of the others
+        self.latest = [['', '', ''] for _ in range(max(CSV_SENSORS, len(self.sensors)))]
+
+    def samples(self, name, timestamp, t, values):
+        """Record the (n, 3) values of one message with their timestamps t in ns.
+
+        The CSV gets one row per sample under the message timestamp, or
+        the aligned rows that are complete.
+        """
+        kind = stream_kind(name)
+        columns = COLUMNS.get(kind, ("x", "y", "z"))
+        if self.recorder is not None:
+            self.recorder.add_stream(name, columns)
+            self.recorder.append(name, t, values)
+        self.ring_log(name, t, values, columns)
+        if self.sensor_writer is None or not len(values) or kind != "accel":
+            return
+        if self.align_pending:
+            self.start_aligner(DEFAULT_ALIGN_RATE)
+        if name not in self.sensors:
+            if len(self.sensors) >= len(self.latest):
+                return
+            self.sensors.append(name)
+            print(f"CSV columns {3 * len(self.sensors) - 1}-{3 * len(self.sensors) + 1}: {name}")
+            if self.aligner is not None:
+                self.sensor_writer.write_block(aligned_columns(3 * len(self.sensors) - 1, name))
+        if self.aligner is not None:
+            self.aligner.add(name, t, values)
+            self.write_aligned(*self.aligner.process())
+            return
+        ix = self.sensors.index(name)
+        before = sum(self.latest[:ix], [])
+        after = sum(self.latest[ix + 1:], [])
+        rows = [[timestamp] + before + s + after for s in np.round(values, 3).tolist()]
+        self.latest[ix] = rows[-1][1 + 3 * ix:4 + 3 * ix]
+        self.sensor_writer.write_rows(rows)
+
+    def frequency(self, timestamp, freq, name="freq"):
+        """Record one frequency value with the timestamp of its message."""
+        if self.freq_stream is None:
+            self.freq_stream = name
+        if self.align_pending and name == self.freq_stream:
+            self.start_aligner(DEFAULT_ALIGN_RATE)
+        if self.freq_writer is not None and name == self.freq_stream:
+            self.freq_writer.write_rows([[str(timestamp if timestamp is not None else ""), freq]])
+        # Older sensor firmware sends the timestamp wrapped in a list
+        if isinstance(timestamp, (list, tuple)):
+            timestamp = timestamp[0] if timestamp else None
+        t = int(timestamp) if timestamp else time.time_ns()
+        if self.recorder is not None:
+            self.recorder.add_stream(name, ("frequency_hz",))
+            self.recorder.append(name, [t], [[freq]])
+        if self.aligner is not None and name == self.freq_stream:
+            self.aligner.add_stream(name, hold=True)
+            self.aligner.add(name, [t], [[freq]])
+        self.ring_log(name, np.array([t]), np.array([[freq]]), ("frequency_hz",))
+
+    def features(self, name, batch):
+        """Record a decoded feature message (Codec.decode_features) as the .bfhrec stream <name>/features."""
+        if self.recorder is None or not len(batch["t"]):
+            return
+        channels = batch["rms"].shape[1]
+        columns = [f"{f}_{c}" for f in FEATURES for c in "xyz"[:channels]]
+        self.recorder.add_stream(name + "/features", columns)
+        self.recorder.append(name + "/features", batch["t"], np.hstack([batch[f] for f in FEATURES]))
+
+    def calibration(self, name, calibration):
+        """Record the calibration dict a stream's values are converted with from now on (.bfhrec only)."""
+        if self.recorder is not None:
+            self.recorder.add_calibration(name, calibration)
+
+    def profile(self, name, profile):
+        """Record the acquisition settings of a stream's sensor (.bfhrec), the first sets a pending align rate."""
+        if self.recorder is not None:
+            self.recorder.add_profile(name, profile)
+        if self.align_pending:
+            # Older kits only send the ODR, which is what they publish undecimated
+            self.start_aligner(float(profile.get("output_hz", profile["odr"])))
+
+    def start_aligner(self, rate):
+        """Write the aligned CSV header and resample to rate Hz from now on."""
+        with self.align_lock:
+            if self.aligner is not None:
+                return
+            self.aligner = StreamAligner(rate)
+            self.align_pending = False
+            self.sensor_writer.write_block(aligned_header(rate) + "".join(
+                aligned_columns(2 + 3 * ix, name) for ix, name in enumerate(self.sensors)))
+        print(f"Aligned CSV rows at {rate:g} Hz")
+
+    def write_aligned(self, t, streams):
+        """Rows of released aligned points: the CSV sensors in column order, then the frequency."""
+        if not len(t):
+            return
+        nan = np.full((len(t), 3), np.nan)
+        groups = [streams.get(name, nan) for name in self.sensors]
+        groups += [nan] * (len(self.latest) - len(groups))
+        groups.append(streams.get(self.freq_stream, nan[:, :1]))
+        self.sensor_writer.write_block(format_aligned(t, np.hstack(groups)))
+
+    def ring_log(self, name, t, values, columns=("x", "y", "z")):
+        """Append to the memory-mapped ring log of a stream."""
+        if self.ringlog_dir is None:
+            return
+        if name not in self.ringlogs:
+            os.makedirs(self.ringlog_dir, exist_ok=True)
+            # One file per stream, "<kit>/<sensor>" becomes <kit>_<sensor>.ring
+            path = os.path.join(self.ringlog_dir, name.replace("/", "_") + ".ring")
+            self.ringlogs[name] = RingLog(path, self.ringlog_records, columns)
+        self.ringlogs[name].append(t, values)
+
+    def close(self):
+        if self.aligner is not None:
+            self.write_aligned(*self.aligner.flush())
+        for w in (self.sensor_writer, self.freq_writer, self.recorder):
+            if w is not None:
+                w.close()
+        for log in self.ringlogs.values():
+            log.close()
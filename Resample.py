@@ -0,0 +1,179 @@
+"""
+Streaming alignment of several sample streams onto one uniform clock.
+
+Each sensor samples on its own clock and its messages arrive in batches,
+sometimes late or out of order. StreamAligner takes the batches with their
+per-sample timestamps and releases rows on a shared grid of rate Hz:
+
+    interpolated streams   accelerations, linear between the samples
+                           around a grid point, NaN inside a gap of more
+                           than max_gap seconds or outside the samples
+    held streams           readings like the frequency, which keep their
+                           value until the next one
+
+A grid point is released once every interpolated stream has samples
+reorder seconds past it, so all of them can be interpolated and batches
+that overtook each other on the way are sorted back in. Streams that have
+not delivered for max_delay seconds of the newest stream's data time no
+longer hold the others back: they get NaN for the points released
+meanwhile. That bounds the reorder buffer to about max_delay seconds of
+samples per stream. Samples for points already released are counted in
+`late` and dropped.
+
+The same code aligns recordings offline: add() everything, then flush().
+All work is per batch with NumPy, nothing is done per sample in Python.
+"""
+import numpy as np
+
+MAX_DELAY = 0.25    # seconds a stream may lag before the others go on without it
+REORDER = 0.05      # seconds of samples held back for batches arriving out of order
+MAX_GAP = 0.05      # seconds between two samples that count as a gap
+
+
+class _Stream:
+
+    def __init__(self, hold, max_gap):
+        self.hold = hold
+        self.max_gap_ns = int(max_gap * 1e9)
+        self.t = np.empty(0, dtype=np.int64)
+        self.values = None
+        self.newest = None
+
+
+class StreamAligner:
+
+    def __init__(self, rate, max_delay=MAX_DELAY, reorder=REORDER, max_gap=MAX_GAP, origin=None):
+        """Grid points are origin + k / rate seconds (ns timestamps), k integer.
+
+        The default origin is the whole second before the first sample, so
+        aligners with the same rate share their grid while k stays small
+        enough for exact ns in float64.
+        """
+        self.rate = rate
+        self.period = 1e9 / rate
+        self.origin = None if origin is None else int(origin)
+        self.max_delay_ns = int(max_delay * 1e9)
+        self.reorder_ns = int(reorder * 1e9)
+        self.max_gap = max_gap
+        self.streams = {}
+        self.next_k = None      # first grid point not released yet
+        self.late = 0           # samples dropped because their points were already released
+
+    def add_stream(self, name, hold=False, max_gap=None):
+        """Declare a stream; streams added without declaration are interpolated with the default gap."""
+        if name not in self.streams:
+            self.streams[name] = _Stream(hold, self.max_gap if max_gap is None else max_gap)
+        return self.streams[name]
+
+    def _grid(self, k):
+        return self.origin + np.rint(k * self.period).astype(np.int64)
+
+    def add(self, name, t, values):
+        """Queue a batch of a stream: t in ns and an (n, channels) array."""
+        t = np.asarray(t, dtype=np.int64)
+        if not len(t):
+            return
+        values = np.asarray(values, dtype=np.float64).reshape(len(t), -1)
+        stream = self.streams.get(name) or self.add_stream(name)
+        if self.next_k is None:
+            if self.origin is None:
+                self.origin = int(t.min()) // 1_000_000_000 * 1_000_000_000
+            # The grid starts at the first point at or after the first sample
+            self.next_k = int(np.ceil((int(t.min()) - self.origin) / self.period))
+        if not stream.hold:
+            released = int(self._grid(self.next_k - 1))
+            keep = t > released
+            if not keep.all():
+                self.late += int((~keep).sum())
+                t, values = t[keep], values[keep]
+                if not len(t):
+                    return
+        if stream.values is None:
+            stream.values = np.empty((0, values.shape[1]))
+        if (len(stream.t) and t[0] < stream.t[-1]) or np.any(np.diff(t) < 0):
+            # Out of order: merge into the buffer
+            t = np.concatenate((stream.t, t))
+            values = np.concatenate((stream.values, values))
+            order = np.argsort(t, kind="stable")
+            stream.t, stream.values = t[order], values[order]
+        else:
+            stream.t = np.concatenate((stream.t, t))
+            stream.values = np.concatenate((stream.values, values))
+        stream.newest = int(stream.t[-1])
+
+    def _watermark(self):
+        """Time up to which every live interpolated stream has data, less the reorder window."""
+        newest = [s.newest for s in self.streams.values() if not s.hold and s.newest is not None]
+        if not newest:
+            return None
+        live = [n for n in newest if n >= max(newest) - self.max_delay_ns]
+        return min(live) - self.reorder_ns
+
+    def process(self):
+        """Release all grid points that are complete; returns (t, {name: (n, channels) values})."""
+        return self._release(self._watermark())
+
+    def flush(self, until=None):
+        """Release everything up to until (ns), by default up to the newest sample of any stream."""
+        if until is None:
+            newest = [s.newest for s in self.streams.values() if s.newest is not None]
+            until = max(newest) if newest else None
+        return self._release(until)
+
+    def _release(self, until):
+        empty = np.empty(0, dtype=np.int64), {}
+        if until is None or self.next_k is None:
+            return empty
+        last_k = int(np.floor((until - self.origin) / self.period))
+        if last_k < self.next_k:
+            return empty
+        grid = self._grid(np.arange(self.next_k, last_k + 1))
+        self.next_k = last_k + 1
+
+        out = {}
+        for name, stream in self.streams.items():
+            if stream.values is None:
+                continue
+            out[name] = self._interpolate(stream, grid) if not stream.hold else self._hold(stream, grid)
+            # Keep the last sample at or before the released points for the next interpolation
+            cut = max(int(np.searchsorted(stream.t, grid[-1], side="right")) - 1, 0)
+            stream.t, stream.values = stream.t[cut:], stream.values[cut:]
+        return grid, out
+
+    def _interpolate(self, stream, grid):
+        t, values = stream.t, stream.values
+        out = np.full((len(grid), values.shape[1]), np.nan)
+        if not len(t):
+            return out
+        # Relative times keep ns resolution in float64
+        x = (t - grid[0]).astype(np.float64)
+        g = (grid - grid[0]).astype(np.float64)
+        for k in range(values.shape[1]):
+            out[:, k] = np.interp(g, x, values[:, k], left=np.nan, right=np.nan)
+        # Points between two samples further apart than max_gap
+        right = np.searchsorted(t, grid)
+        inner = np.flatnonzero((right > 0) & (right < len(t)))
+        r = right[inner]
+        gap = (t[r] - t[r - 1] > stream.max_gap_ns) & (t[r] != grid[inner])
+        out[inner[gap]] = np.nan
+        return out
+
+    def _hold(self, stream, grid):
+        idx = np.searchsorted(stream.t, grid, side="right") - 1
+        out = stream.values[np.maximum(idx, 0)].astype(np.float64)
+        out[idx < 0] = np.nan
+        return out
+
+
+def align_streams(streams, rate, hold=(), max_gap=MAX_GAP, origin=None):
+    """Align whole recordings {name: (t, values)}; returns (t, {name: values}) like StreamAligner.flush().
+
+    max_gap may be a dict with the gap of each stream in seconds.
+    """
+    aligner = StreamAligner(rate, origin=origin)
+    # The earliest stream first, the grid starts at its first sample
+    for name, (t, values) in sorted(streams.items(), key=lambda s: int(np.min(s[1][0])) if len(s[1][0]) else 0):
+        gap = max_gap.get(name, MAX_GAP) if isinstance(max_gap, dict) else max_gap
+        aligner.add_stream(name, hold=name in hold, max_gap=gap)
+        aligner.add(name, t, values)
+    return aligner.flush()
@@ -0,0 +1,69 @@
+"""
+Preallocated single-producer/single-consumer ring buffer for sensor records.
+
+Each record is an int64 timestamp in ns plus a fixed number of values
+(e.g. raw x/y/z counts), or no values at all with width 0. Storage is allocated once as NumPy arrays, so
+writing and draining a batch is a couple of slice copies instead of
+per-sample dicts.
+
+No lock is needed with one producer and one consumer: only the producer
+advances `head` and only the consumer advances `tail`, and each index is
+published with a single assignment after the data has been copied.
+"""
+import numpy as np
+
+
+class RingBuffer:
+
+    def __init__(self, capacity, width=3, dtype=np.int16):
+        self.capacity = capacity
+        self.t = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, width), dtype=dtype)
+        self.head = 0       # records written so far (producer only)
+        self.tail = 0       # records read so far (consumer only)
+        self.overruns = 0   # records dropped because the buffer was full
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def write(self, t, values):
+        """Append a batch. Records that do not fit are dropped and counted.
+
+        values may be None for a buffer of width 0 (timestamps only).
+        """
+        n = len(t)
+        free = self.capacity - (self.head - self.tail)
+        if n > free:
+            self.overruns += n - free
+            n = free
+        if n == 0:
+            return 0
+
+        start = self.head % self.capacity
+        first = min(n, self.capacity - start)
+        self.t[start:start + first] = t[:first]
+        if first < n:
+            self.t[:n - first] = t[first:n]
+        if values is not None:
+            self.values[start:start + first] = values[:first]
+            if first < n:
+                self.values[:n - first] = values[first:n]
+        self.head += n
+        return n
+
+    def read(self, max_records=None):
+        """Remove and return up to max_records as copied (t, values) arrays."""
+        n = self.head - self.tail
+        if max_records is not None:
+            n = min(n, max_records)
+
+        start = self.tail % self.capacity
+        first = min(n, self.capacity - start)
+        if first == n:
+            t = self.t[start:start + n].copy()
+            values = self.values[start:start + n].copy()
+        else:
+            t = np.concatenate((self.t[start:], self.t[:n - first]))
+            values = np.concatenate((self.values[start:], self.values[:n - first]))
+        self.tail += n
+        return t, values
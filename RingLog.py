@@ -0,0 +1,140 @@
+"""
+Fixed-size memory-mapped circular log of timestamped records.
+
+One file per channel keeps the most recent `capacity` records at full
+resolution, so RAM use stays constant however long a recording runs and
+the last minutes can be looked at without parsing any CSV.
+
+File layout (little endian):
+
+    0     magic "BFHRING1"
+    8     u32 version, u32 number of value columns
+    16    u64 capacity in records
+    24    u64 head: total number of records ever written
+    64    column names, comma separated, NUL padded
+    4096  capacity records of (i64 t in ns, f32 value per column)
+
+Record i (counting from the start of the log) lives in slot i % capacity.
+The head is only advanced after the records are in place, so after a
+crash the log reopens with every record up to the head intact.
+"""
+import mmap
+import os
+import struct
+import numpy as np
+
+MAGIC = b"BFHRING1"
+VERSION = 1
+HEADER_SIZE = 4096
+HEADER = struct.Struct("<8sIIQQ")
+HEAD_OFFSET = 24
+NAMES_OFFSET = 64
+
+
+class RingLog:
+
+    def __init__(self, path, capacity=1 << 20, columns=("x", "y", "z"), readonly=False):
+        """Open the log at path, creating it with capacity and columns if it does not exist."""
+        self.path = path
+        self.readonly = readonly
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(path)
+            self._create(path, capacity, columns)
+
+        self._fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR)
+        self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        magic, version, ncols, capacity, _ = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a ring log")
+        names = bytes(self._map[NAMES_OFFSET:HEADER_SIZE]).rstrip(b"\0").decode()
+        self.columns = tuple(names.split(","))[:ncols]
+        self.capacity = capacity
+        self.dtype = np.dtype([("t", "<i8")] + [(c, "<f4") for c in self.columns])
+        self.records = np.frombuffer(self._map, dtype=self.dtype, count=capacity, offset=HEADER_SIZE)
+        self._head = np.frombuffer(self._map, dtype="<u8", count=1, offset=HEAD_OFFSET)
+
+    @staticmethod
+    def _create(path, capacity, columns):
+        dtype = np.dtype([("t", "<i8")] + [(c, "<f4") for c in columns])
+        header = bytearray(HEADER_SIZE)
+        HEADER.pack_into(header, 0, MAGIC, VERSION, len(columns), capacity, 0)
+        names = ",".join(columns).encode()
+        header[NAMES_OFFSET:NAMES_OFFSET + len(names)] = names
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.truncate(HEADER_SIZE + capacity * dtype.itemsize)
+        os.replace(tmp, path)
+
+    @property
+    def head(self):
+        return int(self._head[0])
+
+    def __len__(self):
+        return min(self.head, self.capacity)
+
+    def append(self, t, values):
+        """Write records from timestamps t (ns) and an (n, columns) array."""
+        n = len(t)
+        if n == 0:
+            return
+        if n > self.capacity:
+            t, values, n = t[-self.capacity:], values[-self.capacity:], self.capacity
+        values = np.asarray(values)
+
+        head = self.head
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        for dst, lo, hi in ((start, 0, first), (0, first, n)):
+            if lo == hi:
+                continue
+            block = self.records[dst:dst + hi - lo]
+            block["t"] = t[lo:hi]
+            for i, c in enumerate(self.columns):
+                block[c] = values[lo:hi, i]
+        self._head[0] = head + n
+
+    def views(self, n=None):
+        """Zero-copy views of the newest n records (default all) in time order.
+
+        Returns one view, or two when the window wraps around the end of
+        the file. The views stay valid while the log is open but will see
+        newer data once the writer laps them.
+        """
+        head = self.head
+        n = len(self) if n is None else min(n, len(self))
+        start = (head - n) % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            return [self.records[start:end]]
+        return [self.records[start:], self.records[:end - self.capacity]]
+
+    def latest(self, n=None):
+        """The newest n records as one array (copied only if the window wraps)."""
+        views = self.views(n)
+        return views[0] if len(views) == 1 else np.concatenate(views)
+
+    def since(self, t_start):
+        """Views of all records with t >= t_start, assuming ordered timestamps."""
+        result = []
+        for view in self.views():
+            i = np.searchsorted(view["t"], t_start)
+            if i < len(view):
+                result.append(view[i:])
+        return result
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if not self.readonly:
+            self._map.flush()
+        self.records = None
+        self._head = None
+        try:
+            self._map.close()
+        except BufferError:
+            # Views handed out by views() are still alive, the map closes with them
+            pass
+        os.close(self._fd)
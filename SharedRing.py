@@ -0,0 +1,134 @@
+"""
+Single-producer/single-consumer ring buffer in shared memory, for passing
+sample batches between processes without pickling them.
+
+Layout of the segment (native int64 / float64):
+
+    header   8 slots: head, tail, overruns, skipped, capacity, columns, lossless
+    t        capacity timestamps in ns
+    values   capacity x columns values
+
+As in RingBuffer, only the producer advances head and only the consumer
+advances tail, each with one store after the records are copied.
+
+A lossless ring drops (and counts in overruns) the records that do not fit,
+like RingBuffer. A lossy ring never refuses a write: the producer overwrites
+the oldest records and a consumer that fell behind skips ahead to the newest
+half of the ring (counted in skipped). That is what the GUI gets, so a busy
+GUI costs it old samples but never blocks or slows the producer.
+"""
+from multiprocessing import shared_memory
+import numpy as np
+
+HEAD, TAIL, OVERRUNS, SKIPPED, CAPACITY, COLUMNS, LOSSLESS = range(7)
+HEADER_SLOTS = 8
+
+
+def attach(name):
+    """Open an existing shared memory segment without taking ownership of it."""
+    try:
+        # Only the creator should unlink the segment (Python 3.13+)
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name)
+
+
+class SharedRing:
+
+    def __init__(self, name=None, capacity=None, columns=3, lossless=True):
+        """Create a ring with capacity records, or attach to the ring called name."""
+        if capacity is not None:
+            size = 8 * (HEADER_SLOTS + capacity * (1 + columns))
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            self.owner = True
+            header = np.ndarray(HEADER_SLOTS, dtype=np.int64, buffer=self.shm.buf)
+            header[:] = 0
+            header[CAPACITY], header[COLUMNS], header[LOSSLESS] = capacity, columns, lossless
+        else:
+            self.shm = attach(name)
+            self.owner = False
+        self.name = self.shm.name
+        self.header = np.ndarray(HEADER_SLOTS, dtype=np.int64, buffer=self.shm.buf)
+        self.capacity = int(self.header[CAPACITY])
+        self.columns = int(self.header[COLUMNS])
+        self.lossless = bool(self.header[LOSSLESS])
+        self.t = np.ndarray(self.capacity, dtype=np.int64, buffer=self.shm.buf, offset=8 * HEADER_SLOTS)
+        self.values = np.ndarray((self.capacity, self.columns), dtype=np.float64, buffer=self.shm.buf,
+                                 offset=8 * (HEADER_SLOTS + self.capacity))
+
+    def __len__(self):
+        return int(self.header[HEAD] - self.header[TAIL])
+
+    @property
+    def overruns(self):
+        return int(self.header[OVERRUNS])
+
+    @property
+    def skipped(self):
+        return int(self.header[SKIPPED])
+
+    def write(self, t, values):
+        """Append a batch of timestamps t (ns) and an (n, columns) array. Returns the records written."""
+        n = len(t)
+        head = int(self.header[HEAD])
+        if self.lossless:
+            free = self.capacity - (head - int(self.header[TAIL]))
+            if n > free:
+                self.header[OVERRUNS] += n - free
+                n = free
+        elif n > self.capacity // 2:
+            # Never overwrite what a consumer may still be copying, see read()
+            t, values = t[-(self.capacity // 2):], values[-(self.capacity // 2):]
+            n = len(t)
+        if n == 0:
+            return 0
+
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        self.t[start:start + first] = t[:first]
+        self.values[start:start + first] = values[:first]
+        if first < n:
+            self.t[:n - first] = t[first:n]
+            self.values[:n - first] = values[first:n]
+        self.header[HEAD] = head + n
+        return n
+
+    def read(self, max_records=None):
+        """Remove and return up to max_records as copied (t, values) arrays."""
+        head = int(self.header[HEAD])
+        tail = int(self.header[TAIL])
+        if not self.lossless and head - tail > self.capacity // 2:
+            self.header[SKIPPED] += head - self.capacity // 2 - tail
+            tail = head - self.capacity // 2
+        n = head - tail
+        if max_records is not None:
+            n = min(n, max_records)
+
+        start = tail % self.capacity
+        first = min(n, self.capacity - start)
+        if first == n:
+            t = self.t[start:start + n].copy()
+            values = self.values[start:start + n].copy()
+        else:
+            t = np.concatenate((self.t[start:], self.t[:n - first]))
+            values = np.concatenate((self.values[start:], self.values[:n - first]))
+
+        if not self.lossless:
+            # The producer writes at most half the ring at a time, so records
+            # older than half a ring before its current head may have been
+            # overwritten while they were copied
+            valid = int(self.header[HEAD]) - self.capacity // 2
+            torn = min(n, max(0, valid - tail))
+            if torn:
+                self.header[SKIPPED] += torn
+                t, values = t[torn:], values[torn:]
+        self.header[TAIL] = tail + n
+        return t, values
+
+    def close(self):
+        self.header = self.t = self.values = None
+        self.shm.close()
+
+    def unlink(self):
+        """Remove the segment; only the creating process should call this."""
+        self.shm.unlink()
@@ -0,0 +1,126 @@
+"""
+Streaming spectral analysis of the accelerometer streams.
+
+Each stream is cut into overlapping Hann windowed segments. Every segment
+is transformed exactly once, with the segments of all streams and axes
+stacked into a single rfft call, and its power spectrum is kept in a
+running sum. Each new segment then yields a Welch estimate over the last
+`segments` segments without touching the older ones again.
+
+Per window and axis the stage reports the dominant frequency, the RMS of
+the signal without its mean (i.e. without gravity) and the mean square in
+each frequency band.
+"""
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_BANDS = ((1, 10), (10, 50), (50, 200))
+
+
+class _Stream:
+
+    def __init__(self, channels, segments):
+        self.channels = channels
+        self.rate = None
+        self.pending = np.empty((0, channels))
+        self.pending_t = np.empty(0, dtype=np.int64)
+        self.spectra = deque(maxlen=segments)
+        self.psd_sum = None
+        self.latest = None
+
+
+class SpectralStage:
+
+    def __init__(self, nperseg=256, overlap=0.5, segments=8, bands=DEFAULT_BANDS):
+        self.nperseg = nperseg
+        self.hop = max(1, int(nperseg * (1 - overlap)))
+        self.segments = segments
+        self.bands = bands
+        self.window = np.hanning(nperseg)
+        self.window_power = (self.window ** 2).sum()
+        self.streams = {}
+        self.transforms = 0     # segments transformed so far, per axis
+
+    def add(self, name, t, values):
+        """Queue samples of a stream: t in ns and an (n, channels) array."""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = _Stream(values.shape[1], self.segments)
+        stream.pending = np.concatenate((stream.pending, values))
+        stream.pending_t = np.concatenate((stream.pending_t, np.asarray(t, dtype=np.int64)))
+        if stream.rate is None and len(stream.pending_t) >= self.nperseg:
+            # The sample rate is taken from the timestamps of the first segment
+            stream.rate = 1e9 / np.median(np.diff(stream.pending_t[:self.nperseg]))
+
+    def process(self):
+        """Transform all complete segments.
+
+        Returns {name: [result, ...]} with one result per new Welch window,
+        each a dict with "t" (ns, end of the window), "freqs", "psd"
+        (channels, freqs), "dominant_hz", "rms" and "bands" (channels, bands).
+        """
+        batch = []
+        for name, stream in self.streams.items():
+            if stream.rate is None or len(stream.pending) < self.nperseg:
+                continue
+            k = (len(stream.pending) - self.nperseg) // self.hop + 1
+            segs = sliding_window_view(stream.pending, self.nperseg, axis=0)[::self.hop][:k]
+            ends = stream.pending_t[self.nperseg - 1::self.hop][:k]
+            batch.append((name, segs, ends))
+            stream.pending = stream.pending[k * self.hop:]
+            stream.pending_t = stream.pending_t[k * self.hop:]
+        if not batch:
+            return {}
+
+        # One FFT over every new segment of every axis of every stream
+        stacked = np.concatenate([segs.reshape(-1, self.nperseg) for _, segs, _ in batch])
+        stacked = stacked - stacked.mean(axis=1, keepdims=True)
+        power = np.abs(np.fft.rfft(stacked * self.window, axis=1)) ** 2
+        power[:, 1:-1] *= 2
+        self.transforms += len(stacked)
+
+        results = {}
+        row = 0
+        for name, segs, ends in batch:
+            stream = self.streams[name]
+            n = segs.shape[0] * stream.channels
+            psd = (power[row:row + n] / (stream.rate * self.window_power)).reshape(segs.shape[0], stream.channels, -1)
+            row += n
+            results[name] = [self._window(stream, spectrum, t) for spectrum, t in zip(psd, ends)]
+            results[name] = [r for r in results[name] if r is not None]
+            if results[name]:
+                stream.latest = results[name][-1]
+        return results
+
+    def _window(self, stream, spectrum, t):
+        if stream.psd_sum is None:
+            stream.psd_sum = np.zeros_like(spectrum)
+        if len(stream.spectra) == stream.spectra.maxlen:
+            stream.psd_sum -= stream.spectra[0]
+        stream.spectra.append(spectrum)
+        stream.psd_sum += spectrum
+        if len(stream.spectra) < stream.spectra.maxlen:
+            return None
+
+        psd = stream.psd_sum / len(stream.spectra)
+        freqs = np.fft.rfftfreq(self.nperseg, 1 / stream.rate)
+        df = freqs[1]
+        bands = np.stack([psd[:, (freqs >= lo) & (freqs < hi)].sum(axis=1) * df for lo, hi in self.bands], axis=1)
+        rms = np.sqrt(psd[:, 1:].sum(axis=1) * df)
+        return {
+            "t": int(t),
+            "freqs": freqs,
+            "psd": psd,
+            "dominant_hz": np.where(rms > 0, freqs[1 + psd[:, 1:].argmax(axis=1)], np.nan),
+            "rms": rms,
+            "bands": bands,
+        }
+
+    def latest(self, name):
+        """The newest result of a stream, or None."""
+        stream = self.streams.get(name)
+        return stream.latest if stream else None
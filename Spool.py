@@ -0,0 +1,319 @@
+"""
+Disk-backed store-and-forward spool for the kit's MQTT messages.
+
+sensor-mqtt.py appends every message it publishes to the spool instead of
+handing it to paho directly, and a Forwarder drains the spool to the
+broker at QoS 1. While the Wi-Fi link is down the messages pile up on the
+SD card; once paho has reconnected they are sent in bulk, oldest first.
+An offset only counts as delivered when the broker has acknowledged it
+and everything before it, so a reconnect or a restart of the script
+resends from the last acknowledged offset: delivery is at least once.
+
+The spool is a directory of append-only segment files, named after the
+offset of their first byte (20 digits, ".spool"). Offsets count bytes
+across all segments, so an offset names a record for good. Layout,
+little endian:
+
+    header  8 byte magic "BFHSPL01", u64 offset of the segment
+    record  u32 body length, u16 topic id, u32 CRC-32 of the body, body
+
+A record with topic id 0xFFFF defines a topic for the rest of its segment:
+its body is the u16 id and the topic in UTF-8. Every other record is a
+message with the payload as body, so the topic costs two bytes per
+message and each segment can be read on its own.
+
+The acknowledged offset is kept in the file "ack". Segments that are
+fully acknowledged are deleted, and when the spool outgrows max_bytes the
+oldest segments are deleted even if unsent (dropped_bytes), so a long
+outage cannot fill the SD card. Appends are buffered and written every
+flush(); the file is fsynced every sync_interval seconds, and a record
+torn by a power loss is cut off when the spool is opened again.
+"""
+import bisect
+import collections
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b"BFHSPL01"
+HEADER = struct.Struct("<8sQ")
+RECORD = struct.Struct("<IHI")
+TOPIC_ID = struct.Struct("<H")
+TOPIC = 0xFFFF
+
+SEGMENT_BYTES = 8 << 20     # size at which a new segment is started
+MAX_BYTES = 512 << 20       # disk space of the spool at most, about one segment more
+SYNC_INTERVAL = 1.0         # seconds between fsyncs, the data a power loss may cost
+BUFFER_BYTES = 64 << 10     # appended bytes that are written before the next flush()
+READ_BYTES = 1 << 20        # bytes read from a segment at once
+WINDOW = 200                # messages in flight from a Forwarder
+
+
+class Spool:
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_bytes=MAX_BYTES, sync_interval=SYNC_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.appended = 0       # messages appended since opening
+        self.dropped_bytes = 0  # unsent bytes deleted to stay within max_bytes
+        self.truncated = 0      # bytes of a torn record cut off when opening
+        self.corrupt = 0        # segments whose rest was skipped on a bad record
+        self.segments = sorted(int(name[:-6]) for name in os.listdir(directory)
+                               if name.endswith(".spool") and name[:-6].isdigit())
+        self.committed = self._load_ack()
+        self._acked = self.committed
+        self._buffer = bytearray()
+        self._reader = None
+        self._synced = time.monotonic()
+        if self.segments:
+            self._recover()
+        else:
+            self._open_segment(self.committed)
+        if self.committed < self.segments[0]:
+            self.committed = self.segments[0]
+
+    def _path(self, base):
+        return os.path.join(self.directory, f"{base:020d}.spool")
+
+    def _load_ack(self):
+        try:
+            with open(os.path.join(self.directory, "ack")) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return 0
+
+    def _write_ack(self):
+        path = os.path.join(self.directory, "ack")
+        with open(path + ".tmp", "w") as f:
+            f.write(str(self.committed))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._acked = self.committed
+
+    def _open_segment(self, base):
+        self.segments.append(base)
+        self._file = open(self._path(base), "wb")
+        self._file.write(HEADER.pack(MAGIC, base))
+        self._topics = {}
+        self.end = base + HEADER.size
+
+    def _recover(self):
+        """Reopen the newest segment for appending, without a record torn at its end."""
+        base = self.segments[-1]
+        with open(self._path(base), "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size or HEADER.unpack_from(data)[0] != MAGIC:
+            # Not even the header made it to disk
+            self.truncated += len(data)
+            self.segments.pop()
+            self._open_segment(base)
+            return
+        topics, pos = {}, HEADER.size
+        for pos, _, _ in _records(data, topics, pos):
+            pass
+        if pos < len(data):
+            self.truncated += len(data) - pos
+        self._file = open(self._path(base), "r+b")
+        self._file.truncate(pos)
+        self._file.seek(pos)
+        self._topics = {topic: tid for tid, topic in topics.items()}
+        self.end = base + pos
+
+    @property
+    def pending_bytes(self):
+        """Bytes appended but not acknowledged yet."""
+        return self.end - self.committed
+
+    def append(self, topic, payload):
+        """Queue a message; returns the offset after it."""
+        tid = self._topics.get(topic)
+        if tid is None:
+            tid = self._topics[topic] = len(self._topics)
+            self._put(TOPIC, TOPIC_ID.pack(tid) + topic.encode())
+        self._put(tid, payload)
+        self.appended += 1
+        if len(self._buffer) >= BUFFER_BYTES:
+            self.flush()
+        if self.end - self.segments[-1] >= self.segment_bytes:
+            self._roll()
+        return self.end
+
+    def _put(self, tid, body):
+        self._buffer += RECORD.pack(len(body), tid, zlib.crc32(body))
+        self._buffer += body
+        self.end += RECORD.size + len(body)
+
+    def flush(self):
+        """Write the appended messages to the file; fsync and save the acknowledged offset if due."""
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+            self._file.flush()
+        if time.monotonic() - self._synced >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        if self.committed != self._acked:
+            self._write_ack()
+        self._synced = time.monotonic()
+
+    def _roll(self):
+        self.flush()
+        self.sync()
+        self._file.close()
+        self._open_segment(self.end)
+        # Over the limit: the oldest data goes, sent or not
+        while len(self.segments) > 2 and self.end - self.segments[0] > self.max_bytes:
+            if self.segments[1] > self.committed:
+                self.dropped_bytes += self.segments[1] - self.committed
+                self.committed = self.segments[1]
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        base = self.segments.pop(0)
+        if self._reader is not None and self._reader[0] == base:
+            self._reader[1].close()
+            self._reader = None
+        os.remove(self._path(base))
+
+    def ack(self, offset):
+        """Everything before offset was delivered; deletes the segments that are done."""
+        if offset <= self.committed:
+            return
+        self.committed = min(offset, self.end)
+        while len(self.segments) > 1 and self.segments[1] <= self.committed:
+            self._remove_oldest()
+
+    def read(self, offset, max_records=WINDOW):
+        """Up to max_records messages from offset on, as (offset after, topic, payload)."""
+        self.flush()
+        offset = max(offset, self.segments[0])
+        out = []
+        while len(out) < max_records and offset < self.end:
+            i = bisect.bisect_right(self.segments, offset) - 1
+            base = self.segments[i]
+            size = (self.segments[i + 1] if i + 1 < len(self.segments) else self.end) - base
+            if self._reader is None or self._reader[0] != base or self._reader[2] != offset - base:
+                self._seek(base, offset - base)
+            _, f, pos, topics = self._reader
+            f.seek(pos)
+            data = f.read(min(READ_BYTES, size - pos))
+            if len(data) >= RECORD.size and RECORD.size + RECORD.unpack_from(data)[0] > len(data):
+                # A record larger than READ_BYTES
+                data += f.read(RECORD.size + RECORD.unpack_from(data)[0] - len(data))
+            used = 0
+            for end, topic, body in _records(data, topics):
+                used = end
+                if topic is not None:
+                    out.append((base + pos + end, topic, body))
+                    if len(out) == max_records:
+                        break
+            if not used and pos < size:
+                # Damaged, go on with the next segment
+                self.corrupt += 1
+                used = size - pos
+            self._reader[2] = pos + used
+            offset = base + pos + used
+        return out
+
+    def _seek(self, base, pos):
+        """Position the reader at pos of a segment, with the topics defined before it."""
+        if self._reader is not None:
+            self._reader[1].close()
+        f = open(self._path(base), "rb")
+        topics = {}
+        pos = max(pos, HEADER.size)
+        for _ in _records(f.read(pos), topics, HEADER.size):
+            pass
+        self._reader = [base, f, pos, topics]
+
+    def close(self):
+        self.flush()
+        self.sync()
+        self._file.close()
+        if self._reader is not None:
+            self._reader[1].close()
+            self._reader = None
+
+
+def _records(data, topics, pos=0):
+    """(end, topic, body) of the complete, intact records in data from pos on.
+
+    Topic definitions are added to topics (id -> topic) and yielded with
+    topic and body None.
+    """
+    size = len(data)
+    while pos + RECORD.size <= size:
+        length, tid, crc = RECORD.unpack_from(data, pos)
+        end = pos + RECORD.size + length
+        if end > size:
+            return
+        body = data[pos + RECORD.size:end]
+        if zlib.crc32(body) != crc:
+            return
+        if tid == TOPIC:
+            topics[TOPIC_ID.unpack_from(body)[0]] = body[TOPIC_ID.size:].decode()
+            yield end, None, None
+        else:
+            yield end, topics.get(tid), body
+        pos = end
+
+
+class Forwarder:
+    """Sends the spool's messages through a connected paho client at QoS 1.
+
+    Up to window messages are in flight; pump() sends more as the broker
+    acknowledges them and moves the spool's acknowledged offset along.
+    After a disconnect paho resends what was in flight itself; a new
+    client needs a new Forwarder, which starts again from the spool's
+    acknowledged offset. The Forwarder takes over the client's on_publish
+    callback: MQTTMessageInfo.is_published() raises for a message first
+    sent while paho still thought it was connected, even once it went out.
+    """
+
+    def __init__(self, spool, client, window=WINDOW):
+        self.spool = spool
+        self.client = client
+        self.window = window
+        self.cursor = spool.committed
+        self.inflight = collections.deque()     # (mid, offset after the message)
+        self.sent = 0
+        self.delivered = 0
+        self._published = set()                 # mids the broker acknowledged, added by paho's thread
+        # The mid is the third argument with both callback API versions
+        client.on_publish = lambda *args: self._published.add(args[2])
+
+    def pump(self):
+        """Acknowledge what the broker confirmed and send more; returns the number of messages sent.
+
+        Also flushes the spool, so calling it every loop keeps the file
+        current while the broker is unreachable.
+        """
+        self.spool.flush()
+        done = None
+        while self.inflight and self.inflight[0][0] in self._published:
+            mid, done = self.inflight.popleft()
+            self._published.discard(mid)
+            self.delivered += 1
+        if done is not None:
+            self.spool.ack(done)
+        if not self.client.is_connected() or len(self.inflight) >= self.window:
+            return 0
+        # Data dropped over the size limit is skipped
+        self.cursor = max(self.cursor, self.spool.committed)
+        records = self.spool.read(self.cursor, self.window - len(self.inflight))
+        for offset, topic, payload in records:
+            self.inflight.append((self.client.publish(topic, payload, qos=1).mid, offset))
+            self.cursor = offset
+        self.sent += len(records)
+        return len(records)
+
+    @property
+    def backlog_bytes(self):
+        return self.spool.end - self.cursor
@@ -0,0 +1,68 @@
+"""
+Synthetic accelerometer signals for the simulators and benches.
+
+VibrationSignal models a sensor mounted on a rotating machine: gravity on
+a slightly tilted axis, the shaft frequency with a few harmonics and a slow
+speed wobble, a structural resonance rung by a bearing defect once per
+defect period, and white noise. Everything is drawn from one seed, so a
+seed always gives the same machine and, for the same sequence of calls,
+the same samples.
+
+values(t) takes an array of times in seconds and returns an (n, 3) array
+in g; calling the object with a scalar returns an (x, y, z) tuple, so it
+can replace Acquisition.default_signal on the simulated bus.
+"""
+import numpy as np
+
+NOISE_G = 0.01          # white noise per axis
+DEFECT_ORDER = 3.57     # bearing defect impulses per revolution (outer race of a typical ball bearing)
+
+
+class VibrationSignal:
+
+    def __init__(self, seed=0, rate=1000.0, shaft_hz=None):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        # Gravity tilted up to 10 degrees away from Z
+        tilt, turn = np.radians(rng.uniform(0, 10)), rng.uniform(0, 2 * np.pi)
+        self.gravity = np.array([np.sin(tilt) * np.cos(turn), np.sin(tilt) * np.sin(turn), np.cos(tilt)])
+        self.shaft_hz = shaft_hz if shaft_hz is not None else rng.uniform(15, 60)
+        self.wobble = rng.uniform(0.002, 0.01)          # relative speed variation
+        self.wobble_hz = rng.uniform(0.1, 0.5)
+        # Harmonics 1..4, amplitude falling with the order, own direction and phase each
+        amplitude = rng.uniform(0.05, 0.3)
+        self.harmonics = [(k, amplitude / k ** 2 * rng.uniform(0.3, 1.0, 3), rng.uniform(0, 2 * np.pi, 3))
+                          for k in range(1, 5)]
+        # Resonance below Nyquist, rung at the defect rate and decaying in a few ms
+        self.resonance_hz = min(rng.uniform(300, 450), 0.4 * rate)
+        self.resonance_gain = rng.uniform(0.02, 0.1) * rng.uniform(0.3, 1.0, 3)
+        self.decay_s = rng.uniform(0.002, 0.006)
+        self.noise = NOISE_G
+
+    @property
+    def frequency(self):
+        """Mean shaft frequency in Hz, what the kit's edge input would measure."""
+        return self.shaft_hz
+
+    def values(self, t):
+        """(n, 3) acceleration in g at the times t (seconds)."""
+        t = np.asarray(t, dtype=np.float64)
+        # Shaft angle with the speed wobble integrated in
+        revolutions = self.shaft_hz * (t - self.wobble * np.cos(2 * np.pi * self.wobble_hz * t)
+                                       / (2 * np.pi * self.wobble_hz))
+        out = np.tile(self.gravity, (len(t), 1))
+        for k, gain, phase in self.harmonics:
+            out += gain * np.sin(2 * np.pi * k * revolutions[:, None] + phase)
+        since_defect = np.mod(revolutions * DEFECT_ORDER, 1.0) / (self.shaft_hz * DEFECT_ORDER)
+        ring = np.exp(-since_defect / self.decay_s) * np.sin(2 * np.pi * self.resonance_hz * since_defect)
+        out += ring[:, None] * self.resonance_gain
+        out += self.rng.normal(0.0, self.noise, out.shape)
+        return out
+
+    def counts(self, t, scale=2048.0):
+        """values(t) as int16 sensor counts, scale counts per g (2048 at +-16 g)."""
+        return np.clip(np.rint(self.values(t) * scale), -32768, 32767).astype(np.int16)
+
+    def __call__(self, t):
+        x, y, z = self.values([t])[0]
+        return float(x), float(y), float(z)
@@ -0,0 +1,95 @@
+"""
+Analyze recorded sessions in parallel (see Analysis.py).
+
+    python analyze-sessions.py [files ...] [--jobs 4] [--rate 0] [--nperseg 256] [--out results.json]
+
+Takes Messdaten CSV recordings (their _freq.csv files are picked up
+automatically) and .bfhrec session files, by default everything in
+Messdaten. Each recording is loaded, aligned and analyzed in a worker
+process; results are cached in --cache by the hash of the files and the
+parameters, so a second run only reads the files to hash them.
+
+Prints one line per sensor with rate, gaps, RMS and dominant frequency per
+axis next to the measured frequency, and writes every result, spectra
+included, to --out as JSON.
+"""
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import time
+
+import Analysis
+from Channels import is_frequency
+
+
+def run(job):
+    """Worker: (path, params, cache directory) -> (path, result, cached)."""
+    path, params, cache_dir = job
+    cache = Analysis.AnalysisCache(cache_dir) if cache_dir else None
+    key = cache.key(path, params) if cache else None
+    result = cache.get(key) if cache else None
+    if result is not None:
+        result["path"] = path
+        return path, result, True
+    try:
+        result = Analysis.analyze(path, **params)
+    except (OSError, ValueError) as e:
+        return path, {"path": path, "error": str(e)}, False
+    if cache:
+        cache.put(key, result)
+    return path, result, False
+
+
+def print_result(result):
+    name = os.path.basename(result["path"])
+    if "error" in result:
+        print(f"{name}: {result['error']}")
+        return
+    span = result["aligned"]
+    freq = [v for k, v in (span or {}).items() if is_frequency(k) and v]
+    freq_text = f"{freq[0]['mean']:.2f} Hz" if freq else "-"
+    duration = span["duration_s"] if span else 0.0
+    print(f"{name}: {duration:.1f} s aligned at {span['rate_hz'] if span else 0:.0f} Hz, frequency {freq_text}")
+    for stream, stats in result["streams"].items():
+        if is_frequency(stream):
+            continue
+        spectrum = result["spectra"].get(stream)
+        rms = " ".join(f"{v:6.3f}" for v in spectrum["rms"]) if spectrum else "-"
+        dominant = " ".join(f"{v:6.1f}" for v in spectrum["dominant_hz"]) if spectrum else "-"
+        gaps = span["gap_fraction"].get(stream, 0.0) if span else 0.0
+        print(f"  {stream:<14}{stats['samples']:>7} samples {stats['rate_hz']:7.1f} Hz  gaps {gaps:5.1%}"
+              f"  rms {rms}  dominant Hz {dominant}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=["Messdaten/*.csv", "Messdaten/*.bfhrec"])
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--rate", type=float, default=0, help="common timebase in Hz, 0: the slowest sensor's rate")
+    parser.add_argument("--nperseg", type=int, default=Analysis.NPERSEG, help="samples per spectrum segment")
+    parser.add_argument("--max-gap", type=float, default=Analysis.MAX_GAP, help="sample periods that count as a gap")
+    parser.add_argument("--cache", default="Messdaten/.analysis-cache", help="cache directory")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--out", help="write all results to this JSON file")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.files for p in glob.glob(pattern) if not p.endswith("_freq.csv")})
+    params = {"rate": args.rate or None, "nperseg": args.nperseg, "max_gap": args.max_gap}
+    jobs = [(path, params, None if args.no_cache else args.cache) for path in paths]
+
+    start = time.perf_counter()
+    results, cached = {}, 0
+    with mp.Pool(max(1, min(args.jobs, len(jobs)))) as pool:
+        for path, result, hit in pool.imap_unordered(run, jobs):
+            results[path] = result
+            cached += hit
+    for path in paths:
+        print_result(results[path])
+    print(f"{len(paths)} recordings in {time.perf_counter() - start:.2f} s, {cached} from the cache")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump([results[p] for p in paths], f)
+        print(f"Results written to {args.out}")
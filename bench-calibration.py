@@ -0,0 +1,230 @@
+"""
+Calibration of the MPU6050s (Calibration.py) on emulated sensors, and the
+cost of converting counts on the host.
+
+Two MPU6050s on a FakeSMBus read a still kit with known errors: an offset
+and a gain per axis, noise, and a mounting tilt. The bench takes static
+captures like calibrate-sensors.py does and checks what the routines
+recover:
+
+    level   offsets from one level capture (a sensor without gain error)
+    fit     offset and gain per axis from the six axis up/down poses
+    align   the rotation onto the kit's axes: gravity of the mounted kit
+            in two orientations, after fit
+
+and that still_mean() refuses a capture of a moving sensor, that
+Codec.decode() with a calibration gives the same values as apply(), and
+that a .bfhrec file keeps the calibrations, with and without its index.
+
+Then it times the conversion of --samples counts: Calibration.apply(), a
+decode of binary payloads with and without it, and the per-sample dicts
+the JSON payloads were built from.
+
+Exits with status 1 if an offset is off by more than --offset-tol mg, a
+gain by more than --gain-tol, gravity after align by more than --tilt-tol
+degrees, or a check fails.
+
+    python bench-calibration.py [--seconds 0.5] [--noise 5] [--samples 200000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+import Calibration
+import Codec
+from Acquisition import FakeSMBus, FifoSensor, GRAVITY_MS2
+from Recorder import ChunkReader, ChunkRecorder
+
+ADDRESSES = (0x68, 0x69)
+ODR = 1000
+# Errors of the emulated sensors: offset in g and gain per axis
+ERRORS = {0x68: ((0.030, -0.045, 0.080), (1.0, 1.0, 1.0)),
+          0x69: ((-0.060, 0.020, -0.035), (1.02, 0.97, 1.01))}
+MOUNT_DEG = (7.0, -4.0)     # mounting tilt about the kit's x and y axes
+
+
+def rotation(x_deg, y_deg):
+    a, b = np.radians(x_deg), np.radians(y_deg)
+    rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    return ry @ rx
+
+
+class StillKit:
+    """Signals of the emulated sensors: gravity of the kit's pose in the sensor's axes, with its errors."""
+
+    def __init__(self, noise_g, seed=1):
+        self.gravity = np.array([0.0, 0.0, 1.0])   # in the sensor's axes
+        self.noise_g = noise_g
+        self.rng = np.random.default_rng(seed)
+
+    def signal(self, addr):
+        offset, gain = (np.array(e) for e in ERRORS[addr])
+
+        def read(t):
+            a = gain * self.gravity + offset + self.rng.normal(0.0, self.noise_g, 3)
+            return tuple(a.tolist())
+        return read
+
+
+def still_means(sensors, seconds):
+    """Mean counts per sensor of a capture, like calibrate-sensors.py takes them."""
+    for s in sensors:
+        s.reset()
+    parts = [[] for _ in sensors]
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        time.sleep(0.02)
+        for ix, s in enumerate(sensors):
+            parts[ix].append(s.read_raw()[1])
+    return [Calibration.still_mean(np.concatenate(p), s.accel_scale) for s, p in zip(sensors, parts)]
+
+
+def check_calibration(args, failures):
+    kit = StillKit(args.noise / 1e3)
+    bus = FakeSMBus(ADDRESSES, signal={addr: kit.signal(addr) for addr in ADDRESSES})
+    sensors = [FifoSensor(bus, addr, odr=ODR) for addr in ADDRESSES]
+    for s in sensors:
+        s.setup()
+    scale = sensors[0].accel_scale
+
+    print(f"{'sensor':<8}{'routine':<8}{'offset error mg':>18}{'gain error':>12}")
+    kit.gravity = np.array([0.0, 0.0, 1.0])
+    level = Calibration.level(still_means(sensors[:1], args.seconds)[0], scale)
+    offset_error = np.abs(level.offset / scale - ERRORS[0x68][0]).max() * 1e3
+    print(f"{'s104':<8}{'level':<8}{offset_error:>18.2f}{'':>12}")
+    if offset_error > args.offset_tol:
+        failures.append(f"level: offset off by {offset_error:.2f} mg")
+
+    poses = []
+    for axis in range(3):
+        for sign in (1.0, -1.0):
+            kit.gravity = np.zeros(3)
+            kit.gravity[axis] = sign
+            poses.append(still_means(sensors, args.seconds))
+    fitted = {}
+    for ix, addr in enumerate(ADDRESSES):
+        offset, gain = (np.array(e) for e in ERRORS[addr])
+        c = Calibration.fit([p[ix] for p in poses], scale)
+        fitted[addr] = c
+        offset_error = np.abs(c.offset / scale - offset).max() * 1e3
+        # The calibration's gain undoes the sensor's
+        gain_error = np.abs(c.gain * gain - 1).max()
+        print(f"{'s' + str(addr):<8}{'fit':<8}{offset_error:>18.2f}{gain_error:>12.4f}")
+        if offset_error > args.offset_tol:
+            failures.append(f"fit s{addr}: offset off by {offset_error:.2f} mg")
+        if gain_error > args.gain_tol:
+            failures.append(f"fit s{addr}: gain off by {gain_error:.4f}")
+
+    # The kit mounted tilted: align while it stands level, then tip it over by 30 degrees
+    mount = rotation(*MOUNT_DEG)
+    kit.gravity = mount.T @ np.array([0.0, 0.0, 1.0])
+    means = still_means(sensors, args.seconds)
+    aligned = {addr: Calibration.align(fitted[addr], mean) for addr, mean in zip(ADDRESSES, means)}
+    for kit_gravity in (np.array([0.0, 0.0, 1.0]), rotation(30.0, 0.0) @ np.array([0.0, 0.0, 1.0])):
+        kit.gravity = mount.T @ kit_gravity
+        means = still_means(sensors, args.seconds)
+        for addr, mean in zip(ADDRESSES, means):
+            g = aligned[addr].apply(mean[None, :])[0] / GRAVITY_MS2
+            tilt = np.degrees(np.arccos(np.clip(g @ kit_gravity / np.linalg.norm(g), -1, 1)))
+            print(f"{'s' + str(addr):<8}{'align':<8}{'gravity off by':>18}{tilt:>9.2f} deg")
+            if tilt > args.tilt_tol:
+                failures.append(f"align s{addr}: gravity off by {tilt:.2f} deg")
+    for s in sensors:
+        s.stop()
+
+    kit.noise_g = 0.1
+    try:
+        still_means(sensors[:1], args.seconds)
+        failures.append("still_mean() took a capture of a moving sensor")
+    except ValueError:
+        pass
+    return aligned[ADDRESSES[1]]
+
+
+def check_transport(calibration, failures):
+    """Codec.decode() with the calibration, and the CALB records of a .bfhrec file."""
+    counts = np.random.default_rng(2).integers(-20000, 20000, (500, 3)).astype(np.int16)
+    payload = Codec.encode_binary("s105", 0, 2_000_000, counts, GRAVITY_MS2 / calibration.counts_per_g)
+    decoded = Codec.decode(payload, calibration)["values"]
+    if not np.allclose(decoded, calibration.apply(counts)):
+        failures.append("Codec.decode() with a calibration differs from apply()")
+    restored = Calibration.Calibration.from_dict(calibration.to_dict())
+    if not np.allclose(restored.apply(counts), calibration.apply(counts)):
+        failures.append("to_dict()/from_dict() changes the calibration")
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "session.bfhrec")
+    recorder = ChunkRecorder(path)
+    recorder.add_calibration("kit/s105", calibration.to_dict())
+    recorder.append("kit/s105", np.arange(500), decoded)
+    recorder.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    # Without the index the records are scanned
+    with open(path + ".crash", "wb") as f:
+        f.write(data[:-16])
+    for p in (path, path + ".crash"):
+        with ChunkReader(p) as reader:
+            records = reader.calibrations.get("kit/s105", [])
+        if len(records) != 1 or records[0]["calibration"] != calibration.to_dict():
+            failures.append(f"{os.path.basename(p)}: {len(records)} calibrations read back")
+        os.remove(p)
+    os.rmdir(directory)
+
+
+def timed(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_conversion(calibration, samples, failures):
+    counts = np.random.default_rng(3).integers(-20000, 20000, (samples, 3)).astype(np.int16)
+    scale = GRAVITY_MS2 / calibration.counts_per_g
+    payloads = [Codec.encode_binary("s105", 0, 2_000_000, counts[i:i + 50], scale)
+                for i in range(0, samples, 50)]
+
+    def per_sample():
+        # The dict per sample the kit converted to for JSON payloads
+        return [{"x": round(x * scale, 3), "y": round(y * scale, 3), "z": round(z * scale, 3)}
+                for x, y, z in counts.tolist()]
+
+    results = [
+        ("Calibration.apply()", timed(lambda: calibration.apply(counts))),
+        ("decode, header scale", timed(lambda: [Codec.decode(p) for p in payloads])),
+        ("decode, calibration", timed(lambda: [Codec.decode(p, calibration) for p in payloads])),
+        ("per-sample dicts", timed(per_sample, 1)),
+    ]
+    print(f"\n{'conversion of ' + str(samples) + ' samples':<32}{'Msamples/s':>11}")
+    for name, seconds in results:
+        print(f"{name:<32}{samples / seconds / 1e6:>11.2f}")
+    if results[0][1] > results[-1][1]:
+        failures.append("apply() is slower than converting per sample")
+
+
+def main(args):
+    failures = []
+    calibration = check_calibration(args, failures)
+    check_transport(calibration, failures)
+    bench_conversion(calibration, args.samples, failures)
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=0.5, help="length of each capture")
+    parser.add_argument("--noise", type=float, default=5.0, help="mg of noise per sample and axis")
+    parser.add_argument("--samples", type=int, default=200000)
+    parser.add_argument("--offset-tol", type=float, default=2.0, help="mg")
+    parser.add_argument("--gain-tol", type=float, default=0.002)
+    parser.add_argument("--tilt-tol", type=float, default=0.2, help="degrees")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,60 @@
+"""
+Compare encode/decode throughput and bytes per sample of the legacy JSON
+payload against the binary Codec formats.
+
+    python bench-codec.py [--batches 1 10 100 1000] [--seconds 1]
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+import Codec
+
+SCALE = 9.80665 / 16384.0
+
+
+def make_batch(n):
+    t = 1758210031833784187 + np.arange(n, dtype=np.int64) * 1000000
+    counts = np.random.default_rng(0).integers(-2000, 2000, size=(n, 3)).astype(np.int16)
+    return t, counts
+
+
+def legacy_decode(payload):
+    """What Host.on_message did before the codec: json.loads and walk the dicts."""
+    data = json.loads(payload.decode("utf-8"))
+    return [(s["t"], s["x"], s["y"], s["z"]) for s in data["samples"]]
+
+
+def rate(func, seconds):
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--seconds", type=float, default=1)
+    args = parser.parse_args()
+
+    print(f"{'format':<14}{'batch':>7}{'bytes/sample':>14}{'encode samples/s':>19}{'decode samples/s':>19}")
+    for n in args.batches:
+        t, counts = make_batch(n)
+        accel = counts * SCALE
+        formats = {
+            "json": (lambda: Codec.encode_json([int(t[0])], t, accel), legacy_decode),
+            "json (codec)": (lambda: Codec.encode_json([int(t[0])], t, accel), Codec.decode),
+            "int16": (lambda: Codec.encode_binary("s104", t[0], 1000000, counts, SCALE), Codec.decode),
+            "float32": (lambda: Codec.encode_binary("s104", t[0], 1000000, accel.astype(np.float32)), Codec.decode),
+        }
+        for name, (encode, decode) in formats.items():
+            payload = encode()
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            enc = rate(encode, args.seconds) * n
+            dec = rate(lambda: decode(payload), args.seconds) * n
+            print(f"{name:<14}{n:>7}{len(payload) / n:>14.1f}{enc:>19,.0f}{dec:>19,.0f}")
@@ -0,0 +1,91 @@
+"""
+Replay all_sensor_data.csv through the old reopen-per-message CSV logging
+and through Recorder.CsvWriter, and compare the time spent in the MQTT
+callback and until everything is on disk.
+
+    python bench-csvwriter.py [--input all_sensor_data.csv] [--batch 1]
+"""
+import argparse
+import csv
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+from Recorder import CsvWriter
+
+
+def load_messages(path, batch):
+    """Split the recording into sensor and frequency messages of `batch` rows."""
+    sensor, freq = [], []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 8:
+                continue
+            if row[7]:
+                freq.append((row[0], float(row[7])))
+            elif row[4]:
+                sensor.append((row[0], [float(v) for v in row[4:7]]))
+    messages = []
+    for i in range(0, len(sensor), batch):
+        chunk = sensor[i:i + batch]
+        messages.append(("sensor", chunk[0][0], np.array([s for _, s in chunk])))
+    messages += [("freq", ts, value) for ts, value in freq]
+    return messages
+
+
+def replay_legacy(messages, sensor_file, freq_file):
+    """The logging of Host.py before the CsvWriter, one open() per message."""
+    lock = threading.Lock()
+    latest_s1 = ['', '', '']
+    for kind, ts, data in messages:
+        with lock:
+            if kind == "sensor":
+                with open(sensor_file, 'a', newline='') as f:
+                    writer = csv.writer(f)
+                    for s in data.round(3).tolist():
+                        writer.writerow([ts] + latest_s1 + s)
+            else:
+                with open(freq_file, 'a', newline='') as f:
+                    csv.writer(f).writerow([ts, data])
+
+
+def replay_buffered(messages, sensor_writer, freq_writer):
+    latest_s1 = ['', '', '']
+    for kind, ts, data in messages:
+        if kind == "sensor":
+            sensor_writer.write_rows([[ts] + latest_s1 + s for s in data.round(3).tolist()])
+        else:
+            freq_writer.write_rows([[ts, data]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="all_sensor_data.csv")
+    parser.add_argument("--batch", type=int, default=1, help="samples per sensor message")
+    args = parser.parse_args()
+
+    messages = load_messages(args.input, args.batch)
+    print(f"{len(messages)} messages from {args.input}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sensor_file, freq_file = os.path.join(tmp, "legacy.csv"), os.path.join(tmp, "legacy_freq.csv")
+        start = time.perf_counter()
+        replay_legacy(messages, sensor_file, freq_file)
+        legacy = time.perf_counter() - start
+        legacy_size = os.path.getsize(sensor_file)
+
+        sensor_writer = CsvWriter(os.path.join(tmp, "new.csv"))
+        freq_writer = CsvWriter(os.path.join(tmp, "new_freq.csv"))
+        start = time.perf_counter()
+        replay_buffered(messages, sensor_writer, freq_writer)
+        callback = time.perf_counter() - start
+        sensor_writer.close()
+        freq_writer.close()
+        buffered = time.perf_counter() - start
+        assert os.path.getsize(os.path.join(tmp, "new.csv")) == legacy_size
+
+    print(f"reopen per message: {legacy * 1000:8.1f} ms ({len(messages) / legacy:,.0f} msg/s)")
+    print(f"CsvWriter callback: {callback * 1000:8.1f} ms ({len(messages) / callback:,.0f} msg/s)")
+    print(f"CsvWriter total:    {buffered * 1000:8.1f} ms ({len(messages) / buffered:,.0f} msg/s)")
@@ -0,0 +1,85 @@
+"""
+Check that Plotter.EnvelopeBuffer keeps every extreme of the plotted window,
+then compare its update cost with the full-resolution PlotBuffer.
+
+    python bench-decimation.py [--points 46000] [--columns 900] [--rate 10000]
+
+The check feeds noise with random single-sample spikes in random batch
+sizes and compares the incremental envelope with a min/max computed from
+scratch over the same buckets. It exits non-zero on any mismatch.
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+from Plotter import EnvelopeBuffer, PlotBuffer
+
+
+def reference(samples, env):
+    """Brute-force envelope of the newest complete buckets."""
+    complete = len(samples) // env.bucket * env.bucket
+    window = samples[:complete][-env.columns * env.bucket:]
+    buckets = window.reshape(-1, env.bucket, samples.shape[1])
+    lo = np.full((env.columns, samples.shape[1]), np.nan)
+    hi = lo.copy()
+    if len(buckets):
+        lo[-len(buckets):] = buckets.min(axis=1)
+        hi[-len(buckets):] = buckets.max(axis=1)
+    return lo.T, hi.T
+
+
+def check(points, columns, rounds, seed=0):
+    rng = np.random.default_rng(seed)
+    env = EnvelopeBuffer(3, points, columns)
+    samples = np.empty((0, 3))
+    for _ in range(rounds):
+        batch = rng.normal(0, 1, (int(rng.integers(1, 3 * env.bucket * 7)), 3))
+        spikes = rng.random(batch.shape) < 0.001
+        batch[spikes] = rng.choice([-50.0, 50.0], size=spikes.sum())
+        env.extend(batch)
+        samples = np.concatenate((samples, batch))
+        # Forget old samples in whole buckets so the bucket boundaries stay put
+        samples = samples[max(0, len(samples) - 2 * points) // env.bucket * env.bucket:]
+
+        lo, hi = reference(samples, env)
+        out = env.ordered()
+        if not (np.array_equal(out[:, 0::2], lo, equal_nan=True) and np.array_equal(out[:, 1::2], hi, equal_nan=True)):
+            return False
+        # Every spike inside the shown window is visible in the envelope
+        shown = samples[:len(samples) // env.bucket * env.bucket][-env.size:]
+        if len(shown) and (np.nanmax(out, axis=1) != shown.max(axis=0)).any():
+            return False
+    return True
+
+
+def bench(buffer, rate, frames, interval=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    per_frame = int(rate * interval)
+    data = rng.normal(0, 1, (frames, per_frame, 3))
+    start = time.perf_counter()
+    for batch in data:
+        buffer.extend(batch)
+        buffer.ordered()
+    return (time.perf_counter() - start) / frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=46000, help="samples in the plotted window")
+    parser.add_argument("--columns", type=int, default=900, help="pixel columns of the plot")
+    parser.add_argument("--rate", type=float, default=10000, help="samples/s per sensor")
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    ok = all(check(points, columns, 300, seed)
+             for seed, (points, columns) in enumerate([(4600, 900), (1000, 1000), (997, 13), (args.points, args.columns)]))
+    print(f"extremes kept: {'ok' if ok else 'FAILED'}")
+
+    env = EnvelopeBuffer(3, args.points, args.columns)
+    full = bench(PlotBuffer(3, args.points), args.rate, args.frames)
+    dec = bench(env, args.rate, args.frames)
+    print(f"{args.points} points at {args.rate:.0f} samples/s, {args.columns} columns (bucket {env.bucket})")
+    print(f"PlotBuffer:     {full * 1e3:.3f} ms/frame, {args.points} points per line")
+    print(f"EnvelopeBuffer: {dec * 1e3:.3f} ms/frame, {2 * env.columns} points per line")
+    sys.exit(0 if ok else 1)
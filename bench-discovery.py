@@ -0,0 +1,191 @@
+"""
+Time to connect of the host discovery (Discovery.py) against the old polling.
+
+MiniBroker plays the host's broker on 127.0.0.1. For each scenario the
+host's client appears --trials times at a random moment and the time
+from its appearance until the kit knows the broker's IP is measured:
+
+    polling 1 s     the former get_single_client_ip loop: fork arp (and
+                    iw on the Pi) once a second
+    fake events     Discovery.find() on a FakeBackend woken by the join
+    dnsmasq event   ProcBackend on a lease file, woken by Discovery.py
+                    started as dnsmasq's dhcp-script would start it
+    cached          restart with the host still there, nothing in the
+                    neighbour table yet
+    stale cache     the cached host is gone, another client has the broker
+    two clients     a phone without broker joined after the host
+
+Also prints what one read of the neighbour table costs against forking
+arp. Exits with status 1 if a scenario picks the wrong IP or the event
+driven discovery takes longer than --limit ms (for dnsmasq, not counting
+the start of its script).
+
+    python bench-discovery.py [--trials 5] [--limit 50]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+import Discovery
+from Discovery import FakeBackend, ProcBackend
+from MiniBroker import MiniBroker
+
+HOST = "127.0.0.1"
+
+
+def timed_find(discovery, appear, rng, expected):
+    """ms from appear() until find() returned, and the IP found."""
+    found = {}
+
+    def wait():
+        found["ip"] = discovery.find(timeout=10)
+        found["at"] = time.perf_counter()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(rng.uniform(0.05, 0.3))
+    start = time.perf_counter()
+    appear()
+    waiter.join()
+    if found["ip"] != expected:
+        return None, found["ip"]
+    return (found["at"] - start) * 1e3, found["ip"]
+
+
+def polling(trials, rng):
+    """The former loop: arp once a second until the client shows up."""
+    times = []
+    for _ in range(trials):
+        joined = rng.uniform(0, 1)
+        start = time.perf_counter()
+        while True:
+            subprocess.run(["arp", "-n"], capture_output=True)
+            if time.perf_counter() - start >= joined:
+                break
+            time.sleep(1)
+        times.append((time.perf_counter() - start - joined) * 1e3)
+    return times
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    failures = []
+    broker = MiniBroker(port=0)
+    port = broker.start()
+    directory = tempfile.mkdtemp()
+    cache = os.path.join(directory, "broker-ip.json")
+    results = {}
+
+    def scenario(name, make, appear, expected=HOST, events=True):
+        times = []
+        for _ in range(args.trials):
+            if os.path.exists(cache):
+                os.remove(cache)
+            discovery, backend = make()
+            ms, ip = timed_find(discovery, lambda: appear(backend), rng, expected)
+            if ms is None:
+                failures.append(f"{name}: found {ip} instead of {expected}")
+                return
+            times.append(ms)
+        results[name] = (times, discovery.probes)
+        if events and statistics.median(times) > args.limit:
+            failures.append(f"{name}: {statistics.median(times):.1f} ms to connect, limit {args.limit} ms")
+
+    def fake():
+        backend = FakeBackend()
+        return Discovery.Discovery(backend, cache, port), backend
+
+    scenario("fake events", fake, lambda b: b.join(HOST))
+
+    # dnsmasq: the lease file is written, then the dhcp-script runs
+    leases = os.path.join(directory, "dnsmasq.leases")
+    arp = os.path.join(directory, "arp")
+    with open(arp, "w") as f:
+        f.write("IP address       HW type     Flags       HW address            Mask     Device\n")
+
+    def dnsmasq():
+        if os.path.exists(leases):
+            os.remove(leases)
+        backend = ProcBackend("wlan0", arp, leases, Discovery.EVENT_SOCKET)
+        return Discovery.Discovery(backend, cache, port), backend
+
+    def lease(backend):
+        with open(leases, "w") as f:
+            f.write(f"{int(time.time()) + 86400} 02:00:00:00:00:01 {HOST} laptop 01:02:00:00:00:00:01\n")
+        subprocess.run([sys.executable, "Discovery.py", "add", "02:00:00:00:00:01", HOST, "laptop"])
+
+    scenario("dnsmasq event", dnsmasq, lease, events=False)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "Discovery.py", "old", "02:00:00:00:00:01", HOST])
+    script = (time.perf_counter() - start) * 1e3
+    if "dnsmasq event" in results and statistics.median(results["dnsmasq event"][0]) - script > args.limit:
+        failures.append(f"dnsmasq event: {statistics.median(results['dnsmasq event'][0]) - script:.1f} ms "
+                        f"after the script started, limit {args.limit} ms")
+
+    # Restart with the cache: the host answers before the table has it
+    def cached():
+        discovery, backend = fake()
+        discovery._save(HOST)
+        return discovery, backend
+
+    def stale():
+        discovery, backend = fake()
+        discovery._save("127.0.0.2")
+        return discovery, backend
+
+    def phone(backend):
+        backend.join(HOST)
+        backend.join("127.0.0.3", "02:00:00:00:00:02")
+
+    for name, make, appear in (("stale cache", stale, lambda b: b.join(HOST)), ("two clients", fake, phone)):
+        scenario(name, make, appear)
+    # The cached host is found right away, find() need not wait for anything
+    times = []
+    for _ in range(args.trials):
+        discovery, _ = cached()
+        start = time.perf_counter()
+        ip = discovery.find(timeout=10)
+        times.append((time.perf_counter() - start) * 1e3)
+        if ip != HOST:
+            failures.append(f"cached: found {ip} instead of {HOST}")
+    results["cached"] = (times, discovery.probes)
+    results["polling 1 s"] = (polling(args.trials, rng), None)
+    broker.stop()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'scenario':<16}{'median ms':>10}{'max ms':>9}")
+    for name in ("polling 1 s", "fake events", "dnsmasq event", "cached", "stale cache", "two clients"):
+        if name in results:
+            times, _ = results[name]
+            print(f"{name:<16}{statistics.median(times):>10.1f}{max(times):>9.1f}")
+    print(f"(dnsmasq event includes {script:.0f} ms to start the dhcp-script)")
+
+    backend = ProcBackend("eth0", events=None)
+    start = time.perf_counter()
+    for _ in range(1000):
+        backend.neighbors()
+    table = (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    for _ in range(20):
+        subprocess.run(["arp", "-n"], capture_output=True)
+    fork = (time.perf_counter() - start) / 20 * 1e3
+    print(f"neighbour table read {table:.0f} us, arp -n {fork:.1f} ms")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--limit", type=float, default=50.0, help="ms the event driven discovery may take")
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,65 @@
+"""
+Benchmark the FIFO acquisition engine against the old per-sample register
+polling, using the simulated I2C bus. Reports samples/s per sensor.
+
+    python bench-fifo.py [--odr 1000] [--seconds 5] [--bus-hz 400000]
+"""
+import argparse
+import time
+
+from Acquisition import FakeSMBus, FifoSensor, ACCEL_XOUT0, ACCEL_CONFIG, PWR_MGMT_1
+
+ADDRESSES = (0x68, 0x69)
+
+
+def bench_fifo(odr, seconds, bus_hz, poll_interval):
+    bus = FakeSMBus(ADDRESSES, bus_hz=bus_hz)
+    sensors = [FifoSensor(bus, addr, odr=odr) for addr in ADDRESSES]
+    for s in sensors:
+        s.setup()
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        time.sleep(poll_interval)
+        for s in sensors:
+            s.read()
+    elapsed = time.perf_counter() - start
+
+    print(f"FIFO  @ {sensors[0].odr:.0f} Hz, poll every {poll_interval * 1000:.0f} ms")
+    for s in sensors:
+        print(f"  0x{s.address:02X}: {s.samples / elapsed:8.1f} samples/s, {s.overruns} overruns")
+    print(f"  {bus.transfers / elapsed:.0f} I2C transfers/s, {bus.bytes / elapsed:.0f} bytes/s")
+
+
+def bench_polling(seconds, bus_hz):
+    """Mimics mpu6050.get_accel_data(): 6 byte reads plus a range read per sample."""
+    bus = FakeSMBus(ADDRESSES, bus_hz=bus_hz)
+    for addr in ADDRESSES:
+        bus.write_byte_data(addr, PWR_MGMT_1, 0x00)
+    samples = dict.fromkeys(ADDRESSES, 0)
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for addr in ADDRESSES:
+            for reg in range(ACCEL_XOUT0, ACCEL_XOUT0 + 6):
+                bus.read_byte_data(addr, reg)
+            bus.read_byte_data(addr, ACCEL_CONFIG)
+            samples[addr] += 1
+    elapsed = time.perf_counter() - start
+
+    print("Polling get_accel_data()")
+    for addr, n in samples.items():
+        print(f"  0x{addr:02X}: {n / elapsed:8.1f} samples/s")
+    print(f"  {bus.transfers / elapsed:.0f} I2C transfers/s, {bus.bytes / elapsed:.0f} bytes/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--odr", type=float, default=1000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--bus-hz", type=int, default=400000)
+    parser.add_argument("--poll", type=float, default=0.02, help="seconds between FIFO drains")
+    args = parser.parse_args()
+
+    bench_polling(args.seconds, args.bus_hz)
+    bench_fifo(args.odr, args.seconds, args.bus_hz, args.poll)
@@ -0,0 +1,137 @@
+"""
+Accuracy and CPU cost of the frequency measurement.
+
+Accuracy: simulated edges with the timing errors of a Python callback
+(jitter, late edges) or of kernel event timestamps, both with bounces and
+missed edges, are evaluated every publish interval by the old 1 / last
+period method and by FrequencyMeter.
+CPU: time per edge spent in the callback thread and time per meter update.
+
+    python bench-frequency.py [--seconds 30] [--gate 0.5] [--jitter-us 100]
+"""
+import argparse
+import time
+import numpy as np
+
+from Frequency import CallbackEdges, FrequencyMeter, SimulatedEdges
+
+FREQUENCIES = (0.8, 5, 50, 200, 1000, 5000)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def accuracy(frequency, noise, args):
+    clock = Clock()
+    # Two identical sources: one for the old method, one for the meter
+    old_source, source = (SimulatedEdges(frequency, seed=1, clock=clock, **noise) for _ in range(2))
+    meter = FrequencyMeter(source, gate=args.gate)
+    step = int(args.interval * 1e9)
+    warmup = int(max(args.gate, 2.5 / frequency) * 1e9)
+    old, new = [], []
+    last = None
+    for now in range(step, int(args.seconds * 1e9), step):
+        clock.now = now
+        edges = old_source.drain()
+        # The old callback kept the last period only
+        history = edges if last is None else np.concatenate(([last], edges))
+        if len(history):
+            last = history[-1]
+        meter.update()
+        if now < warmup or len(history) < 2 and not old:
+            continue
+        if len(history) >= 2:
+            old.append(1e9 / (history[-1] - history[-2]))
+        else:
+            old.append(old[-1])
+        new.append(meter.frequency)
+    old = np.abs(np.array(old) / frequency - 1)
+    new = np.abs(np.array(new) / frequency - 1)
+    return old, new
+
+
+class _Device:
+    when_activated = None
+
+
+def callback_cost(n):
+    last_edge_time = None
+    frequency = 0.0
+
+    def on_rising_edge():
+        nonlocal last_edge_time, frequency
+        now = time.time()
+        if last_edge_time is not None:
+            period = now - last_edge_time
+            if period > 0:
+                frequency = 1.0 / period
+        last_edge_time = now
+
+    source = CallbackEdges(_Device(), capacity=n)
+    costs = {}
+    for name, callback in (("old callback", on_rising_edge), ("ring buffer", source._edge)):
+        start = time.perf_counter()
+        for _ in range(n):
+            callback()
+        costs[name] = (time.perf_counter() - start) / n
+    return costs
+
+
+def update_cost(frequency, gate, updates):
+    clock = Clock()
+    source = SimulatedEdges(frequency, jitter_ns=100_000, seed=1, clock=clock)
+    meter = FrequencyMeter(source, gate=gate)
+    elapsed = 0.0
+    for i in range(1, updates + 1):
+        clock.now = int(i * 0.1e9)
+        source.poll()
+        start = time.perf_counter()
+        meter.update()
+        elapsed += time.perf_counter() - start
+    return elapsed / updates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=30.0, help="simulated time per frequency")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between evaluations (FREQ_INTERVAL)")
+    parser.add_argument("--gate", type=float, default=0.5)
+    parser.add_argument("--jitter-us", type=float, default=100.0, help="timestamp noise of the callback")
+    parser.add_argument("--late-rate", type=float, default=0.01, help="share of edges stamped late")
+    parser.add_argument("--late-us", type=float, default=2000.0, help="mean delay of a late edge")
+    parser.add_argument("--kernel-jitter-us", type=float, default=2.0, help="timestamp noise of kernel events")
+    parser.add_argument("--bounce-rate", type=float, default=0.002)
+    parser.add_argument("--miss-rate", type=float, default=0.001)
+    args = parser.parse_args()
+
+    glitches = dict(bounce_rate=args.bounce_rate, miss_rate=args.miss_rate)
+    profiles = {
+        "callback timestamps": dict(jitter_ns=args.jitter_us * 1000, late_rate=args.late_rate,
+                                    late_ns=args.late_us * 1000, **glitches),
+        "kernel timestamps": dict(jitter_ns=args.kernel_jitter_us * 1000, **glitches),
+    }
+    print(f"Relative error, gate {args.gate} s, {args.bounce_rate:.1%} bounces, {args.miss_rate:.1%} missed edges")
+    for profile, noise in profiles.items():
+        if profile.startswith("callback"):
+            print(f"\n{profile}: jitter {args.jitter_us:.0f} us, {args.late_rate:.1%} late by {args.late_us:.0f} us")
+        else:
+            print(f"\n{profile}: jitter {args.kernel_jitter_us:.0f} us")
+        print(f"{'Hz':>8}{'old mean':>11}{'old p99':>10}{'old max':>10}{'gate mean':>11}{'gate p99':>10}{'gate max':>10}")
+        for frequency in FREQUENCIES:
+            old, new = accuracy(frequency, noise, args)
+            print(f"{frequency:>8g}" + "".join(f"{v:>10.3%} " for v in (
+                old.mean(), np.percentile(old, 99), old.max(), new.mean(), np.percentile(new, 99), new.max())))
+
+    print()
+    for name, cost in callback_cost(200_000).items():
+        print(f"{name:<14} {cost * 1e6:6.2f} us per edge in the callback thread")
+    for frequency in (50, 1000, 5000):
+        cost = update_cost(frequency, args.gate, 500)
+        print(f"meter update   {cost * 1e6:6.1f} us per update at {frequency} Hz "
+              f"({cost / args.interval:.3%} of one core at {1 / args.interval:.0f} updates/s)")
@@ -0,0 +1,155 @@
+"""
+Integration check of the asyncio ingest against a local broker stand-in.
+
+Starts MiniBroker, connects AsyncIngest through PahoBridge and publishes
+binary sensor messages as fast as paho can send them. The consumers are set
+up like in Host.py, made slower than real ones on purpose:
+
+    recorder   block,       stalls --stall ms every 50 batches
+    analytics  drop_oldest, runs the SpectralStage
+    plotter    coalesce,    drained every 100 ms by a GUI thread that
+               holds the GIL for --gui-busy ms per frame
+
+Checks that the recorder got every sample, that every queue accounts for
+all samples (out + dropped + queued = in) and stayed within its bounds.
+Exits with status 1 if a check fails.
+
+    python bench-ingest.py [--messages 20000] [--samples 20] [--inbound 200]
+"""
+import argparse
+import asyncio
+import sys
+import threading
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import Codec
+from AsyncIngest import AsyncIngest, BatchQueue, PahoBridge
+from MiniBroker import MiniBroker
+from Spectral import SpectralStage
+
+TOPICS = {"Sensor/s104": "s104", "Sensor/s105": "s105", "Sensor/Frequency": "freq"}
+
+
+def messages(count, samples):
+    rng = np.random.default_rng(1)
+    period = 1_000_000
+    result = []
+    for i in range(count):
+        if i % 50 == 49:
+            result.append(("Sensor/Frequency", f'{{"timestamp": {i * period}, "frequency_hz": 50.0}}'.encode()))
+            continue
+        name = ("s104", "s105")[i % 2]
+        counts = rng.integers(-2000, 2000, (samples, 3), dtype=np.int16)
+        result.append(("Sensor/" + name, Codec.encode_binary(name, i * samples * period, period, counts, 1 / 2048)))
+    return result
+
+
+def main(args):
+    broker = MiniBroker(port=0)
+    port = broker.start()
+
+    ingest = AsyncIngest(TOPICS, inbound=args.inbound)
+    recorded = {"samples": 0, "batches": 0}
+
+    async def record(stream, timestamp, t, values):
+        recorded["samples"] += len(t)
+        recorded["batches"] += 1
+        if recorded["batches"] % 50 == 0:
+            await asyncio.sleep(args.stall / 1e3)
+
+    spectral = SpectralStage(256, 0.5, 8)
+
+    def analyse(stream, timestamp, t, values):
+        if stream != "freq":
+            spectral.add(stream, t, values)
+            spectral.process()
+
+    recorder = ingest.add_consumer(BatchQueue("recorder", 20000, "block"), record)
+    analytics = ingest.add_consumer(BatchQueue("analytics", 8192, "drop_oldest"), analyse)
+    plotter = ingest.add_consumer(BatchQueue("plotter", 4600, "coalesce"))
+    ingest.start()
+    bridge = PahoBridge(ingest, "127.0.0.1", port)
+    bridge.start()
+
+    plotted = {"samples": 0, "frames": 0}
+    stop_gui = threading.Event()
+
+    def gui():
+        while not stop_gui.is_set():
+            frame = time.perf_counter()
+            for stream, timestamp, t, values in plotter.drain():
+                plotted["samples"] += len(t)
+            plotted["frames"] += 1
+            while time.perf_counter() - frame < args.gui_busy / 1e3:
+                pass
+            time.sleep(max(0.0, 0.1 - (time.perf_counter() - frame)))
+
+    gui_thread = threading.Thread(target=gui)
+    gui_thread.start()
+
+    msgs = messages(args.messages, args.samples)
+    sent = sum(args.samples if topic != "Sensor/Frequency" else 1 for topic, _ in msgs)
+    publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    publisher.max_queued_messages_set(0)
+    publisher.connect("127.0.0.1", port)
+    publisher.loop_start()
+    time.sleep(0.5)
+
+    start = time.perf_counter()
+    for topic, payload in msgs:
+        publisher.publish(topic, payload)
+    while ingest.counters["messages"] < len(msgs) and time.perf_counter() - start < args.timeout:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    bridge.stop()
+    ingest.stop()
+    stop_gui.set()
+    gui_thread.join()
+    plotted["samples"] += sum(len(item[2]) for item in plotter.drain())
+    publisher.loop_stop()
+    broker.stop()
+
+    counters, queues = ingest.stats()
+    print(f"{counters['messages']}/{len(msgs)} messages, {counters['samples']}/{sent} samples in {elapsed:.2f} s "
+          f"({counters['messages'] / elapsed:.0f} msg/s, {counters['samples'] / elapsed:.0f} samples/s)")
+    print(f"inbound high water {counters['inbound_high_water']}/{args.inbound}, "
+          f"paho thread blocked {counters['submit_blocked_s']:.2f} s")
+    print(f"{'queue':<10}{'policy':>12}{'in':>9}{'out':>9}{'dropped':>9}{'coalesced':>10}{'high water':>11}{'blocked s':>10}")
+    for name, q in queues.items():
+        print(f"{name:<10}{q['policy']:>12}{q['samples_in']:>9}{q['samples_out']:>9}{q['dropped']:>9}"
+              f"{q['coalesced']:>10}{q['high_water']:>11}{q['blocked_s']:>10.2f}")
+    print(f"GUI frames {plotted['frames']}, plotted {plotted['samples']} samples")
+
+    failures = []
+    if counters["messages"] != len(msgs):
+        failures.append("not every message was ingested")
+    if recorded["samples"] != sent:
+        failures.append(f"recorder got {recorded['samples']} of {sent} samples")
+    if counters["inbound_high_water"] > args.inbound:
+        failures.append("inbound queue exceeded its limit")
+    largest = args.samples
+    for queue in (recorder, analytics, plotter):
+        q = queue.stats()
+        if q["samples_in"] != q["samples_out"] + q["dropped"] + q["depth"]:
+            failures.append(f"{queue.name}: samples unaccounted for")
+        if q["high_water"] > queue.max_samples + largest:
+            failures.append(f"{queue.name}: exceeded its bound")
+    if plotted["samples"] != plotter.stats()["samples_out"]:
+        failures.append("plotter drained count mismatch")
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=20, help="samples per sensor message")
+    parser.add_argument("--inbound", type=int, default=200, help="messages between paho and the loop")
+    parser.add_argument("--stall", type=float, default=20.0, help="ms the recorder stalls every 50 batches")
+    parser.add_argument("--gui-busy", type=float, default=50.0, help="ms per 100 ms frame the GUI holds the GIL")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,167 @@
+"""
+Load test of the multi-kit host: many simulated sensors, discovered on the
+fly, against the ingest of Host.py.
+
+For each sensor count, a publisher process plays kits of two sensors
+(Sensor/kitNN/s104 and s105) plus a frequency topic per kit at --rate
+samples/s per sensor through MiniBroker. The host side is Host.py without
+the window: AsyncIngest with a ChannelRegistry, the SessionRecorder (CSV and
+.bfhrec) behind a block queue and a coalescing plot queue drained every
+100 ms.
+
+Reports offered and achieved throughput, how long after publishing the
+recorder had the samples and what the .bfhrec file holds per channel.
+Exits with status 1 if a channel was missed or a sample not recorded.
+
+    python bench-kits.py [--sensors 2 8 16 32 64] [--rate 1000] [--samples 25] [--seconds 5]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+import Codec
+from AsyncIngest import AsyncIngest, BatchQueue, PahoBridge
+from Channels import ChannelRegistry, FREQ_TOPIC, is_frequency, topic
+from MiniBroker import MiniBroker
+from Recorder import ChunkReader, SessionRecorder
+
+FREQ_RATE = 10      # frequency messages per second and kit
+
+
+def publish(port, sensors, args, result):
+    """Publisher process: every sensor sends one message per --samples/--rate seconds."""
+    import paho.mqtt.client as mqtt
+
+    kits = [f"kit{k:02d}" for k in range(-(-sensors // 2))]
+    names = [(kit, ("s104", "s105")[i % 2]) for i, kit in enumerate(k for k in kits for _ in (0, 1))][:sensors]
+    period = 1_000_000_000 // args.rate
+    counts = np.random.default_rng(1).integers(-2000, 2000, (args.samples, 3), dtype=np.int16)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.max_queued_messages_set(0)
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+
+    interval = args.samples / args.rate
+    ticks = int(args.seconds / interval)
+    freq_every = max(1, round(1 / (FREQ_RATE * interval)))
+    messages = samples = 0
+    info = None
+    start = time.perf_counter()
+    for i in range(ticks):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # Stamped so the newest sample is "now"; the host measures its delay from it
+        t0 = time.time_ns() - (args.samples - 1) * period
+        for kit, name in names:
+            info = client.publish(topic(kit, name), Codec.encode_binary(name, t0, period, counts, 1 / 2048))
+        messages += len(names)
+        samples += len(names) * args.samples
+        if i % freq_every == 0:
+            for kit in kits:
+                client.publish(topic(kit, FREQ_TOPIC), f'{{"timestamp": {time.time_ns()}, "frequency_hz": 50.0}}')
+            messages += len(kits)
+            samples += len(kits)
+    elapsed = time.perf_counter() - start
+    info.wait_for_publish()
+    client.loop_stop()
+    client.disconnect()
+    result.put((messages, samples, elapsed, len(kits), ticks * args.samples))
+
+
+def run(port, sensors, args, directory):
+    channels = ChannelRegistry()
+    csv_file = os.path.join(directory, f"kits_{sensors}.csv")
+    session = SessionRecorder(csv_file, "both", sensors=())
+    delays = []
+
+    def record(stream, timestamp, t, values):
+        if is_frequency(stream):
+            session.frequency(timestamp, float(values[0, 0]), stream)
+        else:
+            delays.append(time.time_ns() - t[-1])
+            session.samples(stream, str(timestamp), t, values)
+
+    ingest = AsyncIngest(channels, inbound=500)
+    recorder = ingest.add_consumer(BatchQueue("recorder", 1 << 17, "block"), record)
+    plotter = ingest.add_consumer(BatchQueue("plotter", 4600, "coalesce"))
+    ingest.start()
+    bridge = PahoBridge(ingest, "127.0.0.1", port)
+    bridge.start()
+    stop_gui = threading.Event()
+
+    def gui():
+        while not stop_gui.wait(0.1):
+            plotter.drain()
+
+    gui_thread = threading.Thread(target=gui)
+    gui_thread.start()
+    time.sleep(0.5)
+
+    result = mp.Queue()
+    publisher = mp.Process(target=publish, args=(port, sensors, args, result))
+    publisher.start()
+    messages, samples, elapsed, kits, per_sensor = result.get()
+    publisher.join()
+    deadline = time.perf_counter() + args.timeout
+    while ingest.counters["messages"] < messages and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    drained = time.perf_counter() - deadline + args.timeout
+
+    bridge.stop()
+    ingest.stop()
+    stop_gui.set()
+    gui_thread.join()
+    session.close()
+
+    counters, _ = ingest.stats()
+    with ChunkReader(csv_file.replace(".csv", ".bfhrec")) as reader:
+        stored = {c.name: len(reader.read(c.name)["t"]) for c in channels.channels()}
+    delays = np.array(delays) / 1e6
+    total = elapsed + drained
+    print(f"{sensors:>7} {len(channels):>8} {messages / elapsed:>9.0f} {samples / elapsed:>11.0f} "
+          f"{counters['messages'] / total:>9.0f} {counters['samples'] / total:>11.0f} "
+          f"{np.percentile(delays, 50):>8.1f} {np.percentile(delays, 99):>8.1f} {drained:>8.2f} "
+          f"{recorder.stats()['blocked_s']:>8.2f}")
+
+    failures = []
+    if len(channels) != sensors + kits:
+        failures.append(f"{sensors} sensors: {len(channels)} of {sensors + kits} channels discovered")
+    if counters["samples"] != samples or sum(stored.values()) != samples:
+        failures.append(f"{sensors} sensors: {counters['samples']} ingested, {sum(stored.values())} "
+                        f"recorded of {samples} samples")
+    if counters["errors"]:
+        failures.append(f"{sensors} sensors: {counters['errors']} decode errors")
+    uneven = [name for name, n in stored.items() if not is_frequency(name) and n != per_sensor]
+    if uneven:
+        failures.append(f"{sensors} sensors: channels {uneven[:3]} hold other than {per_sensor} samples")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, nargs="+", default=[2, 8, 16, 32, 64])
+    parser.add_argument("--rate", type=int, default=1000, help="samples/s per sensor")
+    parser.add_argument("--samples", type=int, default=25, help="samples per message")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the host to catch up")
+    args = parser.parse_args()
+
+    broker = MiniBroker(port=0)
+    port = broker.start()
+    failures = []
+    print(f"{args.rate} samples/s per sensor, {args.samples} samples per message, {args.seconds:.0f} s per run")
+    print(f"{'sensors':>7} {'channels':>8} {'sent/s':>9} {'samples/s':>11} {'host/s':>9} {'samples/s':>11} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'catchup':>8} {'blocked':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for sensors in args.sensors:
+            failures += run(port, sensors, args, directory)
+    broker.stop()
+    for f in failures:
+        print("FAIL:", f)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,128 @@
+"""
+Check of the latency instrumentation (Metrics.py) end to end.
+
+A fake kit publishes stamped sample batches through MiniBroker with its
+clock set --offset ms away from the host clock. Its samples are --acquire
+ms old when read and published --publish ms later, so those two stages
+have known ages. The host side is the ingest of Host.py with Telemetry,
+ClockSync answering pings and a recorder consumer.
+
+Checks that the estimated clock offset is within its error bound of the
+real one, that the acquire and publish ages come out as set, that every
+stage on the host lies between publish age and publish age plus a bound,
+and that the histogram percentiles agree with exact ones. Exits with
+status 1 if a check fails.
+
+    python bench-latency.py [--seconds 5] [--offset 250] [--acquire 5] [--publish 2]
+"""
+import argparse
+import sys
+import threading
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import Codec
+import Metrics
+from AsyncIngest import AsyncIngest, BatchQueue, PahoBridge
+from Channels import ChannelRegistry, topic
+from MiniBroker import MiniBroker
+
+KIT = "fake"
+SAMPLES = 20
+PERIOD = 1_000_000
+
+
+def fake_kit(port, args, stop):
+    """Publishes a batch every 20 ms with stamps on a clock args.offset ms off."""
+    offset = int(args.offset * 1e6)
+    clock = lambda: time.time_ns() + offset
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = lambda client, userdata, flags, reason, properties: client.subscribe(Metrics.PING_TOPIC)
+    client.message_callback_add(Metrics.PING_TOPIC, lambda client, userdata, msg: client.publish(
+        Metrics.pong_topic(KIT), Metrics.pong_payload(msg.payload, clock(), clock())))
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    counts = np.zeros((SAMPLES, 3), dtype=np.int16)
+    while not stop.is_set():
+        now = clock()
+        newest = now - int((args.acquire + args.publish) * 1e6)
+        acquired = newest + int(args.acquire * 1e6)
+        payload = Codec.encode_binary("s104", newest - (SAMPLES - 1) * PERIOD, PERIOD, counts, 1 / 2048,
+                                      acquired, published=now)
+        client.publish(topic(KIT, "s104"), payload)
+        time.sleep(0.02)
+    client.loop_stop()
+    client.disconnect()
+
+
+def main(args):
+    broker = MiniBroker(port=0)
+    port = broker.start()
+
+    telemetry = Metrics.Telemetry()
+    ingest = AsyncIngest(ChannelRegistry(), telemetry=telemetry)
+    ingest.add_consumer(BatchQueue("recorder", 1 << 16, "block"),
+                        lambda stream, timestamp, t, values: telemetry.age("record", stream, t))
+    ingest.start()
+    bridge = PahoBridge(ingest, "127.0.0.1", port)
+    bridge.add_handler(Metrics.PONG_TOPICS, lambda t, p: telemetry.clock.pong(t.split("/")[1], p))
+    bridge.start()
+
+    stop = threading.Event()
+    kit = threading.Thread(target=fake_kit, args=(port, args, stop))
+    kit.start()
+    end = time.monotonic() + args.seconds
+    while time.monotonic() < end:
+        bridge.publish(Metrics.PING_TOPIC, telemetry.clock.ping())
+        time.sleep(0.25)
+    stop.set()
+    kit.join()
+    time.sleep(0.2)
+    bridge.stop()
+    ingest.stop()
+    broker.stop()
+
+    report = telemetry.report()
+    report["stages"] = {s: dict(h, messages_per_s=0, samples_per_s=0) for s, h in report["totals"].items()}
+    print(Metrics.format_report(report))
+
+    failures = []
+    clock = telemetry.clock
+    estimate, bound = clock.offset(KIT), clock.error(KIT)
+    if estimate is None:
+        failures.append("no clock offset estimate")
+    elif abs(estimate - args.offset * 1e6) > bound + 1000:
+        failures.append(f"offset {estimate / 1e6:.3f} ms, real {args.offset} ms, bound {bound / 1e6:.3f} ms")
+    totals = report["totals"]
+    resolution = 1.01
+    for stage, expected in (("acquire", args.acquire), ("publish", args.acquire + args.publish)):
+        if not expected / resolution - 0.001 <= totals[stage]["p50"] <= expected * resolution + 0.001:
+            failures.append(f"{stage} p50 {totals[stage]['p50']:.3f} ms, expected {expected} ms")
+    for stage in ("receive", "decode", "record"):
+        s = totals[stage]
+        low = args.acquire + args.publish - (bound or 0) / 1e6 - 0.01
+        if not s["count"] or s["p50"] < low or s["p50"] > low + args.bound:
+            failures.append(f"{stage} p50 {s['p50']:.3f} ms outside {low:.2f}..{low + args.bound:.2f} ms")
+
+    values = np.random.default_rng(0).lognormal(8, 1.5, 100000).astype(np.int64)
+    histogram = Metrics.LatencyHistogram()
+    histogram.record(values)
+    for p in Metrics.PERCENTILES:
+        exact = np.percentile(values, p, method="inverted_cdf")
+        if abs(histogram.percentile(p) - exact) > exact / (histogram.half - 1) + 1:
+            failures.append(f"histogram p{p} {histogram.percentile(p)}, exact {exact}")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--offset", type=float, default=250.0, help="ms the kit clock is ahead of the host")
+    parser.add_argument("--acquire", type=float, default=5.0, help="ms from the newest sample to its read")
+    parser.add_argument("--publish", type=float, default=2.0, help="ms from the read to the publish")
+    parser.add_argument("--bound", type=float, default=50.0, help="ms the host stages may add at p50")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,155 @@
+"""
+Does a busy GUI delay ingest? Replays binary sensor messages at a fixed
+rate into the host while the GUI loop holds the GIL for --gui-busy ms of
+every 100 ms frame, once with everything in one process (threads, like
+Host.py) and once with the HostPipeline processes (like host-mp.py).
+
+Reports how late messages were handled against their schedule and whether
+the recorder got every sample.
+
+    python bench-pipeline.py [--seconds 10] [--rate 200] [--samples 20] [--gui-busy 80]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+import Codec
+from HostPipeline import Ingest, Pipeline
+from Recorder import ChunkReader, SessionRecorder
+
+SENSORS = ("s104", "s105")
+
+
+def payloads(args):
+    """Pre-encoded messages, alternating between the sensors."""
+    rng = np.random.default_rng(1)
+    period = 1_000_000_000 // (args.rate // len(SENSORS) * args.samples)
+    messages = []
+    for i in range(int(args.seconds * args.rate)):
+        name = SENSORS[i % len(SENSORS)]
+        t0 = (i // len(SENSORS)) * args.samples * period
+        counts = rng.integers(-2000, 2000, (args.samples, 3), dtype=np.int16)
+        messages.append(("Sensor/" + name, Codec.encode_binary(name, t0, period, counts, 1 / 2048)))
+    return messages
+
+
+def replay(messages, rate, handle):
+    """Hand messages to handle() on schedule; returns the lateness of each in ms."""
+    lag = np.empty(len(messages))
+    start = time.perf_counter()
+    for i, (topic, payload) in enumerate(messages):
+        due = start + i / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        handle(topic, payload)
+        lag[i] = (time.perf_counter() - due) * 1e3
+    return lag
+
+
+def busy_gui(seconds, busy_ms, read):
+    """Frames every 100 ms: read the new samples, then hold the GIL for busy_ms."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        frame = time.perf_counter()
+        read()
+        x = 0
+        while time.perf_counter() - frame < busy_ms / 1e3:
+            x += 1      # pure Python, never releases the GIL
+        time.sleep(max(0.0, 0.1 - (time.perf_counter() - frame)))
+
+
+def print_lag(mode, lag, recorded, sent):
+    print(f"{mode:<10} lag p50 {np.percentile(lag, 50):7.2f} ms  p99 {np.percentile(lag, 99):7.2f} ms  "
+          f"max {lag.max():7.2f} ms  recorded {recorded}/{sent} samples")
+
+
+def run_threads(messages, args, directory):
+    """Host.py layout: ingest in a thread of the GUI process, recorder writes queued."""
+    session = SessionRecorder(os.path.join(directory, "threads.csv"), "both", SENSORS)
+    queues = {name: [] for name in SENSORS}
+    lock = threading.Lock()
+
+    def handle(topic, payload):
+        batch = Codec.decode(payload)
+        name = topic.split("/")[-1]
+        session.samples(name, str(batch["timestamp"]), batch["t"], batch["values"])
+        with lock:
+            queues[name].append(batch["values"])
+
+    def read():
+        with lock:
+            for q in queues.values():
+                q.clear()
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("lag", replay(messages, args.rate, handle)))
+    thread.start()
+    busy_gui(args.seconds, args.gui_busy, read)
+    thread.join()
+    session.close()
+    return result["lag"], recorded_samples(session.sensor_writer.path)
+
+
+def feeder(config, rings, metrics_name, stop, profiles):
+    """Stands in for the MQTT ingest process of HostPipeline."""
+    stage = Ingest(config, rings, metrics_name, profiles)
+    lag = replay(config["messages"], config["rate"], stage.handle)
+    np.save(config["lag_file"], lag)
+    stage.close()
+    stop.wait()
+
+
+def run_processes(messages, args, directory):
+    config = {
+        "topics": {"Sensor/" + name: name for name in SENSORS},
+        "csv_file": os.path.join(directory, "processes.csv"),
+        "record_format": "both",
+        "flush_interval": 1.0,
+        "fsync": False,
+        "ringlog_dir": None,
+        "ringlog_records": 0,
+        "record_interval": 0.05,
+        "messages": messages,
+        "rate": args.rate,
+        "lag_file": os.path.join(directory, "lag.npy"),
+    }
+    pipeline = Pipeline(config, {name: 3 for name in SENSORS}, 1 << 18, 1 << 14, source=feeder)
+    pipeline.start()
+    views = [pipeline.view(name) for name in SENSORS]
+    busy_gui(args.seconds, args.gui_busy, lambda: [v.read() for v in views])
+    while not os.path.exists(config["lag_file"]):
+        time.sleep(0.05)
+    time.sleep(0.2)
+    stages, rings = pipeline.report()
+    pipeline.close()
+    for name, r in rings.items():
+        print(f"{'':<10} {name}: record overruns {r['record_overruns']}, view skipped {r['view_skipped']}")
+    return np.load(config["lag_file"]), recorded_samples(config["csv_file"])
+
+
+def recorded_samples(csv_file):
+    """Samples that made it into the .bfhrec file of a run."""
+    with ChunkReader(csv_file.replace(".csv", ".bfhrec")) as reader:
+        return sum(len(reader.read(name)["t"]) for name in SENSORS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--rate", type=int, default=200, help="messages per second, both sensors")
+    parser.add_argument("--samples", type=int, default=20, help="samples per message")
+    parser.add_argument("--gui-busy", type=float, default=80.0, help="ms per 100 ms frame the GUI holds the GIL")
+    args = parser.parse_args()
+
+    messages = payloads(args)
+    sent = len(messages) * args.samples
+    print(f"{len(messages)} messages, {sent} samples, GUI busy {args.gui_busy:.0f} ms of 100 ms")
+    with tempfile.TemporaryDirectory() as directory:
+        lag, count = run_threads(messages, args, directory)
+        print_lag("threads", lag, count, sent)
+        lag, count = run_processes(messages, args, directory)
+        print_lag("processes", lag, count, sent)
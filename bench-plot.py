@@ -0,0 +1,91 @@
+"""
+Headless frame-time benchmark of the live plot (Agg backend): the old
+deque + list() + full redraw update against Plotter.LiveFigure, with and
+without min/max decimation.
+
+    python bench-plot.py [--frames 100] [--rate 1000] [--points 4600]
+"""
+import argparse
+import time
+from collections import deque
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from Plotter import LiveFigure
+
+PANELS = [
+    {"ylabel": "Accel s104 (g)", "ylim": (-22, 22), "lines": [('X', 'r'), ('Y', 'g'), ('Z', 'b')]},
+    {"ylabel": "Accel s105 (g)", "ylim": (-22, 22), "lines": [('X', 'r'), ('Y', 'g'), ('Z', 'b')]},
+    {"ylabel": "Freq (Hz)", "ylim": (0, 200), "lines": [('Frequency (Hz)', 'm')]},
+]
+
+
+def frames_of_data(frames, per_frame, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(frames):
+        yield rng.normal(0, 3, (per_frame, 3)), rng.normal(0, 3, (per_frame, 3)), rng.uniform(0, 200, (1, 1))
+
+
+def bench_legacy(frames, per_frame, max_points):
+    """The Host.update of before: seven deques, list() per line, set_xlim and a full draw."""
+    fig, axs = plt.subplots(3, 1, figsize=(10, 8), sharex=True)
+    lines = [[ax.plot([], [], c)[0] for c in colors] for ax, colors in zip(axs, ("rgb", "rgb", "m"))]
+    for ax, spec in zip(axs, PANELS):
+        ax.set_ylim(*spec["ylim"])
+    data = [[deque([0] * 100, maxlen=max_points) for _ in panel] for panel in lines]
+    times = []
+    for s1, s2, f in frames_of_data(frames, per_frame):
+        start = time.perf_counter()
+        for panel, values in zip(data, (s1, s2, f)):
+            for s in values:
+                for d, v in zip(panel, s):
+                    d.append(v)
+        for ax, panel_lines, panel in zip(axs, lines, data):
+            for line, d in zip(panel_lines, panel):
+                line.set_data(range(len(d)), list(d))
+            ax.set_xlim(max(0, len(panel[0]) - max_points), len(panel[0]))
+        fig.canvas.draw()
+        times.append(time.perf_counter() - start)
+    plt.close(fig)
+    return np.array(times)
+
+
+def bench_live(frames, per_frame, max_points, decimate=False):
+    live = LiveFigure(PANELS, max_points, decimate=decimate)
+    for ix in range(len(PANELS)):
+        live.set_active(ix, True)
+    live.canvas.draw()
+    times = []
+    for s1, s2, f in frames_of_data(frames, per_frame):
+        start = time.perf_counter()
+        live.extend(0, s1)
+        live.extend(1, s2)
+        live.extend(2, f)
+        for ix in range(len(PANELS)):
+            live.set_active(ix, True)
+        live.draw_frame()
+        times.append(time.perf_counter() - start)
+    plt.close(live.fig)
+    return np.array(times), live.full_draws
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1000, help="samples/s per sensor")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds per frame")
+    parser.add_argument("--points", type=int, default=4600, help="MAX_POINTS")
+    args = parser.parse_args()
+
+    per_frame = int(args.rate * args.interval)
+    legacy = bench_legacy(args.frames, per_frame, args.points)
+    live, full_draws = bench_live(args.frames, per_frame, args.points)
+    decimated, _ = bench_live(args.frames, per_frame, args.points, decimate=True)
+    print(f"{args.frames} frames, {per_frame} samples per sensor and frame, {args.points} points")
+    print(f"legacy update:   mean {legacy.mean() * 1000:6.1f} ms, p95 {np.percentile(legacy, 95) * 1000:6.1f} ms")
+    print(f"LiveFigure blit: mean {live.mean() * 1000:6.1f} ms, p95 {np.percentile(live, 95) * 1000:6.1f} ms, "
+          f"{full_draws} full redraws")
+    print(f"  + decimation:  mean {decimated.mean() * 1000:6.1f} ms, p95 {np.percentile(decimated, 95) * 1000:6.1f} ms")
@@ -0,0 +1,154 @@
+"""
+Check and cost of the on-device processing (Processing.py) on a recording.
+
+Replays a sensor of all_sensor_data.csv (or --file) as raw counts in
+batches of --batch samples through a Processor in every mode, like the
+sensor loop of sensor-mqtt.py does, and prints the time per batch, the
+share of one core that would take at the kit's --rate, and the payload
+bytes per second published compared with raw, with the samples grouped
+into messages by a Batcher of --latency seconds like on the kit.
+
+Checks that the streamed decimation equals filtering the whole recording
+at once, that a ramp comes out of the filter at its own timestamps (no
+delay), that a tone in the pass band keeps its amplitude while one that
+would alias is suppressed, and that the features match a direct
+computation per window. Exits with status 1 if a check fails.
+
+    python bench-processing.py [--file all_sensor_data.csv] [--sensor s105] [--batch 10] [--factor 4] [--latency 0.02]
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+import Codec
+from Acquisition import GRAVITY_MS2
+from Batching import Batcher
+from Processing import MODES, Decimator, Processor
+from Recorder import load_csv
+
+COUNTS_PER_G = 2048
+
+
+def replay(processor, t, counts, args):
+    """Feed the recording in batches; returns seconds, payload bytes and the outputs.
+
+    The samples go through a Batcher on the recording's clock, set up like
+    sensor-mqtt.py does, so the payloads are the messages the kit publishes.
+    """
+    scale = GRAVITY_MS2 / COUNTS_PER_G
+    batcher = Batcher(args.latency + processor.delay_ns / 1e9)
+    out_t, out_counts, features = [], [], []
+    size = 0
+    elapsed = 0.0
+    for i in range(0, len(t), args.batch):
+        start = time.perf_counter()
+        bt, bc, f = processor.process(t[i:i + args.batch], counts[i:i + args.batch])
+        elapsed += time.perf_counter() - start
+        batcher.add(bt, bc, 0)
+        now = int(t[min(i + args.batch, len(t)) - 1])
+        while batcher.pending and (batcher.due(now) or i + args.batch >= len(t)):
+            mt, mc = batcher.take(now)
+            size += len(Codec.encode_binary(args.sensor, mt[0], processor.output_period_ns, mc, scale))
+            out_t.append(mt)
+            out_counts.append(mc)
+        if f is not None:
+            size += len(Codec.encode_features(args.sensor, args.window, f, scale))
+            features.append(f)
+    return elapsed, size, out_t, out_counts, features
+
+
+def tone_gain(factor, rate, freq, seconds=20.0, batch=10):
+    """Amplitude of a decimated unit sine relative to its input."""
+    period_ns = int(1e9 / rate)
+    t = np.arange(int(seconds * rate), dtype=np.int64) * period_ns
+    x = np.sin(2 * np.pi * freq * t / 1e9)[:, None]
+    decimator = Decimator(factor, period_ns)
+    parts = [decimator.process(t[i:i + batch], x[i:i + batch])[1] for i in range(0, len(t), batch)]
+    y = np.concatenate(parts)[:, 0]
+    return np.sqrt(2 * np.mean(y[len(y) // 4:] ** 2))
+
+
+def main(args):
+    failures = []
+    streams = load_csv(args.file)
+    t, values = streams[args.sensor]
+    counts = np.clip(np.rint(values / (GRAVITY_MS2 / COUNTS_PER_G)), -32768, 32767).astype(np.int16)
+    steps = np.diff(t)
+    period_ns = int(np.median(steps[steps > 0]))
+    rate = 1e9 / period_ns
+    print(f"{args.file} {args.sensor}: {len(t)} samples at {rate:.0f} Hz, batches of {args.batch}")
+
+    raw_size = None
+    print(f"{'mode':<10}{'us/batch':>10}{'ns/sample':>11}{'core %':>8}{'kB/s':>8}{'vs raw':>8}")
+    results = {}
+    for mode in MODES:
+        processor = Processor(period_ns, mode, args.factor, args.window)
+        elapsed, size, out_t, out_counts, features = replay(processor, t, counts, args)
+        results[mode] = (out_t, out_counts, features)
+        raw_size = raw_size or size
+        batches = -(-len(t) // args.batch)
+        duration = len(t) / rate
+        # Cost at the kit's rate: same work per sample, args.rate samples/s per sensor, two sensors
+        core = elapsed / len(t) * args.rate * 2 * 100
+        print(f"{mode:<10}{elapsed / batches * 1e6:>10.1f}{elapsed / len(t) * 1e9:>11.0f}{core:>8.2f}"
+              f"{size / duration / 1e3:>8.1f}{size / raw_size:>8.1%}")
+
+    # Streaming equals one pass over everything, sample for sample
+    out_t, out_counts, _ = results["decimated"]
+    whole_t, whole = Decimator(args.factor, period_ns).process(t, counts)
+    streamed = np.concatenate(out_counts)
+    if not np.array_equal(np.concatenate(out_t), whole_t) or \
+            not np.array_equal(streamed, np.clip(np.rint(whole), -32768, 32767).astype(np.int16)):
+        failures.append("streamed decimation differs from decimating the whole recording")
+
+    # A ramp passes a linear phase filter unchanged, at its own timestamps
+    ramp_t = np.arange(5000, dtype=np.int64) * period_ns
+    ramp_out_t, ramp_out = Decimator(args.factor, period_ns).process(ramp_t, ramp_t[:, None] / 1e6)
+    if np.max(np.abs(ramp_out[:, 0] - ramp_out_t / 1e6)) > 1e-6:
+        failures.append("decimated timestamps are shifted against the filtered signal")
+
+    nyquist = rate / args.factor / 2
+    delay = Processor(period_ns, "decimated", args.factor).delay_ns / 1e6
+    passband = tone_gain(args.factor, rate, 0.5 * nyquist)
+    alias = tone_gain(args.factor, rate, 1.3 * nyquist)
+    print(f"decimated to {rate / args.factor:.1f} Hz: tone at {0.5 * nyquist:.1f} Hz x {passband:.4f}, "
+          f"at {1.3 * nyquist:.1f} Hz (would alias) {20 * np.log10(max(alias, 1e-12)):.0f} dB, "
+          f"published {delay:.0f} ms later")
+    if abs(passband - 1) > 0.01:
+        failures.append(f"pass band gain {passband:.4f}")
+    if alias > 1e-3:
+        failures.append(f"alias suppressed only to {20 * np.log10(alias):.0f} dB")
+
+    # Features against a direct computation
+    window = max(1, round(args.window * 1e9 / period_ns))
+    _, _, features = results["features"]
+    k = len(t) // window
+    blocks = counts[:k * window].astype(np.float64).reshape(k, window, 3)
+    deviation = blocks - blocks.mean(axis=1, keepdims=True)
+    rms = np.sqrt((deviation ** 2).mean(axis=1))
+    peak = np.abs(deviation).max(axis=1)
+    got = {name: np.concatenate([f[name] for f in features]) for name in ("rms", "peak", "crest")}
+    if len(got["rms"]) != k or not np.allclose(got["rms"], rms) or not np.allclose(got["peak"], peak) \
+            or not np.allclose(got["crest"], np.divide(peak, rms, out=np.zeros_like(peak), where=rms > 0)):
+        failures.append("features differ from the direct computation")
+    else:
+        crest = got["crest"].max(axis=1)
+        print(f"{k} feature windows of {window} samples, crest factor median {np.median(crest):.2f}, "
+              f"max {crest.max():.2f}")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default="all_sensor_data.csv")
+    parser.add_argument("--sensor", default="s105")
+    parser.add_argument("--batch", type=int, default=10, help="samples per sensor loop read")
+    parser.add_argument("--factor", type=int, default=4, help="decimation factor")
+    parser.add_argument("--window", type=float, default=0.5, help="seconds per feature window")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds a sample may wait for its message")
+    parser.add_argument("--rate", type=float, default=500, help="kit sample rate for the core share")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,147 @@
+"""
+Highest output data rate the I2C bus sustains for each acquisition profile.
+
+For every profile of Acquisition.PROFILES two emulated MPU6050s on a
+FakeSMBus with the Pi's I2C timing (HAL.I2C_HZ, --latency of driver time
+per transfer) are set up with the profile's ranges and channels and drained
+by one Sampler each, like the kit does. What the bus sustains only depends
+on the bytes per sample, so it is measured once per size: starting at the
+bound, the ODR is lowered divider by divider of the 8 kHz sample clock
+until both sensors deliver at least 99 % of it without a FIFO or ring
+buffer overrun in two trials of --seconds. A profile's highest ODR is the
+fastest its DLPF's sample clock allows up to that rate.
+
+    bytes       FIFO bytes per sample: 6 accel, 2 temp, 6 gyro
+    bound       ODR at which both sensors' reads fill the shared bus: per
+                poll a FIFO count and INT_STATUS read, then the blocks
+    bus max     highest ODR the bus sustains for samples of that size
+    max ODR     highest ODR of the profile's DLPF up to bus max
+    delivered   samples/s of the slowest sensor at max ODR
+    busy        share of the time the bus was busy at max ODR
+    setup ms    FifoSensor.setup(), the registers written in blocks and
+                read back, against one transfer per register (per-reg)
+
+Exits with status 1 if a profile's own ODR is above its highest sustained
+one.
+
+    python bench-profiles.py [--profiles default vibration shock motion] [--seconds 2]
+                             [--latency 60] [--poll 0.02]
+"""
+import argparse
+import math
+import sys
+import time
+
+import HAL
+from Acquisition import (ACCEL_CONFIG, FIFO_EN, GYRO_CONFIG, MPU_CONFIG, PROFILES, PWR_MGMT_1, SMPLRT_DIV,
+                         FakeSMBus, FifoSensor, Sampler, gyro_output_rate, profile)
+from RingBuffer import RingBuffer
+
+ADDRESSES = (0x68, 0x69)
+
+
+def transfer_seconds(nbytes, latency):
+    # start, address, register, repeated start and 9 clocks per byte
+    return (3 + nbytes) * 9 / HAL.I2C_HZ + latency
+
+
+def bound(sample_bytes, block, args):
+    """ODR at which the reads of all sensors per --poll take the whole bus."""
+    latency = args.latency / 1e6
+    per_poll = transfer_seconds(2, latency) + transfer_seconds(1, latency)
+    per_sample = (sample_bytes * 9 / HAL.I2C_HZ + transfer_seconds(0, latency) * sample_bytes / block)
+    return (args.poll / len(ADDRESSES) - per_poll) / (args.poll * per_sample)
+
+
+def bus_max(settings, limit, args):
+    """Highest ODR of the 8 kHz sample clock up to limit that two sensors sustain with settings."""
+    clock = gyro_output_rate(0)
+    for divider in range(256):
+        odr = clock / (divider + 1)
+        if odr > limit:
+            continue
+        # Twice, a rate the bus only sustains by luck on a busy core is no maximum
+        results = [trial(dict(settings, dlpf=0), odr, args) for _ in range(2)]
+        if all(rate >= 0.99 * odr and not overruns for rate, overruns, _ in results):
+            return odr
+    return 0.0
+
+
+def trial(settings, odr, args):
+    """(delivered samples/s of the slowest sensor, overruns, bus busy share) at one ODR."""
+    bus = FakeSMBus(ADDRESSES, HAL.I2C_HZ, latency=args.latency / 1e6)
+    sensors = [FifoSensor.from_profile(bus, addr, dict(settings, odr=odr)) for addr in ADDRESSES]
+    samplers = []
+    for s in sensors:
+        s.setup()
+        samplers.append(Sampler(s, RingBuffer(int(s.odr * (args.seconds + 2)), s.width), args.poll))
+    for sampler in samplers:
+        sampler.start()
+    # Past the first drains, then count
+    time.sleep(0.3)
+    counts = [s.samples for s in sensors]
+    transfers, nbytes = bus.transfers, bus.bytes
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - start
+    counts = [s.samples - n for s, n in zip(sensors, counts)]
+    transfers, nbytes = bus.transfers - transfers, bus.bytes - nbytes
+    for sampler in samplers:
+        sampler.stop()
+    overruns = sum(sum(sampler.overruns()) for sampler in samplers)
+    busy = (transfers * transfer_seconds(0, args.latency / 1e6) + nbytes * 9 / HAL.I2C_HZ) / elapsed
+    errors = [sampler.error for sampler in samplers if sampler.error is not None]
+    if errors:
+        raise errors[0]
+    return min(counts) / elapsed, overruns, busy
+
+
+def setup_ms(settings, args):
+    """ms of FifoSensor.setup() and of the same settings written one register per transfer."""
+    bus = FakeSMBus(ADDRESSES[:1], HAL.I2C_HZ, latency=args.latency / 1e6)
+    sensor = FifoSensor.from_profile(bus, ADDRESSES[0], settings)
+    start = time.perf_counter()
+    sensor.setup()
+    batched = time.perf_counter() - start
+    start = time.perf_counter()
+    for register, value in ((PWR_MGMT_1, 0x00), (MPU_CONFIG, sensor.dlpf), (SMPLRT_DIV, sensor.divider),
+                            (GYRO_CONFIG, sensor.gyro_range), (ACCEL_CONFIG, sensor.accel_range),
+                            (FIFO_EN, sensor.fifo_enable)):
+        bus.write_byte_data(ADDRESSES[0], register, value)
+    sensor.reset()
+    return batched * 1e3, (time.perf_counter() - start) * 1e3
+
+
+def main(args):
+    failures = []
+    sustained = {}
+    print(f"{'profile':<11}{'odr':>6}{'bytes':>6}{'bound':>7}{'bus max':>9}{'max ODR':>9}{'delivered':>11}"
+          f"{'busy':>6}{'setup ms':>10}{'per-reg':>9}")
+    for name in args.profiles:
+        settings = profile(name)
+        probe = FifoSensor.from_profile(None, ADDRESSES[0], settings)
+        limit = bound(probe.sample_bytes, probe.block_size, args)
+        if probe.sample_bytes not in sustained:
+            sustained[probe.sample_bytes] = bus_max(settings, limit, args)
+        top = sustained[probe.sample_bytes]
+        clock = gyro_output_rate(settings["dlpf"])
+        # The fastest divider of the profile's clock at or below bus max
+        odr = clock / math.ceil(clock / top - 1e-6) if top else 0.0
+        rate, _, busy = trial(settings, odr, args) if odr else (0.0, 0, 0.0)
+        batched, per_register = setup_ms(settings, args)
+        print(f"{name:<11}{settings['odr']:>6}{probe.sample_bytes:>6}{limit:>7.0f}{top:>9.0f}{odr:>9.0f}{rate:>11.0f}"
+              f"{busy:>6.0%}{batched:>10.2f}{per_register:>9.2f}")
+        if settings["odr"] > odr:
+            failures.append(f"{name}: {settings['odr']} Hz is not sustained, at most {odr:.0f} Hz")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--seconds", type=float, default=2.0, help="length of each trial")
+    parser.add_argument("--latency", type=float, default=HAL.I2C_LATENCY * 1e6, help="us of driver time per I2C transfer")
+    parser.add_argument("--poll", type=float, default=0.02, help="seconds between FIFO drains, POLL_INTERVAL")
+    sys.exit(main(parser.parse_args()))
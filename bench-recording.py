@@ -0,0 +1,60 @@
+"""
+Compare loading Messdaten CSV recordings with reading the same data from
+.bfhrec session files, in full and for a short time range.
+
+    python bench-recording.py [files ...]
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+from Recorder import ChunkReader, load_csv
+
+convert = __import__("convert-csv").convert
+
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def read_all(path):
+    with ChunkReader(path) as reader:
+        return {name: reader.read(name) for name in reader.streams}
+
+
+def read_range(path, seconds):
+    """The last `seconds` of the longest stream."""
+    with ChunkReader(path) as reader:
+        name = max(reader.streams, key=lambda n: sum(c[1] for c in reader.chunks(n)))
+        t_end = reader.chunks(name)[-1][3]
+        return reader.read(name, t_end - int(seconds * 1e9), t_end)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=["Messdaten/*.csv", "all_sensor_data.csv"])
+    parser.add_argument("--range", type=float, default=1.0, help="seconds read in the range test")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.files for p in glob.glob(pattern) if not p.endswith("_freq.csv")})
+    print(f"{'file':<40}{'samples':>9}{'csv kB':>9}{'rec kB':>9}{'csv ms':>9}{'rec ms':>9}{'range ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in paths:
+            csv_size = os.path.getsize(path)
+            freq_path = path.replace(".csv", "_freq.csv")
+            if os.path.exists(freq_path):
+                csv_size += os.path.getsize(freq_path)
+            csv_time, streams = timed(lambda: load_csv(path))
+            rec, counts = convert(path, tmp)
+            rec_time, _ = timed(lambda: read_all(rec))
+            range_time, _ = timed(lambda: read_range(rec, args.range))
+            print(f"{os.path.basename(path):<40}{sum(counts.values()):>9}{csv_size / 1024:>9.0f}"
+                  f"{os.path.getsize(rec) / 1024:>9.0f}{csv_time * 1000:>9.1f}{rec_time * 1000:>9.2f}{range_time * 1000:>10.2f}")
@@ -0,0 +1,258 @@
+"""
+Recovery of the kit's state machine (Kit.py) from injected errors.
+
+Runs a Kit on fakes: two emulated MPU6050s on a FakeSMBus that can be
+made to fail, MiniBroker as the host's broker, Discovery on a
+FakeBackend and a SimulatedEdges frequency input. Once the kit is
+running, one error after the other is injected:
+
+    i2c glitch      one sensor does not answer for --glitch ms
+    link abort      the broker cuts the kit's connection
+    broker restart  the broker is stopped and started again
+    host moved      the host leaves and comes back as 127.0.0.2
+    unknown error   the frequency meter raises
+
+For each it prints the recovery time (from the error until the kit is
+back in Idelling or Running, or the broker link is back) and the samples
+lost at a subscriber. Exits with status 1 if a sensor or broker error
+costs the broker connection or the run, the broker errors lose samples,
+a recovery takes longer than --limit ms (host moved: plus --host-lost)
+or the unknown error is not recovered by a full reset.
+
+    python bench-recovery.py [--glitch 50] [--limit 500] [--host-lost 0.5]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import Channels
+import Codec
+import Kit
+from Acquisition import FakeSMBus, profile
+from Discovery import Discovery, FakeBackend
+from Frequency import FrequencyMeter, SimulatedEdges
+from Functions import States
+from HAL import SimButton, SimLed
+from MiniBroker import MiniBroker
+from Spool import Spool
+
+KIT_ID = "recovery"
+ADDRESSES = [0x68, 0x69]
+ODR = 500
+
+
+class FlakyBus(FakeSMBus):
+    """A FakeSMBus on which an address stops answering for a while."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failing = {}       # address -> monotonic time it answers again
+
+    def fail(self, address, seconds):
+        self.failing[address] = time.monotonic() + seconds
+
+    def _transfer(self, address, length):
+        if time.monotonic() < self.failing.get(address, 0):
+            raise OSError(121, "Remote I/O error")
+        return super()._transfer(address, length)
+
+
+class FlakyMeter(FrequencyMeter):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail = False
+
+    def update(self, now=None):
+        if self.fail:
+            self.fail = False
+            raise RuntimeError("injected")
+        return super().update(now)
+
+
+class Receiver:
+    """Sample timestamps per sensor arriving at one broker."""
+
+    def __init__(self, host, port, received):
+        self.received = received
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self.client.reconnect_delay_set(0.01, 0.05)
+        self.client.on_connect = lambda client, userdata, flags, reason, properties: \
+            client.subscribe(Channels.topic(KIT_ID, "#"))
+        self.client.on_message = self._message
+        self.client.connect(host, port)
+        self.client.loop_start()
+
+    def _message(self, client, userdata, msg):
+        if Codec.is_binary(msg.payload):
+            batch = Codec.decode(msg.payload)
+            self.received.setdefault(batch["sensor"], []).append(batch["t"])
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def lost_samples(received, start, end, period):
+    """Samples missing at the receivers with the gap starting between start and end (ns)."""
+    lost = 0
+    for batches in received.values():
+        t = np.unique(np.concatenate(batches))
+        gaps = np.round(np.diff(t) / period).astype(np.int64) - 1
+        inside = (t[:-1] >= start) & (t[:-1] <= end)
+        lost += int(gaps[inside & (gaps > 0)].sum())
+    return lost
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.002)
+    return True
+
+
+def main(args):
+    failures = []
+    directory = tempfile.mkdtemp()
+    broker = MiniBroker(port=0)
+    port = broker.start()
+    received = {}
+    receivers = [Receiver("127.0.0.1", port, received)]
+
+    backend = FakeBackend()
+    backend.join("127.0.0.1")
+    discovery = Discovery(backend, f"{directory}/broker-ip.json", port)
+    spool = Spool(f"{directory}/spool")
+    bus = FlakyBus(ADDRESSES)
+    meter = FlakyMeter(SimulatedEdges(25.0), gate=0.5)
+    led, button = SimLed(), SimButton()
+    config = {
+        "kit_id": KIT_ID, "addresses": ADDRESSES, "profile": profile("default", odr=ODR), "poll_interval": 0.02,
+        "publish_tick": 0.005, "max_batch_latency": 0.02, "max_batch_samples": 500, "freq_interval": 0.1,
+        "buffer_seconds": 5, "stats_interval": 2, "payload_format": "binary", "stamp_payloads": True,
+        "processing": "raw", "decimation": 4, "feature_window": 0.5, "forward_window": 200,
+        "port": port, "connect_timeout": 1.0, "reconnect_min": 0.05, "reconnect_max": 0.5,
+        "host_lost": args.host_lost,
+    }
+    kit = Kit.Kit(config, led, button, lambda: bus, meter, discovery, spool)
+    stop = threading.Event()
+    thread = threading.Thread(target=kit.run, args=(stop,), daemon=True)
+    thread.start()
+
+    if not wait_for(lambda: kit.state == States.Idelling, 10):
+        print(f"FAIL: kit did not connect, stuck in {kit.state.name}")
+        return 1
+    # The button is seen released first, then pressed
+    time.sleep(0.1)
+    button.press()
+    if not wait_for(lambda: kit.state == States.Running, 5):
+        print(f"FAIL: run did not start, kit in {kit.state.name}")
+        return 1
+    time.sleep(1)
+    period = kit.sensors[0].period_ns
+    results = []
+
+    def links():
+        return kit.recovery.kinds.get(Kit.LINK, {}).get("recoveries", 0)
+
+    def scenario(name, inject, recovered, keeps_link, lossless, limit):
+        client, last, outages = kit.client, kit.recovery.last, links()
+        start_ns, start = time.time_ns(), time.perf_counter()
+        inject()
+        if not wait_for(lambda: recovered(last, outages), 10):
+            failures.append(f"{name}: not recovered, kit in {kit.state.name}")
+            return
+        ms = (time.perf_counter() - start) * 1e3
+        if kit.recovery.last is not last and kit.recovery.last["kind"] != Kit.LINK:
+            ms = kit.recovery.last["ms"]
+        time.sleep(1)
+        lost = lost_samples(received, start_ns, time.time_ns(), period)
+        results.append((name, ms, lost, kit.state.name, kit.client is client))
+        if keeps_link and kit.client is not client:
+            failures.append(f"{name}: the broker connection was set up again")
+        if lossless and lost:
+            failures.append(f"{name}: {lost} samples lost")
+        if ms > limit:
+            failures.append(f"{name}: {ms:.0f} ms to recover, limit {limit:.0f} ms")
+
+    def running_again(last, outages):
+        return kit.recovery.last is not last and kit.state == States.Running
+
+    def link_back(last, outages):
+        return links() > outages and kit.client.is_connected()
+
+    scenario("i2c glitch", lambda: bus.fail(ADDRESSES[0], args.glitch / 1e3),
+             running_again, True, False, args.limit + args.glitch)
+
+    def abort():
+        for client in list(broker.clients):
+            if Channels.PREFIX not in "".join(client.filters):
+                broker._loop.call_soon_threadsafe(client.writer.transport.abort)
+
+    scenario("link abort", abort, link_back, True, True, args.limit)
+
+    def restart():
+        nonlocal broker
+        broker.stop()
+        broker = MiniBroker(port=port)
+        broker.start()
+
+    scenario("broker restart", restart, link_back, True, True, args.limit)
+
+    def move():
+        moved = MiniBroker("127.0.0.2", port)
+        moved.start()
+        receivers.append(Receiver("127.0.0.2", port, received))
+        backend.leave("127.0.0.1")
+        backend.join("127.0.0.2")
+        broker.stop()
+        brokers.append(moved)
+
+    brokers = []
+    scenario("host moved", move, lambda last, outages: link_back(last, outages) and kit.host == "127.0.0.2",
+             False, True, args.limit + args.host_lost * 1e3)
+
+    def unknown():
+        meter.fail = True
+
+    def reset(last, outages):
+        return kit.recovery.last is not last and kit.state == States.Idelling
+
+    scenario("unknown error", unknown, reset, False, False, args.limit + 1e3)
+
+    stop.set()
+    thread.join(5)
+    for r in receivers:
+        r.close()
+    for b in brokers:
+        b.stop()
+    spool.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'error':<16}{'recovery ms':>12}{'lost':>7}  {'state':<10}same connection")
+    for name, ms, lost, state, same in results:
+        print(f"{name:<16}{ms:>12.0f}{lost:>7}  {state:<10}{'yes' if same else 'no'}")
+    report = kit.recovery.report()["kinds"]
+    print("recoveries: " + ", ".join(f"{kind} {r['recoveries']}/{r['failures']} (max {r['max_ms']:.0f} ms)"
+                                     for kind, r in report.items()))
+    if Kit.UNKNOWN in report and report[Kit.UNKNOWN]["failures"] != 1:
+        failures.append(f"{report[Kit.UNKNOWN]['failures']} full resets, expected 1")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--glitch", type=float, default=50.0, help="ms the sensor does not answer")
+    parser.add_argument("--limit", type=float, default=500.0, help="ms a recovery may take")
+    parser.add_argument("--host-lost", type=float, default=0.5, help="seconds before the host is looked up again")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+"""
+Check and throughput of the streaming alignment (Resample.py).
+
+Two simulated sensors on slightly different, jittery clocks and a
+frequency input are cut into batches that arrive with random delays, so
+batches overtake each other. The StreamAligner is fed in arrival order
+and must release exactly the rows that aligning the whole recording at
+once gives, without dropping samples as late. A second run stops one
+sensor for --stall seconds: the other must go on within max_delay, with
+NaN for the silent one, and the buffers must stay bounded.
+
+Exits with status 1 if a check fails.
+
+    python bench-resample.py [--seconds 60] [--rate 500] [--batch 10] [--delay 2] [--stall 2]
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+from Resample import MAX_DELAY, REORDER, StreamAligner, align_streams
+from Vibration import VibrationSignal
+
+
+def recording(args, rng):
+    """{name: (t, values)}: two sensors at about args.rate Hz and a 10 Hz frequency stream."""
+    streams = {}
+    for i, (name, skew) in enumerate((("s104", 1.0), ("s105", 1.0004))):
+        n = int(args.seconds * args.rate)
+        period = 1e9 / args.rate * skew
+        t = 1_700_000_000_000_000_000 + i * 1_300_000 + np.cumsum(rng.normal(period, period * 0.05, n)).astype(np.int64)
+        streams[name] = (t, VibrationSignal(i, args.rate).values((t - t[0]) / 1e9))
+    t = streams["s104"][0][::max(1, int(args.rate / 10))]
+    streams["freq"] = (t, 25 + rng.normal(0, 0.1, (len(t), 1)))
+    return streams
+
+
+def deliveries(streams, args, rng, stall=None):
+    """(arrival, name, t, values) batches in arrival order; stall is (name, from, to) ns without delivery."""
+    batches = []
+    for name, (t, values) in streams.items():
+        step = 1 if name == "freq" else args.batch
+        for i in range(0, len(t), step):
+            bt = t[i:i + step]
+            if stall and name == stall[0] and stall[1] <= bt[0] < stall[2]:
+                continue
+            batches.append((bt[-1] + rng.exponential(args.delay * 1e6), name, bt, values[i:i + step]))
+    batches.sort(key=lambda b: b[0])
+    return batches
+
+
+def stream_through(aligner, batches):
+    grids, rows = [], {}
+    buffered = 0
+    start = time.perf_counter()
+    for _, name, t, values in batches:
+        aligner.add(name, t, values)
+        grid, out = aligner.process()
+        buffered = max(buffered, max(len(s.t) for s in aligner.streams.values()))
+        if len(grid):
+            grids.append(grid)
+            for n in aligner.streams:
+                rows.setdefault(n, []).append(out.get(n, np.full((len(grid), 3 if n != "freq" else 1), np.nan)))
+    elapsed = time.perf_counter() - start
+    grid, out = aligner.flush()
+    grids.append(grid)
+    for n in aligner.streams:
+        rows.setdefault(n, []).append(out.get(n, np.empty((0, 3 if n != "freq" else 1))))
+    return elapsed, buffered, np.concatenate(grids), {n: np.concatenate(r) for n, r in rows.items()}
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    streams = recording(args, rng)
+    failures = []
+
+    start = time.perf_counter()
+    grid, expected = align_streams(streams, args.rate, hold=("freq",))
+    offline = time.perf_counter() - start
+
+    batches = deliveries(streams, args, rng)
+    aligner = StreamAligner(args.rate)
+    aligner.add_stream("freq", hold=True)
+    elapsed, buffered, got_grid, got = stream_through(aligner, batches)
+    samples = sum(len(t) for t, _ in streams.values())
+    print(f"{len(batches)} batches, {samples} samples, {len(grid)} rows")
+    print(f"streaming: {elapsed * 1e6 / len(batches):.1f} us per batch, {samples / elapsed / 1e6:.2f} M samples/s, "
+          f"largest buffer {buffered} samples, late {aligner.late}")
+    print(f"offline:   {samples / offline / 1e6:.2f} M samples/s")
+    if aligner.late:
+        failures.append(f"{aligner.late} samples late with {args.delay} ms mean delay and {REORDER * 1e3:.0f} ms reorder")
+    if not np.array_equal(got_grid, grid):
+        failures.append("streaming grid differs from the offline one")
+    else:
+        for name, values in expected.items():
+            if not np.array_equal(np.isnan(got[name]), np.isnan(values)) or \
+                    not np.allclose(got[name][~np.isnan(values)], values[~np.isnan(values)]):
+                failures.append(f"{name}: streaming rows differ from the offline ones")
+
+    # One sensor silent for a while
+    t0 = streams["s105"][0][0] + int(args.seconds / 3 * 1e9)
+    stall = ("s105", t0, t0 + int(args.stall * 1e9))
+    aligner = StreamAligner(args.rate)
+    aligner.add_stream("freq", hold=True)
+    _, buffered, got_grid, got = stream_through(aligner, deliveries(streams, args, rng, stall))
+    silent = (got_grid >= stall[1]) & (got_grid < stall[2])
+    print(f"stall of {args.stall} s: s105 NaN on {np.isnan(got['s105'][silent, 0]).mean():.1%} of its rows, "
+          f"s104 on {np.isnan(got['s104'][silent, 0]).mean():.1%}, largest buffer {buffered} samples")
+    limit = (MAX_DELAY + REORDER) * args.rate * 1.5 + args.batch * 2
+    if buffered > limit:
+        failures.append(f"buffer grew to {buffered} samples during the stall, limit {limit:.0f}")
+    if np.isnan(got["s104"][silent, 0]).any():
+        failures.append("s104 has gaps while only s105 stalled")
+    if not np.isnan(got["s105"][silent, 0]).mean() > 0.9:
+        failures.append("s105 not NaN while it stalled")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--rate", type=float, default=500.0, help="samples/s per sensor and aligned rate")
+    parser.add_argument("--batch", type=int, default=10, help="samples per message")
+    parser.add_argument("--delay", type=float, default=2.0, help="mean extra delay of a message in ms")
+    parser.add_argument("--stall", type=float, default=2.0, help="seconds one sensor stays silent")
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,54 @@
+"""
+Check that the sampling threads keep a gap-free timeline while the
+publisher stalls, using the simulated I2C bus.
+
+    python bench-sampler.py [--odr 1000] [--seconds 10] [--stall 0.3]
+"""
+import argparse
+import random
+import time
+
+from Acquisition import FakeSMBus, FifoSensor, Sampler
+from RingBuffer import RingBuffer
+
+ADDRESSES = (0x68, 0x69)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--odr", type=float, default=1000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--poll", type=float, default=0.02, help="seconds between FIFO drains")
+    parser.add_argument("--stall", type=float, default=0.3, help="longest simulated publish stall (s)")
+    parser.add_argument("--buffer", type=float, default=5, help="ring buffer capacity (s)")
+    args = parser.parse_args()
+
+    bus = FakeSMBus(ADDRESSES)
+    samplers = []
+    for addr in ADDRESSES:
+        sensor = FifoSensor(bus, addr, odr=args.odr)
+        sensor.setup()
+        samplers.append(Sampler(sensor, RingBuffer(int(sensor.odr * args.buffer)), args.poll))
+    for s in samplers:
+        s.start()
+
+    drained = dict.fromkeys(ADDRESSES, 0)
+    batches = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        # Publisher: drain, then occasionally stall like a blocked client.publish
+        for s in samplers:
+            t, counts = s.buffer.read()
+            drained[s.sensor.address] += len(t)
+        batches += 1
+        time.sleep(random.uniform(0, args.stall) if random.random() < 0.1 else 0.05)
+    for s in samplers:
+        s.stop()
+        drained[s.sensor.address] += len(s.buffer.read()[0])
+    elapsed = time.perf_counter() - start
+
+    print(f"{batches} publisher batches in {elapsed:.1f} s, stalls up to {args.stall * 1000:.0f} ms")
+    for s in samplers:
+        fifo_overruns, buffer_overruns = s.overruns()
+        print(f"0x{s.sensor.address:02X}: {drained[s.sensor.address] / elapsed:.1f} samples/s, "
+              f"{s.stats.summary()}, overruns fifo={fifo_overruns} buffer={buffer_overruns}")
@@ -0,0 +1,186 @@
+"""
+End-to-end throughput of the kit's sensor loop on simulated hardware (HAL.py).
+
+For each --odr the Kit of sensor-mqtt.py runs --profile on the "sim" HAL: two
+emulated MPU6050s replaying --trace over a FakeSMBus with the Pi's I2C
+timing, and button1 pressed once the kit is connected. It samples, processes,
+spools and forwards to a MiniBroker with a subscriber in a second
+process, so the kit's process time is the kit's own. Over --seconds it
+measures:
+
+    delivered   samples/s per sensor (and its gyro and temp streams) arriving at the subscriber
+    cpu         process time of the kit per wall second, and per sample
+    bus         share of the time the I2C bus was busy, transfers/s
+    latency     acquisition to arrival at the subscriber, median and p99
+    gaps        jumps of the sample timeline, resyncs after the sampler
+                was held up (on one core the subscriber competes for it)
+
+Exits with status 1 if a sensor delivers less than 99 % of its ODR (of
+ODR / 4 with --processing decimated or both) or
+samples were lost in a FIFO or ring buffer overrun.
+
+    python bench-sensorloop.py [--odr 250 500 1000] [--seconds 5] [--processing raw] [--profile default]
+                               [--trace Messdaten/Messung_11_11_15_34_29.csv] [--latency 60]
+"""
+import argparse
+import multiprocessing as mp
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+import HAL
+from Acquisition import profile
+from Discovery import Discovery, FakeBackend
+from Frequency import FrequencyMeter
+from Functions import States
+from Kit import Kit
+from Spool import Spool
+
+KIT_ID = "loop"
+ADDRESSES = [0x68, 0x69]
+DECIMATION = 4
+
+
+def subscriber(ready, stop, results):
+    """Broker and subscriber process: samples per sensor in the window, gaps and latencies."""
+    import paho.mqtt.client as mqtt
+    import Codec
+    from Channels import topic
+    from MiniBroker import MiniBroker
+
+    broker = MiniBroker(port=0)
+    port = broker.start()
+    received = {}
+    latencies = []
+
+    def message(client, userdata, msg):
+        arrived = time.time_ns()
+        if Codec.is_binary(msg.payload):
+            batch = Codec.decode(msg.payload)
+            received.setdefault(batch["sensor"], []).append(batch["t"])
+            if batch["stamps"] is not None:
+                latencies.append((arrived - batch["stamps"]["acquired"]) / 1e6)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = lambda client, userdata, flags, reason, properties: client.subscribe(topic(KIT_ID, "#"))
+    client.on_message = message
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    ready.put(port)
+    window = stop.get()
+    time.sleep(0.5)
+    client.loop_stop()
+    broker.stop()
+    start, end = window
+    out = {}
+    for name, batches in received.items():
+        t = np.unique(np.concatenate(batches))
+        inside = t[(t >= start) & (t < end)]
+        period = np.median(np.diff(t))
+        out[name] = (len(inside), int((np.round(np.diff(inside) / period) > 1).sum()))
+    results.put((out, latencies))
+
+
+def run(odr, args):
+    ready, stop, results = mp.Queue(), mp.Queue(), mp.Queue()
+    broker = mp.Process(target=subscriber, args=(ready, stop, results))
+    broker.start()
+    port = ready.get()
+    directory = tempfile.mkdtemp()
+
+    hal = HAL.open_hal({"hal": "sim", "addresses": ADDRESSES, "odr": odr, "sim_trace": args.trace,
+                        "sim_i2c_latency": args.latency / 1e6})
+    backend = FakeBackend()
+    backend.join("127.0.0.1")
+    config = {
+        "kit_id": KIT_ID, "addresses": ADDRESSES, "profile": profile(args.profile, odr=odr), "poll_interval": 0.02,
+        "publish_tick": 0.005, "max_batch_latency": 0.02, "max_batch_samples": 500, "freq_interval": 0.1,
+        "buffer_seconds": 5, "stats_interval": 3600, "payload_format": "binary", "stamp_payloads": True,
+        "processing": args.processing, "decimation": DECIMATION, "feature_window": 0.5, "forward_window": 200,
+        "port": port, "connect_timeout": 1.0, "reconnect_min": 0.1, "reconnect_max": 1.0, "host_lost": 15.0,
+    }
+    kit = Kit(config, hal.led, hal.buttons[0], hal.open_bus, FrequencyMeter(hal.edges),
+              Discovery(backend, None, port), Spool(f"{directory}/spool"))
+    halt = threading.Event()
+    thread = threading.Thread(target=kit.run, args=(halt,), daemon=True)
+    thread.start()
+    while kit.state != States.Idelling:
+        time.sleep(0.01)
+    # A run starts when button1 is pressed after the kit saw it released
+    time.sleep(0.1)
+    hal.buttons[0].press()
+    while kit.state != States.Running:
+        time.sleep(0.01)
+    time.sleep(1)
+
+    bus = kit.bus
+    transfers, nbytes = bus.transfers, bus.bytes
+    start_ns, start, cpu = time.time_ns(), time.perf_counter(), time.process_time()
+    time.sleep(args.seconds)
+    end_ns, elapsed, cpu = time.time_ns(), time.perf_counter() - start, time.process_time() - cpu
+    transfers, nbytes = bus.transfers - transfers, bus.bytes - nbytes
+    overruns = sum(sum(s.overruns()) for s in kit.samplers)
+    # Past the decimator's delay, then the run ends like with button1 and everything sampled is sent
+    time.sleep(1)
+    hal.buttons[0].release()
+    while kit.state != States.Idelling or kit.forwarder.backlog_bytes or kit.forwarder.inflight:
+        time.sleep(0.01)
+    halt.set()
+    thread.join()
+    kit._close()
+    kit.spool.close()
+    stop.put((start_ns, end_ns))
+    received, latencies = results.get()
+    broker.join()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    # start, address, register, repeated start per transfer and 9 clocks per byte
+    busy = (transfers * (27 / HAL.I2C_HZ + args.latency / 1e6) + nbytes * 9 / HAL.I2C_HZ) / elapsed
+    samples = sum(n for n, _ in received.values())
+    return {
+        "rates": {name: n / elapsed for name, (n, _) in received.items()},
+        "gaps": sum(g for _, g in received.values()), "overruns": overruns,
+        "cpu": cpu / elapsed, "cpu_us": cpu / samples * 1e6 if samples else float("nan"),
+        "busy": busy, "transfers": transfers / elapsed,
+        "latency": np.percentile(latencies, [50, 99]) if latencies else [np.nan, np.nan],
+    }
+
+
+def main(args):
+    failures = []
+    print(f"{'odr':>6}{'delivered/s':>13}{'cpu':>7}{'us/sample':>11}{'bus':>6}{'transfers/s':>13}"
+          f"{'latency ms':>12}{'p99':>7}{'gaps':>6}")
+    for odr in args.odr:
+        r = run(odr, args)
+        rates = r["rates"]
+        expected = odr / DECIMATION if args.processing != "raw" else odr
+        print(f"{odr:>6}{min(rates.values(), default=0):>13.0f}{r['cpu']:>7.0%}{r['cpu_us']:>11.1f}"
+              f"{r['busy']:>6.0%}{r['transfers']:>13.0f}{r['latency'][0]:>12.1f}{r['latency'][1]:>7.1f}"
+              f"{r['gaps']:>6}")
+        # One stream per sensor and channel, accel, gyro and temp
+        streams = len(ADDRESSES) * len(profile(args.profile)["channels"])
+        if len(rates) < streams:
+            failures.append(f"{odr} Hz: {streams - len(rates)} streams sent nothing")
+        for name, rate in rates.items():
+            if rate < 0.99 * expected:
+                failures.append(f"{odr} Hz: {name} delivered {rate:.0f} samples/s")
+        if r["overruns"]:
+            failures.append(f"{odr} Hz: {r['overruns']} overruns")
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--odr", type=int, nargs="+", default=[250, 500, 1000], help="MPU6050 output data rates (Hz)")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--processing", default="raw", choices=["raw", "decimated", "both"])
+    parser.add_argument("--profile", default="default", help="acquisition profile (Acquisition.PROFILES), run at each --odr")
+    parser.add_argument("--trace", default="Messdaten/Messung_11_11_15_34_29.csv", help="recording the sensors replay")
+    parser.add_argument("--latency", type=float, default=HAL.I2C_LATENCY * 1e6, help="us of driver time per I2C transfer")
+    sys.exit(main(parser.parse_args()))
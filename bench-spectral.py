@@ -0,0 +1,65 @@
+"""
+Throughput of the streaming spectral stage on recorded Messdaten sessions,
+with the dominant frequency next to the edge counted frequency.
+
+    python bench-spectral.py [files ...] [--batch 50] [--repeat 20]
+"""
+import argparse
+import glob
+import os
+import time
+import numpy as np
+
+from Recorder import load_csv
+from Spectral import SpectralStage
+
+
+def replay(streams, batch, nperseg, segments):
+    """Feed the accelerometer streams in batches like Host.update does."""
+    stage = SpectralStage(nperseg, 0.5, segments)
+    names = [n for n in streams if n != "freq"]
+    length = max(len(streams[n][0]) for n in names)
+    windows = []
+    start = time.perf_counter()
+    for i in range(0, length, batch):
+        for name in names:
+            t, values = streams[name]
+            stage.add(name, t[i:i + batch], values[i:i + batch])
+        for name, results in stage.process().items():
+            windows += [(name, r) for r in results]
+    return time.perf_counter() - start, windows, stage
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=["Messdaten/*.csv", "all_sensor_data.csv"])
+    parser.add_argument("--batch", type=int, default=50, help="samples per stream and update")
+    parser.add_argument("--nperseg", type=int, default=256)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=20, help="times each recording is tiled for timing")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.files for p in glob.glob(pattern) if not p.endswith("_freq.csv")})
+    print(f"{'file':<30}{'rate Hz':>9}{'windows':>9}{'samples/s':>13}{'x realtime':>12}{'peak Hz':>9}{'edges Hz':>10}")
+    for path in paths:
+        streams = load_csv(path)
+        if not any(n != "freq" for n in streams):
+            continue
+        # Tile the recording so the timing is not dominated by start-up
+        tiled = {}
+        for name, (t, values) in streams.items():
+            if name == "freq" or len(t) < 2:
+                continue
+            period = int(np.median(np.diff(t)))
+            reps = args.repeat
+            tiled[name] = (t[0] + np.arange(len(t) * reps, dtype=np.int64) * period, np.tile(values, (reps, 1)))
+        if not tiled:
+            continue
+        elapsed, windows, stage = replay(tiled, args.batch, args.nperseg, args.segments)
+        samples = sum(len(t) for t, _ in tiled.values())
+        rate = max(s.rate or 0 for s in stage.streams.values())
+        duration = max((t[-1] - t[0]) / 1e9 for t, _ in tiled.values())
+        peaks = [r["dominant_hz"][np.argmax(r["rms"])] for _, r in windows]
+        edges = np.median(streams["freq"][1]) if "freq" in streams else float("nan")
+        print(f"{os.path.basename(path):<30}{rate:>9.1f}{len(windows):>9}{samples / elapsed:>13,.0f}"
+              f"{duration / elapsed:>12.0f}{np.median(peaks) if peaks else float('nan'):>9.1f}{edges:>10.1f}")
@@ -0,0 +1,236 @@
+"""
+Check and replay throughput of the store-and-forward spool (Spool.py).
+
+Appends --minutes of a kit's traffic (two sensors at --rate Hz in 20 ms
+messages and the frequency every 100 ms) to a spool as if the Wi-Fi link
+were down, reopens it with a torn record at its end like after a power
+loss, and drains it through MiniBroker with a Forwarder at QoS 1 while
+the kit's connection is cut --drops times on the way.
+
+Checks that every message reaches a subscriber at least once and in the
+order appended, that the spool ends fully acknowledged with its sent
+segments deleted, that the torn record is cut off, that a backlog of
+small messages larger than one read (READ_BYTES) in a segment of the
+kit's size reads back whole, and that a spool limited to --max-kb (a
+quarter of the outage by default) stays within it by dropping the oldest
+data. Prints
+the append and replay rates and how long an hour of outage takes to
+drain. Exits with status 1 if a check fails.
+
+    python bench-spool.py [--minutes 10] [--rate 500] [--drops 3] [--window 200]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import paho.mqtt.client as mqtt
+
+import Codec
+from Channels import topic
+from MiniBroker import MiniBroker
+from Spool import READ_BYTES, RECORD, SEGMENT_BYTES, Forwarder, Spool
+
+KIT = "spool"
+
+
+def traffic(args, rng):
+    """(topic, payload) of --minutes of kit traffic, every payload distinct."""
+    messages = []
+    samples = int(args.rate * 0.02)
+    period = int(1e9 / args.rate)
+    t = 1_700_000_000_000_000_000
+    for tick in range(int(args.minutes * 60 / 0.02)):
+        for sensor in ("s104", "s105"):
+            counts = rng.integers(-4096, 4096, (samples, 3), dtype=np.int16)
+            messages.append((topic(KIT, sensor), Codec.encode_binary(sensor, t, period, counts, 1 / 2048)))
+        if tick % 5 == 0:
+            messages.append((topic(KIT, "freq"), json.dumps({"timestamp": t, "frequency_hz": 25.0 + tick % 7}).encode()))
+        t += samples * period
+    return messages
+
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(".spool"))
+
+
+def drain(spool, messages, args, failures):
+    broker = MiniBroker(port=0)
+    port = broker.start()
+    received = []
+    subscribed = threading.Event()
+    subscriber = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    subscriber.on_connect = lambda client, userdata, flags, reason, properties: client.subscribe(f"Sensor/{KIT}/#")
+    subscriber.on_subscribe = lambda *a: subscribed.set()
+    subscriber.on_message = lambda client, userdata, msg: received.append(msg.payload)
+    subscriber.connect("127.0.0.1", port)
+    subscriber.loop_start()
+    subscribed.wait(5)
+
+    kit = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    kit.max_inflight_messages_set(args.window)
+    kit.reconnect_delay_set(0.05, 0.2)
+    disconnects = []
+    kit.on_disconnect = lambda *a: disconnects.append(time.monotonic())
+    kit.connect("127.0.0.1", port)
+    kit.loop_start()
+    forwarder = Forwarder(spool, kit, args.window)
+
+    total = len(messages)
+    drops = [total * (i + 1) // (args.drops + 1) for i in range(args.drops)]
+    start = time.perf_counter()
+    deadline = time.monotonic() + 600
+    while (forwarder.delivered < total or forwarder.inflight) and time.monotonic() < deadline:
+        if drops and forwarder.delivered >= drops[0]:
+            drops.pop(0)
+            # The kit's link goes down: the broker side of its connection is cut
+            for client in list(broker.clients):
+                if not client.filters:
+                    broker._loop.call_soon_threadsafe(client.writer.transport.abort)
+        if not forwarder.pump():
+            time.sleep(0.0005)
+    elapsed = time.perf_counter() - start
+    dropped = len(disconnects)
+    # Let the last forwarded messages arrive
+    for _ in range(200):
+        count = len(received)
+        time.sleep(0.01)
+        if len(received) == count and count >= total:
+            break
+
+    kit.loop_stop()
+    kit.disconnect()
+    subscriber.loop_stop()
+    subscriber.disconnect()
+    broker.stop()
+
+    size = sum(len(p) for _, p in messages)
+    rate = total / elapsed
+    live = total / (args.minutes * 60)
+    print(f"drain: {total} messages in {elapsed:.2f} s, {rate:.0f} msg/s, {size / elapsed / 1e6:.2f} MB/s, "
+          f"{len(received) - total} duplicates after {dropped} drops")
+    print(f"       {rate / live:.0f}x the live rate, an hour of outage drains in {3600 * live / rate:.0f} s")
+
+    index = {payload: i for i, (_, payload) in enumerate(messages)}
+    seen = set()
+    order = []
+    for payload in received:
+        i = index.get(payload)
+        if i is not None and i not in seen:
+            seen.add(i)
+            order.append(i)
+    if len(seen) != total:
+        failures.append(f"{total - len(seen)} of {total} messages never arrived")
+    if order != sorted(order):
+        failures.append("messages arrived out of order")
+    if spool.committed != spool.end:
+        failures.append(f"{spool.end - spool.committed} bytes left unacknowledged")
+    if len(spool.segments) != 1:
+        failures.append(f"{len(spool.segments) - 1} sent segments not deleted")
+
+
+def check_backlog(failures):
+    """Read back a backlog of 300 byte messages larger than READ_BYTES, in windows like a Forwarder."""
+    with tempfile.TemporaryDirectory() as directory:
+        spool = Spool(directory)
+        payloads = [i.to_bytes(4, "little") * 75 for i in range(READ_BYTES * 3 // 2 // 300)]
+        for payload in payloads:
+            spool.append(topic(KIT, "s104"), payload)
+        read = []
+        offset = spool.committed
+        try:
+            while True:
+                records = spool.read(offset)
+                if not records:
+                    break
+                read += [p for _, _, p in records]
+                offset = records[-1][0]
+        except ValueError as e:
+            failures.append(f"reading a backlog of {spool.end >> 10} kB: {e}")
+        spool.close()
+    print(f"backlog: {len(read)} of {len(payloads)} messages of 300 bytes read back")
+    if read != payloads:
+        failures.append(f"backlog of {len(payloads)} messages read back as {len(read)}")
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    failures = []
+    messages = traffic(args, rng)
+    size = sum(len(p) for _, p in messages)
+    print(f"{args.minutes} min outage: {len(messages)} messages, {size / 1e6:.1f} MB of payload")
+
+    with tempfile.TemporaryDirectory() as directory:
+        spool = Spool(directory, segment_bytes=args.segment_kb << 10)
+        start = time.perf_counter()
+        for i, (name, payload) in enumerate(messages):
+            spool.append(name, payload)
+            if i % 3 == 2:
+                spool.flush()   # once per loop of the kit
+        spool.close()
+        elapsed = time.perf_counter() - start
+        print(f"append: {len(messages) / elapsed:.0f} msg/s, {size / elapsed / 1e6:.1f} MB/s, "
+              f"{elapsed / len(messages) * 1e6:.1f} us per message; {len(spool.segments)} segments, "
+              f"{disk_usage(directory) / size - 1:+.1%} over the payload")
+        end = spool.end
+
+        # Power loss in the middle of a write
+        with open(os.path.join(directory, f"{spool.segments[-1]:020d}.spool"), "ab") as f:
+            f.write(RECORD.pack(500, 0, 0) + b"\x01" * 37)
+        start = time.perf_counter()
+        spool = Spool(directory, segment_bytes=args.segment_kb << 10)
+        print(f"reopen: {(time.perf_counter() - start) * 1e3:.1f} ms, cut {spool.truncated} bytes of a torn record")
+        if spool.end != end or spool.truncated != RECORD.size + 37:
+            failures.append(f"reopened at {spool.end} instead of {end}, cut {spool.truncated} bytes")
+        if spool.pending_bytes != end:
+            failures.append("reopened spool does not start at the first message")
+
+        drain(spool, messages, args, failures)
+        committed = spool.committed
+        spool.close()
+        if Spool(directory).committed != committed:
+            failures.append("acknowledged offset not kept across a reopen")
+
+    check_backlog(failures)
+
+    # Bounded disk use
+    max_kb = args.max_kb or max(size >> 12, 128)
+    with tempfile.TemporaryDirectory() as directory:
+        segment = 64 << 10
+        spool = Spool(directory, segment_bytes=segment, max_bytes=max_kb << 10)
+        largest = 0
+        for name, payload in messages:
+            spool.append(name, payload)
+            if spool.appended % 100 == 0:
+                largest = max(largest, disk_usage(directory))
+        spool.flush()
+        kept = spool.read(spool.committed, len(messages))
+        limit = (max_kb << 10) + 2 * segment
+        print(f"limit {max_kb} kB: largest {largest / 1024:.0f} kB on disk, "
+              f"dropped {spool.dropped_bytes / 1e6:.1f} MB, kept {spool.pending_bytes / 1024:.0f} kB")
+        if largest > limit:
+            failures.append(f"spool grew to {largest} bytes with a limit of {max_kb} kB")
+        if not spool.dropped_bytes or spool.pending_bytes > limit:
+            failures.append("spool over its limit did not drop the oldest data")
+        if not kept or [p for _, _, p in kept] != [p for _, p in messages[-len(kept):]]:
+            failures.append("the kept messages are not the newest ones")
+        spool.close()
+
+    for f in failures:
+        print("FAIL:", f)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=10.0, help="length of the outage")
+    parser.add_argument("--rate", type=float, default=500.0, help="samples/s per sensor")
+    parser.add_argument("--drops", type=int, default=3, help="connection losses while draining")
+    parser.add_argument("--window", type=int, default=200, help="messages in flight")
+    parser.add_argument("--segment-kb", type=int, default=SEGMENT_BYTES >> 10)
+    parser.add_argument("--max-kb", type=int, default=None, help="limit of the bounded spool, default a quarter of the outage")
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""
+Calibrate the kit's MPU6050s from static captures (Calibration.py).
+
+Stop sensor-mqtt.py first, the script drives the sensors itself. For every
+capture the kit has to lie still for --seconds while all sensors are read
+at --odr; a capture in which a sensor moved is taken again.
+
+    level   one capture with the kit lying level: the offsets
+    fit     --poses captures, the kit turned between them so that every
+            axis points up and down once: offset and gain per axis
+    align   one capture with the kit standing as mounted on the machine:
+            the rotation of every sensor onto the kit's axes, on top of
+            its calibration so far
+
+The result is merged into --file (calibration.json by default), which the
+kit reads when it sets up its sensors; level and fit keep an earlier
+alignment.
+
+    python calibrate-sensors.py [--mode fit] [--poses 6] [--seconds 3] [--addresses 0x69 0x68]
+                                [--file calibration.json] [--bus 1]
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+import Calibration
+from Acquisition import FifoSensor
+
+POSES = ["+Z up (lying level)", "-Z up (upside down)", "+X up", "-X up", "+Y up", "-Y up"]
+
+
+def capture(sensors, seconds):
+    """(n, 3) counts per sensor read over seconds."""
+    for s in sensors:
+        s.reset()
+    parts = [[] for _ in sensors]
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        time.sleep(0.02)
+        for ix, s in enumerate(sensors):
+            parts[ix].append(s.read_raw()[1])
+    return [np.concatenate(p) for p in parts]
+
+
+def still_capture(sensors, seconds, prompt):
+    """Mean counts per sensor of a capture in which none of them moved."""
+    while True:
+        input(f"{prompt}, keep it still and press Enter ")
+        means = []
+        try:
+            for s, counts in zip(sensors, capture(sensors, seconds)):
+                means.append(Calibration.still_mean(counts, s.accel_scale))
+        except ValueError as e:
+            print(f"0x{s.address:02X}: {e}, once more")
+            continue
+        return means
+
+
+def main(args):
+    import smbus
+    bus = smbus.SMBus(args.bus)
+    sensors = []
+    for addr in args.addresses:
+        try:
+            sensor = FifoSensor(bus, addr, odr=args.odr)
+            sensor.setup()
+            sensors.append(sensor)
+        except OSError as e:
+            print(f"No response from 0x{addr:02X}: {e}")
+    if not sensors:
+        return 1
+    names = ["s" + str(s.address) for s in sensors]
+    calibrations = Calibration.load(args.file)
+
+    result = {}
+    if args.mode == "level":
+        means = still_capture(sensors, args.seconds, "Lay the kit level")
+        for name, s, mean in zip(names, sensors, means):
+            result[name] = Calibration.level(mean, s.accel_scale)
+    elif args.mode == "fit":
+        captures = []
+        for k in range(args.poses):
+            pose = POSES[k] if k < len(POSES) else "Any other orientation"
+            captures.append(still_capture(sensors, args.seconds, f"Pose {k + 1}/{args.poses}: {pose}"))
+        for ix, (name, s) in enumerate(zip(names, sensors)):
+            try:
+                result[name] = Calibration.fit([c[ix] for c in captures], s.accel_scale)
+            except ValueError as e:
+                print(f"{name}: {e}")
+    else:
+        means = still_capture(sensors, args.seconds, "Mount the kit on the machine")
+        for name, s, mean in zip(names, sensors, means):
+            current = calibrations.get(name, Calibration.Calibration(s.accel_scale)).at_range(s.accel_scale)
+            result[name] = Calibration.align(current, mean)
+
+    for s in sensors:
+        s.stop()
+    bus.close()
+
+    for name, c in result.items():
+        if args.mode != "align" and name in calibrations:
+            c = Calibration.Calibration(c.counts_per_g, c.offset, c.gain, calibrations[name].axes, c.info)
+        calibrations[name] = c
+        line = (f"{name}: offset {np.round(c.offset / c.counts_per_g * 1e3, 1).tolist()} mg, "
+                f"gain {np.round(c.gain, 4).tolist()}")
+        if "rms_g" in c.info:
+            line += f", residual {c.info['rms_g'] * 1e3:.1f} mg"
+        if "tilt_deg" in c.info:
+            line += f", tilted {c.info['tilt_deg']:.1f} deg"
+        print(line)
+    if len(result) < len(sensors):
+        return 1
+    Calibration.save(calibrations, args.file)
+    print(f"Saved to {args.file}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="fit", choices=["level", "fit", "align"])
+    parser.add_argument("--poses", type=int, default=len(POSES), help="captures of the fit, at least 6")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of each capture")
+    parser.add_argument("--addresses", type=lambda a: int(a, 0), nargs="+", default=[0x69, 0x68])
+    parser.add_argument("--odr", type=float, default=500)
+    parser.add_argument("--file", default=Calibration.CALIBRATION_PATH)
+    parser.add_argument("--bus", type=int, default=1, help="I2C bus of the MPU6050s")
+    sys.exit(main(parser.parse_args()))
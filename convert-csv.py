@@ -0,0 +1,72 @@
+"""
+Convert Messdaten CSV recordings to .bfhrec session files (see Recorder.py).
+
+    python convert-csv.py Messdaten/Messung_*.csv all_sensor_data.csv
+
+The matching _freq.csv files are picked up automatically. Output files are
+written next to the input unless --out names a directory.
+
+With --align RATE the sensors and the frequency are also resampled onto one
+RATE Hz clock (Resample.py) and written as an aligned CSV, <name>_aligned.csv,
+the layout Host.py records with CSV_LAYOUT = "aligned".
+"""
+import argparse
+import glob
+import os
+import time
+import numpy as np
+
+from Recorder import ChunkRecorder, aligned_columns, aligned_header, format_aligned, load_csv
+from Resample import align_streams
+
+COLUMNS = {"freq": ("frequency_hz",)}
+
+
+def convert(path, out_dir=None):
+    target = os.path.splitext(path)[0] + ".bfhrec"
+    if out_dir:
+        target = os.path.join(out_dir, os.path.basename(target))
+    streams = load_csv(path)
+    recorder = ChunkRecorder(target, metadata={
+        "source": os.path.basename(path),
+        "converted": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    for name, (t, values) in streams.items():
+        recorder.add_stream(name, COLUMNS.get(name, ("x", "y", "z")))
+        recorder.append(name, t, values)
+    recorder.close()
+    return target, {name: len(t) for name, (t, _) in streams.items()}
+
+
+def convert_aligned(path, rate, out_dir=None):
+    target = os.path.splitext(path)[0] + "_aligned.csv"
+    if out_dir:
+        target = os.path.join(out_dir, os.path.basename(target))
+    streams = load_csv(path)
+    t, aligned = align_streams(streams, rate, hold=("freq",))
+    sensors = [name for name in streams if name != "freq"]
+    nan = np.full((len(t), 1), np.nan)
+    columns = np.hstack([aligned[name] for name in sensors] + [aligned.get("freq", nan)])
+    with open(target, "w") as f:
+        f.write(aligned_header(rate))
+        f.write("".join(aligned_columns(2 + 3 * ix, name) for ix, name in enumerate(sensors)))
+        f.write(format_aligned(t, columns))
+    return target, len(t)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--out", help="output directory")
+    parser.add_argument("--align", type=float, metavar="RATE", help="also write an aligned CSV at RATE Hz")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.files for p in glob.glob(pattern)})
+    for path in paths:
+        if path.endswith("_freq.csv"):
+            continue
+        target, counts = convert(path, args.out)
+        print(f"{path} -> {target} {counts}")
+        if args.align:
+            target, rows = convert_aligned(path, args.align, args.out)
+            print(f"{path} -> {target} {rows} rows")
@@ -0,0 +1,156 @@
+"""
+Host in multi-process mode: same plots and recordings as Host.py, but MQTT
+ingest/decode and recording run in their own processes (see HostPipeline.py)
+and hand the samples over through shared memory rings. The GUI here only
+reads what it has time for; ingest and recording never wait for it.
+
+    python host-mp.py
+"""
+import time
+import matplotlib.pyplot as plt
+import numpy as np
+
+import Channels
+from Acquisition import GRAVITY_MS2
+from HostPipeline import Pipeline
+from Plotter import LiveFigure
+from Spectral import SpectralStage
+
+# ===============================
+# Configuration
+# ===============================
+MQTT_BROKER = "192.168.4.245"
+MQTT_PORT = 1883
+# The rings are created before the processes start, so this host shows one
+# kit with fixed sensors; Host.py discovers any number of kits.
+KIT_ID = ""               # as printed by sensor-mqtt.py at start, "" for firmware without kit ids
+TOPIC_SENSOR1 = Channels.topic(KIT_ID, "s104")
+TOPIC_SENSOR2 = Channels.topic(KIT_ID, "s105")
+TOPIC_FREQ = Channels.topic(KIT_ID, Channels.FREQ_TOPIC)
+
+MAX_POINTS = 4600
+DECIMATE = True   # draw a min/max envelope per pixel column instead of every sample
+FFT_SEGMENT = 256     # samples per FFT segment (50 % overlap)
+FFT_SEGMENTS = 8      # segments averaged per Welch window
+
+CSV_FLUSH_INTERVAL = 1.0  # seconds between flushes of the CSV files
+CSV_FSYNC = False         # also force every flush to disk
+RECORD_FORMAT = "both"    # "csv", "chunks" (compressed .bfhrec session file, see Recorder.py) or "both"
+CSV_LAYOUT = "aligned"    # "aligned": both sensors resampled to one clock (Resample.py), "rows": one row per sample
+ALIGN_RATE = None         # Hz of the aligned CSV rows, None: the output rate in the first kit profile
+RINGLOG_DIR = "Messdaten/ringlog"  # memory-mapped logs of the most recent samples per channel, None to disable
+RINGLOG_RECORDS = 1 << 22         # records per channel (~70 min at 1 kHz, 80 MB for x/y/z)
+
+RECORD_RING = 1 << 18     # samples per stream between ingest and recorder (~4 min at 1 kHz)
+VIEW_RING = 1 << 15       # samples per stream between ingest and GUI
+RECORD_INTERVAL = 0.05    # seconds between recorder drains
+STATS_INTERVAL = 5        # seconds between stage metrics printouts
+
+
+def print_report(stages, rings):
+    for stage, s in stages.items():
+        print(f"{stage:>7}: {s['messages_per_s']:7.1f} msg/s {s['samples_per_s']:9.0f} samples/s "
+              f"busy {s['busy']:6.1%}  errors {s['errors']}")
+    for name, r in rings.items():
+        print(f"{name:>7}: record depth {r['record_depth']:6d} overruns {r['record_overruns']}  "
+              f"view depth {r['view_depth']:6d} skipped {r['view_skipped']}")
+
+
+if __name__ == "__main__":
+    timestring = time.strftime("%d_%m_%H_%M_%S")
+    names = {TOPIC_SENSOR1: TOPIC_SENSOR1.split("/")[-1], TOPIC_SENSOR2: TOPIC_SENSOR2.split("/")[-1],
+             TOPIC_FREQ: "freq"}
+    # The settings of each sensor's run, recorded and setting the aligned CSV rate
+    profile_topics = {Channels.topic(KIT_ID, name, Channels.PROFILE_PREFIX): name
+                      for name in names.values() if name != "freq"}
+    config = {
+        "broker": MQTT_BROKER,
+        "port": MQTT_PORT,
+        "topics": names,
+        "profile_topics": profile_topics,
+        "csv_file": "Messdaten/Messung_" + timestring + ".csv",
+        "record_format": RECORD_FORMAT,
+        "csv_layout": CSV_LAYOUT,
+        "align_rate": ALIGN_RATE,
+        "metadata": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "broker": MQTT_BROKER,
+            "topics": list(names),
+        },
+        "flush_interval": CSV_FLUSH_INTERVAL,
+        "fsync": CSV_FSYNC,
+        "ringlog_dir": RINGLOG_DIR,
+        "ringlog_records": RINGLOG_RECORDS,
+        "record_interval": RECORD_INTERVAL,
+    }
+    sensors = [names[TOPIC_SENSOR1], names[TOPIC_SENSOR2]]
+    pipeline = Pipeline(config, {sensors[0]: 3, sensors[1]: 3, "freq": 1}, RECORD_RING, VIEW_RING)
+    pipeline.start()
+
+    # ===============================
+    # Plot setup
+    # ===============================
+    # ±2 g until the sensors' profiles tell their range
+    limit = 1.1 * GRAVITY_MS2 * 2
+    live = LiveFigure([
+        {"ylabel": f"Accel {name} (m/s²)", "ylim": (-limit, limit), "lines": [('X', 'r'), ('Y', 'g'), ('Z', 'b')]}
+        for name in sensors
+    ] + [
+        {"ylabel": "Freq (Hz)", "ylim": (0, 200), "lines": [('Frequency (Hz)', 'm')]},
+    ], MAX_POINTS, decimate=DECIMATE)
+    spectral = SpectralStage(FFT_SEGMENT, 0.5, FFT_SEGMENTS)
+    views = [pipeline.view(name) for name in sensors + ["freq"]]
+    state = {"last_freq": None, "last_stats": time.monotonic()}
+
+    def spectral_status():
+        parts = []
+        for name in sensors:
+            r = spectral.latest(name)
+            if r is not None:
+                axis = int(np.argmax(r["rms"]))
+                parts.append(f"{name}: peak {r['dominant_hz'][axis]:.1f} Hz ({'xyz'[axis]}), "
+                             f"rms {np.round(r['rms'], 2).tolist()}")
+        if parts and state["last_freq"] is not None:
+            parts.append(f"edges: {state['last_freq']:.1f} Hz")
+        return "   ".join(parts)
+
+    # ===============================
+    # Update function
+    # ===============================
+    def update():
+        for name, profile in pipeline.new_profiles():
+            if name in sensors:
+                limit = 1.1 * GRAVITY_MS2 * profile.get("accel_range_g", 2)
+                live.set_ylim(sensors.index(name), -limit, limit)
+        start = time.perf_counter()
+        samples = 0
+        for ix, view in enumerate(views):
+            t, values = view.read()
+            if not len(t):
+                continue
+            samples += len(t)
+            live.extend(ix, values)
+            live.set_active(ix, True)
+            if ix < len(sensors):
+                spectral.add(sensors[ix], t, values)
+            else:
+                state["last_freq"] = values[-1, 0]
+        if spectral.process():
+            live.set_status(spectral_status())
+        if samples:
+            pipeline.metrics.add("view", 1, samples, time.perf_counter() - start)
+
+        if time.monotonic() - state["last_stats"] >= STATS_INTERVAL:
+            print_report(*pipeline.report())
+            state["last_stats"] = time.monotonic()
+
+    # ===============================
+    # Start animation
+    # ===============================
+    timer = live.start(update, interval=100)
+    plt.tight_layout()
+    try:
+        plt.show()
+    finally:
+        print_report(*pipeline.report())
+        pipeline.close()
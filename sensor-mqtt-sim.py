@@ -1,78 +1,196 @@
+"""
+Load generator: simulated kits publishing like sensor-mqtt.py.
+
+Every simulated sensor sends batches of --batch samples at --rate samples/s
+on Sensor/<kit>/<sensor> (binary Codec v1 or the legacy JSON), and every kit
+its shaft frequency on Sensor/<kit>/Frequency at 10 Hz. The samples come
+from Vibration.VibrationSignal, seeded per sensor from --seed, so a run is
+reproducible. Sensors are spread over --processes publisher processes with
+one MQTT connection each. Payloads carry the acquire/publish stamps and the
+kits answer the host's clock pings like sensor-mqtt.py (Metrics.py).
+
+Prints the achieved message, sample and byte rates against the offered ones
+every --report seconds and at the end, and how far publishing fell behind
+its schedule.
+
+    python sensor-mqtt-sim.py --broker 127.0.0.1 [--sensors 2] [--kits 1] [--rate 500] [--batch 10]
+                              [--format binary] [--seconds 0] [--seed 1] [--processes 1]
+
+Without --broker it runs on the Pi like before: it waits for the client
+of the access point that runs the broker (Discovery.py) and publishes to it.
+"""
+import argparse
 import json
-import random
+import multiprocessing as mp
 import time
-import subprocess
-import re
-import paho.mqtt.client as mqtt
-
-# ----------- Detect the single connected client -----------
-def get_single_client_ip():
-    """Return the IP of the single client connected to wlan0."""
-    # Get MAC addresses using iw
-    try:
-        iw_output = subprocess.check_output(["iw", "dev", "wlan0", "station", "dump"], text=True)
-        macs = re.findall(r"Station ([0-9a-f:]{17})", iw_output)
-        if not macs:
-            return None
-        mac = macs[0]  # pick the first (and only) client
-    except subprocess.CalledProcessError:
-        return None
-
-    # Map MAC to IP using arp
-    try:
-        arp_output = subprocess.check_output(["arp", "-n"], text=True)
-        ip_map = {}
-        for line in arp_output.splitlines():
-            parts = line.split()
-            if len(parts) >= 3:
-                ip_addr, _, mac_addr = parts[0], parts[1], parts[2]
-                ip_map[mac_addr.lower()] = ip_addr
-        return ip_map.get(mac.lower())
-    except subprocess.CalledProcessError:
-        return None
+import numpy as np
 
-# Wait until a client connects
-broker_ip = None
-print("Waiting for a client to connect to the Pi AP...")
-while broker_ip is None:
-    broker_ip = get_single_client_ip()
-    time.sleep(1)
+import Channels
+import Codec
+import Metrics
+from Acquisition import GRAVITY_MS2
+from Discovery import Discovery
+from Vibration import VibrationSignal
 
-print(f"Detected client IP: {broker_ip}")
+FIELDS = ("messages", "samples", "bytes", "lag_s", "elapsed_s")
+FREQ_INTERVAL = 0.1     # seconds between frequency messages per kit
+COUNTS_PER_G = 2048     # +-16 g range, like the kit
 
-# ----------- MQTT Setup -----------
-topic = "sensors/accel"
 
+# ===============================
+# Simulated sensors
+# ===============================
+def layout(args):
+    """(kit, sensor name, seed) of every simulated sensor, named like the kit names its MPU6050s."""
+    kits = [f"{args.kit}{k:02d}" if args.kits > 1 else args.kit for k in range(args.kits)]
+    per_kit = -(-args.sensors // args.kits)
+    return [(kits[i // per_kit], f"s{104 + i % per_kit}", args.seed * 1000 + i) for i in range(args.sensors)]
 
-client = mqtt.Client(client_id="sim_accel_pub", callback_api_version=1)
 
-retry_delay = 5  # seconds between retries
+def kit_owners(sensors):
+    """The first sensor of each kit also does the kit's frequency input and clock answers."""
+    owners = {}
+    for i, (kit, _, _) in enumerate(sensors):
+        owners.setdefault(kit, i)
+    return set(owners.values())
+
+
+def publisher(index, sensors, owners, args, broker, counters, stop):
+    """Publish the given sensors on schedule until stop is set or --seconds have passed."""
+    import paho.mqtt.client as mqtt
+
+    signals = [VibrationSignal(seed, args.rate) for _, _, seed in sensors]
+    topics = [Channels.topic(kit, name) for kit, name, _ in sensors]
+    freq = {Channels.topic(kit, Channels.FREQ_TOPIC): signal
+            for (kit, _, _), signal, owner in zip(sensors, signals, owners) if owner}
+    kits = [kit for (kit, _, _), owner in zip(sensors, owners) if owner]
+
+    def answer_ping(client, userdata, msg):
+        received = time.time_ns()
+        for kit in kits:
+            client.publish(Metrics.pong_topic(kit), Metrics.pong_payload(msg.payload, received))
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"sim-load-{index}")
+    client.on_connect = lambda client, userdata, flags, reason, properties: client.subscribe(Metrics.PING_TOPIC)
+    client.message_callback_add(Metrics.PING_TOPIC, answer_ping)
+    client.connect(broker, args.port, 60)
+    client.loop_start()
+
+    row = np.frombuffer(counters, dtype=np.float64).reshape(-1, len(FIELDS))[index]
+    period = 1e9 / args.rate
+    interval = args.batch / args.rate
+    scale = GRAVITY_MS2 / COUNTS_PER_G
+    start, start_ns = time.perf_counter(), time.time_ns()
+    batch, next_freq = 0, 0.0
+    offsets = np.arange(args.batch)
+
+    while not stop.is_set() and (not args.seconds or batch * interval < args.seconds):
+        due = start + batch * interval
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            row[3] = max(row[3], -delay)
+        # Sensor timeline: evenly spaced samples up to now, like a FIFO read
+        k = batch * args.batch + offsets
+        t = start_ns + np.rint((k + 1 - args.batch) * period).astype(np.int64)
+        acquired = time.time_ns() if args.stamps else None
+        for topic, (_, name, _), signal in zip(topics, sensors, signals):
+            counts = signal.counts(k / args.rate, COUNTS_PER_G)
+            if args.format == "json":
+                payload = Codec.encode_json(time.time_ns(), t.tolist(), counts * scale, acquired=acquired)
+            else:
+                payload = Codec.encode_binary(name, int(t[0]), period, counts, scale, acquired)
+            client.publish(topic, payload, qos=args.qos)
+            row[0] += 1
+            row[1] += args.batch
+            row[2] += len(payload)
+        if batch * interval >= next_freq:
+            for topic, signal in freq.items():
+                payload = json.dumps({"timestamp": time.time_ns(), "frequency_hz": round(signal.frequency, 2)})
+                client.publish(topic, payload, qos=args.qos)
+                row[0] += 1
+                row[2] += len(payload)
+            next_freq += FREQ_INTERVAL
+        batch += 1
+        row[4] = time.perf_counter() - start
 
-while True:
-    try:
-        client.connect(broker_ip, 1883, 60)
-        print(f"Connected to MQTT broker at {broker_ip}")
-        break  # exit loop if successful
-    except TimeoutError:
-        time.sleep(retry_delay)
-
-client.loop_start()
-print(f"Publishing accelerometer data to {broker_ip}...")
-
-# ----------- Simulated accelerometer loop -----------
-try:
-    while True:
-        data = {
-            "x": round(random.uniform(-1, 1), 3),
-            "y": round(random.uniform(-1, 1), 3),
-            "z": round(random.uniform(-1, 1), 3)
-        }
-        payload = json.dumps(data)
-        client.publish(topic, payload)
-        print(f"Published: {payload}")
-        time.sleep(0.001)
-
-except KeyboardInterrupt:
-    print("\nStopping publisher...")
     client.loop_stop()
     client.disconnect()
+
+
+# ===============================
+# Reporting
+# ===============================
+def totals(rows):
+    """Counts summed over the publishers, the largest lag and run time."""
+    return np.concatenate((rows[:, :3].sum(axis=0), rows[:, 3:].max(axis=0)))
+
+
+def report(label, elapsed, totals, offered):
+    messages, samples, size, lag = totals[:4]
+    if elapsed <= 0:
+        return
+    print(f"{label}: {messages / elapsed:8.0f} msg/s  {samples / elapsed:9.0f} samples/s "
+          f"({samples / elapsed / offered:6.1%} of {offered:.0f})  {size / elapsed / 1e3:8.1f} kB/s  "
+          f"max behind schedule {lag * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", help="broker address; default: the client of the Pi's access point")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--sensors", type=int, default=2)
+    parser.add_argument("--kits", type=int, default=1, help="kits the sensors are spread over")
+    parser.add_argument("--kit", default="sim", help="kit id, numbered when there are several; '' for Sensor/<sensor>")
+    parser.add_argument("--rate", type=float, default=500, help="samples/s per sensor")
+    parser.add_argument("--batch", type=int, default=10, help="samples per message")
+    parser.add_argument("--format", choices=("binary", "json"), default="binary")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--no-stamps", dest="stamps", action="store_false",
+                        help="unstamped payloads (Codec version 1) for hosts without latency metrics")
+    parser.add_argument("--seconds", type=float, default=0, help="run time, 0 until Ctrl+C")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=1, help="publisher processes")
+    parser.add_argument("--report", type=float, default=5.0, help="seconds between rate printouts")
+    args = parser.parse_args()
+
+    broker = args.broker
+    if broker is None:
+        print("Waiting for a client to connect to the Pi AP...")
+        broker = Discovery(port=args.port).find()
+        print(f"Detected client IP: {broker}")
+
+    sensors = layout(args)
+    first = kit_owners(sensors)
+    owners = [i in first for i in range(len(sensors))]
+    offered = args.sensors * args.rate
+    print(f"{args.sensors} sensors on {len({kit for kit, _, _ in sensors})} kits, {args.rate:.0f} samples/s each "
+          f"in batches of {args.batch} ({args.format}), publishing to {broker}:{args.port}")
+
+    counters = mp.Array("d", args.processes * len(FIELDS), lock=False)
+    rows = np.frombuffer(counters, dtype=np.float64).reshape(args.processes, len(FIELDS))
+    stop = mp.Event()
+    processes = [mp.Process(target=publisher, name=f"sim-{i}",
+                            args=(i, sensors[i::args.processes], owners[i::args.processes], args, broker,
+                                  counters, stop))
+                 for i in range(args.processes)]
+    for p in processes:
+        p.start()
+
+    # Rates over the publishers' own run time, without process start-up
+    last = np.zeros(len(FIELDS))
+    try:
+        while any(p.is_alive() for p in processes):
+            time.sleep(min(0.2, args.report))
+            now = totals(rows)
+            if now[4] - last[4] >= args.report:
+                report(f"{now[4]:6.0f} s", now[4] - last[4], now - np.append(last[:3], [0, 0]), offered)
+                last = now
+    except KeyboardInterrupt:
+        print("\nStopping publisher...")
+    stop.set()
+    for p in processes:
+        p.join()
+    now = totals(rows)
+    report(" total", now[4], now, offered)
@@ -1,206 +1,85 @@
-import json
-import random
-import time
-import subprocess
-import re
-import paho.mqtt.client as mqtt
-from gpiozero import RGBLED, Button
-from gpiozero import DigitalInputDevice
-
-from time import sleep
 from Functions import *
-from mpu6050 import mpu6050
-import time
-
-
-
-
-# Define RGB LED pins (change as needed)
-led = RGBLED(red=13, green=19, blue=6)
-button1 = Button(10,pull_up=False)
-button2 = Button(9,pull_up=False)
-freq_pin = DigitalInputDevice(21)
-
-
-last_edge_time = None
-frequency = 0.0
-
-
-def on_rising_edge():
-    global last_edge_time, frequency
-    now = time.time()
-    if last_edge_time is not None:
-        period = now - last_edge_time
-        if period > 0:
-            frequency = 1.0 / period
-    last_edge_time = now
-
-freq_pin.when_activated = on_rising_edge
-
-def connectHW():
-
-    addresses = [0x69, 0x68]
-    connected = False
-    sensors = []
-    dataarray = []
-    names = []
-
-    while not connected:
-        for addr in addresses:
-            try:
-                sensor = mpu6050(addr)
-                sensors.append(sensor)
-                name = "s"+str(addr)
-                names.append(name)
-                dataarray.append([])
-                print(f"Connected to MPU6050 at 0x{addr:02X}")
-                connected = True
-            except (TimeoutError, OSError) as e:
-                print(f"No response from 0x{addr:02X}: {e}")
-        if not connected:
-            time.sleep(1)
-    
-    return sensors,dataarray,names
-
-def connectHost():
-
-    broker_ip = None
-    print("Waiting for a client to connect to the Pi AP...")
-    while broker_ip is None:
-        broker_ip = get_single_client_ip()
-        time.sleep(1)
-
-    print(f"Detected client IP: {broker_ip}")
-    return broker_ip
-
-def connectBroker(broker_ip="127.0.0.1"):
-
-    
-    client = mqtt.Client(client_id="sim_accel_pub", callback_api_version=1)
-
-    retry_delay = 5  # seconds between retries
-
-    while True:
-        try:
-            client.connect(broker_ip, 1883, 60)
-            print(f"Connected to MQTT broker at {broker_ip}")
-            break  # exit loop if successful
-        except TimeoutError:
-            time.sleep(retry_delay)
-
-    client.loop_start()
-    print(f"Publishing accelerometer data to {broker_ip}...")
-    return client
-
-
-def measure(sensor,array):
-            # --- Sample accelerometer data ---
-            accel = sensor.get_accel_data()
-            # Store full reading with timestamp
-            array.append({
-                "t": time.time_ns(),
-                "x": round(accel["x"], 3),
-                "y": round(accel["y"], 3),
-                "z": round(accel["z"], 3)
-            })
-
-            
-
-    
-       
-
-
-last_publish = time.time()
+from Acquisition import profile
+from Frequency import FrequencyMeter
+from Spool import Spool
+from Discovery import Discovery, FakeBackend, ProcBackend
+from HAL import open_hal
+from Kit import Kit
+
+
+
+
+# Devices: "pi" for the kit's GPIO and I2C, "sim" for simulated ones on any machine (HAL.py)
+HAL = "pi"
+LED_PINS = (13, 19, 6)  # red, green, blue (change as needed)
+BUTTON_PINS = (10, 9)  # button1 starts and stops a run
+FREQ_PIN = 21
+I2C_BUS = 1
+SIM_TRACE = "Messdaten/Messung_11_11_15_34_29.csv"  # recording the simulated MPU6050s replay, "" for a synthetic signal
+SIM_SPEED = 1.0       # replay speed of SIM_TRACE
+SIM_PRESS = 1.0       # seconds until the simulated button1 is pressed, None to never start a run
+SIM_BROKER = "127.0.0.1"  # the host of a simulated kit
+
+# Acquisition settings
+ADDRESSES = [0x69, 0x68]  # MPU6050s on I2C bus 1
+PROFILE = profile("default")  # MPU6050 ODR, low-pass, ranges and channels (Acquisition.PROFILES), e.g. profile("motion", odr=100)
+POLL_INTERVAL = 0.02  # seconds between FIFO drains, must stay well below the FIFO fill time
+PUBLISH_TICK = 0.005  # seconds between checks for due batches
+MAX_BATCH_LATENCY = 0.02  # seconds the oldest sample may wait before its batch is published
+MAX_BATCH_SAMPLES = 500   # samples per message at most
+FREQ_INTERVAL = 0.1   # seconds between frequency publishes
+FREQ_BACKEND = "gpiod"  # "gpiod" (kernel edge timestamps), "gpiozero" (Python callback) or "sim", with HAL "pi"
+FREQ_CHIP = "/dev/gpiochip0"  # gpiochip4 on a Pi 5 with an older kernel
+FREQ_GATE = 0.5       # seconds of edges per frequency value
+BUFFER_SECONDS = 5    # ring buffer capacity per sensor
+STATS_INTERVAL = 5    # seconds between sampling and publish statistics printouts
+CALIBRATION_FILE = "calibration.json"  # per sensor calibration of calibrate-sensors.py, nominal without it
+PAYLOAD_FORMAT = "binary"  # "binary" (Codec v1, int16 counts) or "json" (legacy per-sample dicts)
+STAMP_PAYLOADS = True  # acquire/publish stamps for the host's latency metrics (Codec version 2)
+PROCESSING = "raw"    # "raw", "decimated", "features" or "both", see Processing.py
+DECIMATION = 4        # factor of "decimated" and "both", behind an anti-aliasing filter (500 Hz -> 125 Hz)
+FEATURE_WINDOW = 0.5  # seconds of raw samples per RMS/peak/crest factor window
+SPOOL_DIR = "spool"   # store-and-forward spool, messages wait here while the host is unreachable
+SPOOL_MAX_MB = 512    # disk space of the spool, the oldest unsent data goes beyond it
+FORWARD_WINDOW = 200  # spooled messages in flight to the broker (QoS 1)
+BROKER_CACHE = "broker-ip.json"  # last host found, tried first after a restart
+BROKER_PORT = 1883
+CONNECT_TIMEOUT = 2.0  # seconds the broker may take to accept a connection
+RECONNECT_MIN = 0.5   # seconds before paho reconnects a broken connection, doubling up to
+RECONNECT_MAX = 10.0  # this many seconds
+HOST_LOST = 15.0      # seconds without broker before the host is looked up at another address
+KIT_ID = get_kit_id()  # topics are Sensor/<KIT_ID>/<sensor>; "" publishes on the old Sensor/<sensor>
+
+
+hal = open_hal({
+    "hal": HAL, "led_pins": LED_PINS, "button_pins": BUTTON_PINS, "freq_backend": FREQ_BACKEND,
+    "freq_pin": FREQ_PIN, "freq_chip": FREQ_CHIP, "i2c_bus": I2C_BUS, "addresses": ADDRESSES, "odr": PROFILE["odr"],
+    "sim_trace": SIM_TRACE, "sim_speed": SIM_SPEED, "sim_press": SIM_PRESS,
+})
+freq_meter = FrequencyMeter(hal.edges, gate=FREQ_GATE)
+if HAL == "sim":
+    backend = FakeBackend()
+    backend.join(SIM_BROKER)
+    discovery = Discovery(backend, None)
+else:
+    discovery = Discovery(ProcBackend("wlan0"), BROKER_CACHE)
+spool = Spool(SPOOL_DIR, max_bytes=SPOOL_MAX_MB << 20)
+if spool.pending_bytes:
+    print(f"Spool: {spool.pending_bytes / 1e6:.1f} MB from an earlier run still to send")
+
+config = {
+    "kit_id": KIT_ID, "addresses": ADDRESSES, "profile": PROFILE, "poll_interval": POLL_INTERVAL,
+    "publish_tick": PUBLISH_TICK, "max_batch_latency": MAX_BATCH_LATENCY,
+    "max_batch_samples": MAX_BATCH_SAMPLES, "freq_interval": FREQ_INTERVAL,
+    "buffer_seconds": BUFFER_SECONDS, "stats_interval": STATS_INTERVAL,
+    "payload_format": PAYLOAD_FORMAT, "stamp_payloads": STAMP_PAYLOADS, "processing": PROCESSING,
+    "decimation": DECIMATION, "feature_window": FEATURE_WINDOW, "forward_window": FORWARD_WINDOW,
+    "port": BROKER_PORT, "connect_timeout": CONNECT_TIMEOUT, "reconnect_min": RECONNECT_MIN,
+    "reconnect_max": RECONNECT_MAX, "host_lost": HOST_LOST, "calibration": CALIBRATION_FILE,
+}
 
 
 # ------------ STATEMACHINE ---------------
-state = States.Default
-while True:
-    try:
-        match state:
-
-            case States.Default: #OFF
-                led.off()
-                time.sleep(1)
-                state = States.SettingUpHW
-        
-            case States.SettingUpHW: #RED
-                led.color = (1, 0, 0)
-                sensors,dataarray,names = connectHW()
-                state = States.ConnectingHost
-            
-            case States.ConnectingHost: #ORANGE
-                led.color = (1, 0.45, 0)
-                hostIP = connectHost()
-                state = States.ConnectingBroker
-            
-            case States.ConnectingBroker: #YELLOW
-                led.color = (1, 1, 0)
-                client = connectBroker(hostIP)
-                state = States.Idelling
-
-                down = False
-
-            case States.Idelling: #BLUE
-                led.color = (0, 0, 1)
-
-                if not button1.is_active:
-                    down=True
-                if button1.is_active and down:
-                    state = States.Preparing
-
-            case States.Preparing: #BLUE BLINK
-                led.blink(on_time=0.5, off_time=0.5, on_color=(0,0,1),n=5,background=False)
-                state = States.Running
-                
-
-            case States.Running: #GREEN
-                led.color = (0, 1, 0)
-
-
-
-                for ix,s in enumerate(sensors):
-                    measure(s,dataarray[ix])
-
-                now = time.time_ns(),
-                for ix,s in enumerate(sensors):
-                    topic = "Sensor/"+names[ix]
-
-                    payload = json.dumps({
-                        "timestamp": now,
-                        "samples": dataarray[ix],
-                    
-                    })
-                    client.publish(topic, payload)
-                    print(f"Published Sensor {names[ix]} data ({len(dataarray[ix])} points)")
-                    dataarray[ix] = []
-
-                if (time.time() - last_publish) >= 0.1:
-                    #FREQUENCY
-                    topic = "Sensor/Frequency"
-                    payload = json.dumps({
-                        "timestamp": now,
-                        "frequency_hz": round(frequency, 2)
-                    })
-                    client.publish(topic, payload)
-                    print(f"Published frequency: {frequency:.2f} Hz")
-                    # last_publish = time.time()
-
-
-                if not button1.is_active:
-                    client.loop_stop()
-                    client.disconnect()
-                    state = States.Idelling
-
-                
-
-
-
-
-    except Exception as e:
-        state = States.Default
-
-
-led.color = (0, 1, 0) #GREEN
-
-
+# Kit.py: the states, and what each error sets up again
+kit = Kit(config, hal.led, hal.buttons[0], hal.open_bus, freq_meter, discovery, spool)
+kit.run()